@@ -0,0 +1,856 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Batch operations on many files.
+
+:func:`import_csv` embeds AVM from a spreadsheet exported as CSV, with one row per file::
+
+	path,Title,Spectral.Band,Spatial.ReferenceValue
+	images/orion.jpg,Orion Nebula,Optical;Infrared,83.82;-5.39
+
+List values are separated by semicolons, as in the output of :meth:`libavm.AVMMeta.to_string`,
+and dates are written in ISO 8601 format.  All rows are parsed and validated before any file
+is touched; valid rows are then written by a pool of threads.  Each processed row is appended
+to a result log, which is also used to resume an interrupted import.
+
+:func:`propagate_avm` copies the AVM of a master image to its renditions, serializing the
+packet once and writing it to all renditions concurrently::
+
+	overrides = dict([(path, rendition_overrides(master_data, width, height))
+		for path, width, height in renditions])
+	propagate_avm('master.tif', overrides.keys(), overrides)
+
+:func:`run_job` applies a function to many files, e.g. a re-tagging job over an archive.
+Progress is recorded in a checkpoint journal so an interrupted job resumes where it stopped,
+and the files can be split into deterministic shards processed on different machines::
+
+	def retag( file_path ):
+		return avm_to_file(file_path, {'Publisher': 'ESO'})
+	
+	run_job(retag, file_paths, 'retag-3.journal', shard=3, num_shards=8, progress=report)
+
+Malformed files can make Exempi hang or crash the interpreter.  :class:`AVMSupervisedPool`
+runs each file in a worker process with a timeout, replaces workers which hang or die, and
+quarantines the files responsible so that later runs skip them.
+"""
+
+import os
+import csv
+import time
+import errno
+import libavm
+import select
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+	import libxmp
+except ImportError:
+	pass
+
+from libavm.specs import *
+from libavm.columnar import column_kind
+from libavm.serialize import parse_datetime
+from libavm.utils import avm_from_file, avm_obj_from_file, avm_to_file, xmp_to_file, XMPSession
+
+
+__all__ = ['import_csv', 'read_csv', 'parse_value', 'path_lock', 'propagate_avm', 'rendition_overrides', 'run_job', 'shard_of', 'AVMJournal', 'AVMJobProgress',
+	'AVMSupervisedPool', 'AVMQuarantine', 'supervised_read']
+
+
+LOG_COLUMNS = ['line', 'path', 'status', 'message']
+
+# Fixed set of locks shared by hash of the path, so that memory does not grow with the number
+# of files written
+_path_locks = [threading.Lock() for i in range(64)]
+
+def path_lock( file_path ):
+	"""
+	Returns the lock serializing writes to a file within this process.  Other files may share
+	the same lock, so at most one path lock should be held at a time.
+	
+	:return: threading.Lock
+	"""
+	return _path_locks[hash(os.path.abspath(file_path)) % len(_path_locks)]
+
+
+def _split( value ):
+	return [item.strip() for item in value.split(';')]
+
+def parse_value( avmdt, value ):
+	"""
+	Converts a CSV cell to the Python value expected by the data type.
+	
+	:param avmdt: AVM data type of the field
+	:param value: String
+	
+	:return: Object accepted by avmdt.set_data()
+	"""
+	kind = column_kind(avmdt)
+	if kind == 'date':
+		value = parse_datetime(value)
+		return value.date() if hasattr(value, 'date') else value
+	elif kind == 'datetime':
+		return parse_datetime(value)
+	elif kind == 'floatlist':
+		return [item != '-' and item or '' for item in _split(value)]
+	elif kind == 'datetimelist':
+		return [parse_datetime(item) for item in _split(value)]
+	elif kind in ('cvlist', 'stringlist'):
+		return _split(value)
+	return value
+
+def read_csv( stream, mapping=None, path_column='path', specs=SPECS_1_1 ):
+	"""
+	Parses and validates the rows of a CSV file.
+	
+	:param stream: File-like object with the CSV data, including a header row
+	:param mapping: Dictionary mapping column names to AVM fields.  By default columns named after an AVM field are imported.
+	:param path_column: Name of the column with the path of the file
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: List of (line number, path, AVM dictionary, list of errors) tuples
+	"""
+	reader = csv.reader(stream)
+	header = [column.strip() for column in reader.next()]
+	if path_column not in header:
+		raise ValueError("The CSV file has no '%s' column." % path_column)
+	if mapping is None:
+		mapping = dict([(column, column) for column in header if column in specs])
+	for column, field in mapping.items():
+		if field not in specs:
+			raise KeyError, "The key '%s' is not an AVM field" % field
+	
+	path_index = header.index(path_column)
+	columns = [(index, mapping[column]) for index, column in enumerate(header) if column in mapping]
+	
+	rows = []
+	for row in reader:
+		if not any(row):
+			continue
+		avm_dict = {}
+		errors = []
+		for index, field in columns:
+			value = index < len(row) and row[index].strip()
+			if not value:
+				continue
+			avmdt = specs[field]
+			try:
+				value = parse_value(avmdt, value)
+				avmdt.check_data(value)
+			except Exception, e:
+				errors.append('%s: %s' % (field, e))
+				continue
+			avm_dict[field] = value
+		
+		file_path = path_index < len(row) and row[path_index].strip()
+		if not file_path:
+			errors.append('%s: missing' % path_column)
+		rows.append((reader.line_num, file_path, avm_dict, errors))
+	return rows
+
+
+def _read_log( log_path ):
+	"""
+	:return: Set of (line, path) of the rows imported successfully
+	"""
+	done = set()
+	if not os.path.exists(log_path):
+		return done
+	with open(log_path, 'rb') as log:
+		for row in csv.DictReader(log):
+			if row.get('status') == 'ok':
+				done.add((int(row['line']), row['path']))
+	return done
+
+def _write_rows( task ):
+	full_path, rows, replace = task
+	results = []
+	with path_lock(full_path):
+		for line, file_path, avm_dict in rows:
+			if not os.path.exists(full_path):
+				results.append((line, file_path, 'failed', 'File not found'))
+				continue
+			try:
+				if avm_to_file(full_path, avm_dict, replace=replace):
+					results.append((line, file_path, 'ok', ''))
+				else:
+					results.append((line, file_path, 'failed', 'Unable to write XMP'))
+			except Exception, e:
+				results.append((line, file_path, 'failed', str(e)))
+	return results
+
+def import_csv( csv_path, mapping=None, path_column='path', log_path=None, resume=True, workers=4, replace=False, base_dir=None, specs=SPECS_1_1 ):
+	"""
+	Embeds the AVM of the rows of a CSV file into the files they name.
+	
+	Rows are validated before writing; invalid rows are logged and not written.  Rows for the
+	same file are written in order by a single task, and writes to a file are serialized with
+	path_lock().  Every row is appended to the log as soon as it is processed, so that a later
+	call with resume=True skips the rows already imported.
+	
+	:param csv_path: Path of the CSV file
+	:param mapping: Dictionary mapping column names to AVM fields, see read_csv()
+	:param path_column: Name of the column with the path of the file
+	:param log_path: Path of the result log, default to the CSV path with a '.log' suffix
+	:param resume: Boolean to skip rows logged as imported by a previous run
+	:param workers: Number of writer threads
+	:param replace: Boolean to replace the existing XMP of the files, see avm_to_file()
+	:param base_dir: Directory relative paths are resolved against, default to the directory of the CSV file
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: List of (line number, path, status, message) tuples for the rows processed, with status 'ok', 'failed' or 'invalid'
+	"""
+	if log_path is None:
+		log_path = csv_path + '.log'
+	if base_dir is None:
+		base_dir = os.path.dirname(os.path.abspath(csv_path))
+	
+	with open(csv_path, 'rb') as stream:
+		rows = read_csv(stream, mapping, path_column, specs)
+	
+	done = resume and _read_log(log_path) or set()
+	
+	results = []
+	tasks = {}
+	order = []
+	for line, file_path, avm_dict, errors in rows:
+		if (line, file_path) in done:
+			continue
+		if errors:
+			results.append((line, file_path, 'invalid', '; '.join(errors)))
+			continue
+		full_path = os.path.join(base_dir, file_path)
+		if full_path not in tasks:
+			tasks[full_path] = []
+			order.append(full_path)
+		tasks[full_path].append((line, file_path, avm_dict))
+	
+	new_log = not (resume and os.path.exists(log_path))
+	with open(log_path, new_log and 'wb' or 'ab') as log:
+		writer = csv.writer(log)
+		if new_log:
+			writer.writerow(LOG_COLUMNS)
+		
+		def record(result):
+			writer.writerow(result)
+			log.flush()
+		
+		for result in results:
+			record(result)
+		
+		if order:
+			pool = ThreadPool(max(1, min(workers, len(order))))
+			try:
+				for task_results in pool.imap_unordered(_write_rows, [(path, tasks[path], replace) for path in order]):
+					for result in task_results:
+						record(result)
+						results.append(result)
+			except:
+				# Drop the queued files rather than writing them without logging
+				pool.terminate()
+				pool.join()
+				raise
+			pool.close()
+			pool.join()
+	
+	return results
+
+
+def rendition_overrides( data, width, height ):
+	"""
+	Computes the spatial fields of a rendition of an image, resized to width x height pixels.
+	Spatial.Scale, Spatial.ReferencePixel and Spatial.ReferenceDimension are rescaled from
+	the values of the master image; the world coordinates are unchanged.
+	
+	:param data: AVM dictionary of the master image
+	:param width: Width of the rendition in pixels
+	:param height: Height of the rendition in pixels
+	
+	:return: AVM dictionary with the rescaled fields, empty if the master has no ReferenceDimension
+	"""
+	try:
+		factors = (float(width) / float(data['Spatial.ReferenceDimension'][0]), float(height) / float(data['Spatial.ReferenceDimension'][1]))
+	except (KeyError, IndexError, TypeError, ValueError, ZeroDivisionError):
+		return {}
+	
+	overrides = {'Spatial.ReferenceDimension': [str(width), str(height)]}
+	
+	def rescale(field, func):
+		try:
+			overrides[field] = [repr(func(float(value), factor)) for value, factor in zip(data[field], factors)]
+		except (KeyError, TypeError, ValueError):
+			pass
+	
+	rescale('Spatial.Scale', lambda scale, factor: scale / factor)
+	# Pixel coordinates are measured from the edge of the image, the first pixel centered on 1
+	rescale('Spatial.ReferencePixel', lambda pixel, factor: (pixel - 0.5) * factor + 0.5)
+	return overrides
+
+def _merge_xmp( file_path, source, fields, specs ):
+	"""
+	Copies AVM fields from an XMP packet into the XMP of a file, as is.
+	
+	:return: Boolean
+	"""
+	try:
+		session = XMPSession(file_path, open_forupdate=True)
+	except libxmp.XMPError:
+		return False
+	
+	with session:
+		xmp = session.get_xmp() or libxmp.XMPMeta()
+		for field in fields:
+			specs[field].copy_data(source, xmp)
+		return session.put_xmp(xmp)
+
+def _propagate( task ):
+	file_path, packet, fields, overrides, specs, replace = task
+	
+	xmp = libxmp.XMPMeta(xmp_str=packet)
+	if overrides:
+		for field, value in overrides.items():
+			try:
+				specs[field].set_data(xmp, value)
+			except Exception, e:
+				return (file_path, 'invalid', '%s: %s' % (field, e))
+	
+	if not os.path.exists(file_path):
+		return (file_path, 'failed', 'File not found')
+	
+	with path_lock(file_path):
+		try:
+			if replace:
+				written = xmp_to_file(file_path, xmp)
+			else:
+				# The master and the overrides are already validated
+				written = _merge_xmp(file_path, xmp, set(fields) | set(overrides or {}), specs)
+			if written:
+				return (file_path, 'ok', '')
+			return (file_path, 'failed', 'Unable to write XMP')
+		except Exception, e:
+			return (file_path, 'failed', str(e))
+
+def propagate_avm( master, targets, overrides=None, workers=4, replace=False ):
+	"""
+	Copies the AVM of a master image to its renditions.  The AVM fields of the master are
+	merged into the XMP of each rendition, which keeps its other properties (e.g. EXIF or
+	rights) and the AVM fields the master does not have.  With replace, the whole XMP packet
+	of the master replaces the XMP of the renditions instead.
+	
+	The master is read and validated once; the overrides of each target are validated before
+	it is written.  Targets are written concurrently by a pool of threads.
+	
+	:param master: Path to the master file, AVMMeta object or AVM dictionary
+	:param targets: List of paths to the renditions
+	:param overrides: Dictionary mapping target paths to AVM dictionaries of fields to override, e.g. from rendition_overrides()
+	:param workers: Number of writer threads
+	:param replace: Boolean to replace the XMP of the renditions by the packet of the master
+	
+	:return: List of (path, status, message) tuples in the order of targets, with status 'ok', 'failed' or 'invalid'
+	"""
+	if isinstance(master, libavm.AVMMeta):
+		avm = master
+	elif isinstance(master, dict):
+		avm = libavm.AVMMeta(avm_dict=master)
+	else:
+		avm = avm_obj_from_file(master)
+		if avm is None:
+			raise IOError("Unable to read the XMP of %s" % master)
+	
+	packet = avm.xmp.serialize_to_str()
+	overrides = overrides or {}
+	tasks = [(file_path, packet, avm.data.keys(), overrides.get(file_path), avm.specs, replace) for file_path in targets]
+	if not tasks:
+		return []
+	
+	pool = ThreadPool(max(1, min(workers, len(tasks))))
+	try:
+		return pool.map(_propagate, tasks)
+	finally:
+		pool.close()
+		pool.join()
+
+
+#
+# Checkpointed jobs
+#
+
+def shard_of( file_path, num_shards ):
+	"""
+	Assigns a file to one of num_shards shards.  The assignment only depends on the path, so
+	every machine splits a list of files the same way.
+	
+	:return: Integer between 0 and num_shards - 1
+	"""
+	if isinstance(file_path, unicode):
+		file_path = file_path.encode('utf-8')
+	return int(hashlib.md5(file_path).hexdigest()[:8], 16) % num_shards
+
+
+class AVMJournal( object ):
+	"""
+	Append-only journal of the files processed by a job, one line per file with its status.
+	Lines are flushed as they are recorded, and a line left incomplete by a crash is ignored
+	when the journal is read back.
+	
+	:param journal_path: Path of the journal file
+	"""
+	def __init__(self, journal_path):
+		self.journal_path = journal_path
+		self.statuses = {}
+		complete = True
+		if os.path.exists(journal_path):
+			with open(journal_path, 'rb') as journal:
+				for line in journal:
+					if not line.endswith('\n'):
+						complete = False
+						break
+					fields = line[:-1].split('\t', 1)
+					if len(fields) == 2:
+						# Messages hold no tabs, paths might
+						self.statuses[fields[1].rsplit('\t', 1)[0]] = fields[0]
+		self._file = open(journal_path, 'ab')
+		if not complete:
+			self._file.write('\n')
+		self._lock = threading.Lock()
+	
+	def done(self, retry_failed=True):
+		"""
+		:param retry_failed: Boolean to leave out the files which failed
+		
+		:return: Set of the paths already processed
+		"""
+		if retry_failed:
+			return set([file_path for file_path, status in self.statuses.iteritems() if status == 'ok'])
+		return set(self.statuses)
+	
+	def record(self, file_path, status, message=''):
+		"""
+		Appends the status of a file to the journal.
+		"""
+		if isinstance(file_path, unicode):
+			file_path = file_path.encode('utf-8')
+		message = ' '.join(str(message).split())
+		with self._lock:
+			self._file.write('%s\t%s\t%s\n' % (status, file_path, message))
+			self._file.flush()
+			self.statuses[file_path] = status
+	
+	def close(self):
+		self._file.close()
+
+
+class AVMJobProgress( object ):
+	"""
+	Progress of a job: counts of files processed, throughput and estimated time remaining.
+	"""
+	def __init__(self, total, skipped=0):
+		self.total = total
+		self.skipped = skipped
+		self.ok = 0
+		self.failed = 0
+		self.start = time.time()
+	
+	@property
+	def processed(self):
+		return self.ok + self.failed
+	
+	@property
+	def elapsed(self):
+		return time.time() - self.start
+	
+	@property
+	def rate(self):
+		"""
+		:return: Files processed per second
+		"""
+		elapsed = self.elapsed
+		if elapsed > 0:
+			return self.processed / elapsed
+		return 0.0
+	
+	@property
+	def eta(self):
+		"""
+		:return: Estimated seconds remaining, or None before the first file is processed
+		"""
+		rate = self.rate
+		if rate > 0:
+			return (self.total - self.processed) / rate
+		return None
+	
+	def __str__(self):
+		eta = self.eta
+		return '%d/%d files (%d failed, %d skipped), %.1f files/s, ETA %s' % (
+			self.processed, self.total, self.failed, self.skipped, self.rate,
+			eta is None and '-' or '%d:%02d:%02d' % (eta // 3600, eta % 3600 // 60, eta % 60),
+		)
+
+
+def _run( task ):
+	func, file_path = task
+	try:
+		if func(file_path):
+			return (file_path, 'ok', '')
+		return (file_path, 'failed', '')
+	except Exception, e:
+		return (file_path, 'failed', '%s: %s' % (e.__class__.__name__, e))
+
+def _supervised_results( results ):
+	for file_path, status, result in results:
+		if status == 'ok':
+			yield (file_path, result and 'ok' or 'failed', '')
+		else:
+			yield (file_path, status, result)
+
+def run_job( func, file_paths, journal_path, shard=0, num_shards=1, workers=4, retry_failed=True, progress=None, progress_interval=10.0, timeout=None, retries=1, quarantine=None ):
+	"""
+	Applies a function to files, recording the outcome of each file in a checkpoint journal.
+	Files already recorded as done in the journal are skipped, so an interrupted job can be
+	restarted with the same arguments.
+	
+	By default files are processed by threads.  When a timeout is given, they are processed by
+	an AVMSupervisedPool instead, which isolates hanging or crashing files; func must then be
+	defined at module level.
+	
+	:param func: Function called with the path of each file.  A true return value marks the file as done; a false value or an exception as failed.
+	:param file_paths: Iterable of file paths
+	:param journal_path: Path of the checkpoint journal, see AVMJournal
+	:param shard: Index of the shard of files to process, see shard_of()
+	:param num_shards: Number of shards the files are split into
+	:param workers: Number of threads or worker processes
+	:param retry_failed: Boolean to process again the files which failed in a previous run
+	:param progress: Function called with an AVMJobProgress every progress_interval seconds, and at the end of the job
+	:param progress_interval: Seconds between progress reports
+	:param timeout: Seconds a file may take in a supervised worker process, or None to use threads
+	:param retries: Number of times a file is retried after a timeout or crash, see AVMSupervisedPool
+	:param quarantine: AVMQuarantine or path of the quarantine list, see AVMSupervisedPool
+	
+	:return: AVMJobProgress
+	"""
+	journal = AVMJournal(journal_path)
+	try:
+		done = journal.done(retry_failed)
+		pending = []
+		skipped = 0
+		for file_path in file_paths:
+			if num_shards > 1 and shard_of(file_path, num_shards) != shard:
+				continue
+			if (isinstance(file_path, unicode) and file_path.encode('utf-8') or file_path) in done:
+				skipped += 1
+			else:
+				pending.append(file_path)
+		
+		job_progress = AVMJobProgress(len(pending), skipped)
+		last_report = time.time()
+		if pending:
+			if timeout is None:
+				pool = ThreadPool(max(1, min(workers, len(pending))))
+				results = pool.imap_unordered(_run, [(func, file_path) for file_path in pending])
+			else:
+				pool = AVMSupervisedPool(max(1, min(workers, len(pending))), timeout, retries, quarantine)
+				results = _supervised_results(pool.imap_unordered(func, pending))
+			try:
+				for file_path, status, message in results:
+					journal.record(file_path, status, message)
+					if status == 'ok':
+						job_progress.ok += 1
+					else:
+						job_progress.failed += 1
+					
+					if progress and time.time() - last_report >= progress_interval:
+						last_report = time.time()
+						progress(job_progress)
+			except:
+				# Drop the queued files rather than running them without journaling
+				if timeout is None:
+					pool.terminate()
+					pool.join()
+				else:
+					pool.close()
+				raise
+			pool.close()
+			if timeout is None:
+				pool.join()
+		
+		if progress:
+			progress(job_progress)
+		return job_progress
+	finally:
+		journal.close()
+
+
+#
+# Supervised worker processes
+#
+
+class AVMQuarantine( object ):
+	"""
+	Set of paths of files which made a worker hang or crash.  When a file path is given, the
+	set is loaded from it and new paths are appended to it, one per line.
+	
+	:param file_path: Path of the quarantine list, or None to keep it in memory only
+	"""
+	def __init__(self, file_path=None):
+		self.file_path = file_path
+		self.paths = set()
+		if file_path and os.path.exists(file_path):
+			with open(file_path, 'rb') as f:
+				self.paths.update([line.rstrip('\n') for line in f if line.strip()])
+	
+	def add(self, file_path):
+		if file_path in self.paths:
+			return
+		self.paths.add(file_path)
+		if self.file_path:
+			with open(self.file_path, 'ab') as f:
+				f.write('%s\n' % (isinstance(file_path, unicode) and file_path.encode('utf-8') or file_path))
+	
+	def __contains__(self, file_path):
+		return file_path in self.paths
+	
+	def __len__(self):
+		return len(self.paths)
+
+
+def _worker_main( connection ):
+	"""
+	Main loop of a supervised worker process: runs (func, file_path) tasks received from the
+	connection and sends back (status, result) tuples.
+	"""
+	while True:
+		try:
+			task = connection.recv()
+		except (EOFError, IOError):
+			break
+		if task is None:
+			break
+		
+		func, file_path = task
+		try:
+			result = ('ok', func(file_path))
+		except Exception, e:
+			result = ('failed', '%s: %s' % (e.__class__.__name__, e))
+		
+		try:
+			connection.send(result)
+		except (EOFError, IOError):
+			break
+		except Exception, e:
+			connection.send(('failed', 'Unable to return result: %s' % e))
+
+
+class _Worker( object ):
+	def __init__(self):
+		self.connection, child_connection = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=_worker_main, args=(child_connection,))
+		self.process.daemon = True
+		self.process.start()
+		child_connection.close()
+		self.task = None
+		self.started = None
+		self.count = 0
+	
+	def submit(self, func, task):
+		self.task = task
+		self.started = time.time()
+		self.connection.send((func, task[0]))
+	
+	def stop(self, kill=False):
+		if kill:
+			self.process.terminate()
+		else:
+			try:
+				self.connection.send(None)
+			except (EOFError, IOError):
+				pass
+		self.process.join(kill and 1.0 or 5.0)
+		if self.process.is_alive():
+			self.process.terminate()
+			self.process.join()
+		self.connection.close()
+
+
+class AVMSupervisedPool( object ):
+	"""
+	Pool of worker processes running one task at a time each, under supervision of the calling
+	process.  A task running longer than timeout has its worker killed; a worker which dies,
+	e.g. on a segmentation fault in Exempi, is replaced.  The file is then tried again on a
+	fresh worker up to retries times, and quarantined if it still fails.  Other workers keep
+	processing files meanwhile.
+	
+	Tasks raising an exception are reported as failed, but do not affect their worker and are
+	not retried.  Functions and results are pickled, so functions must be defined at module
+	level; AVMMeta objects can be returned.
+	
+	:param workers: Number of worker processes
+	:param timeout: Seconds a task may run, or None for no limit
+	:param retries: Number of times a file is retried after a timeout or crash
+	:param quarantine: AVMQuarantine, or path of the quarantine list
+	:param maxtasksperchild: Number of tasks after which a worker is replaced, or None
+	"""
+	def __init__(self, workers=4, timeout=60.0, retries=1, quarantine=None, maxtasksperchild=None):
+		if not isinstance(quarantine, AVMQuarantine):
+			quarantine = AVMQuarantine(quarantine)
+		self.quarantine = quarantine
+		self.timeout = timeout
+		self.retries = retries
+		self.maxtasksperchild = maxtasksperchild
+		self.num_workers = workers
+		self.workers = []
+		self.recycled = 0
+	
+	def _replace(self, worker, kill=False):
+		worker.stop(kill)
+		self.workers[self.workers.index(worker)] = _Worker()
+		self.recycled += 1
+	
+	def imap_unordered(self, func, file_paths):
+		"""
+		Applies func to every file, yielding results in completion order.
+		
+		:return: Iterator of (path, status, result) tuples.  status is 'ok' with the return value of func as result, or 'failed', 'timeout', 'crashed' or 'quarantined' with a message.
+		"""
+		if not self.workers:
+			self.workers = [_Worker() for i in range(self.num_workers)]
+		
+		file_paths = iter(file_paths)
+		retry = deque()
+		exhausted = False
+		
+		while True:
+			# Hand out tasks to idle workers, retries first
+			for i in range(len(self.workers)):
+				while self.workers[i].task is None:
+					if retry:
+						task = retry.popleft()
+					elif not exhausted:
+						try:
+							file_path = file_paths.next()
+						except StopIteration:
+							exhausted = True
+							break
+						if file_path in self.quarantine:
+							yield (file_path, 'quarantined', 'File is quarantined')
+							continue
+						task = (file_path, 0)
+					else:
+						break
+					try:
+						self.workers[i].submit(func, task)
+					except (EOFError, IOError, OSError):
+						# The worker died while idle: the task did not run, hand it to a new one
+						self._replace(self.workers[i], kill=True)
+						retry.appendleft(task)
+			
+			busy = [worker for worker in self.workers if worker.task is not None]
+			if not busy:
+				break
+			
+			wait = 1.0
+			if self.timeout is not None:
+				now = time.time()
+				wait = max(0.0, min([wait] + [worker.started + self.timeout - now for worker in busy]))
+			try:
+				readable = select.select([worker.connection for worker in busy], [], [], wait)[0]
+			except select.error, e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			
+			for worker in busy:
+				file_path, attempts = worker.task
+				error = None
+				if worker.connection in readable:
+					try:
+						status, result = worker.connection.recv()
+					except (EOFError, IOError):
+						error = ('crashed', 'Worker exited with code %s' % worker.process.exitcode)
+					else:
+						worker.task = None
+						worker.count += 1
+						if self.maxtasksperchild and worker.count >= self.maxtasksperchild:
+							self._replace(worker)
+						yield (file_path, status, result)
+						continue
+				elif not worker.process.is_alive():
+					error = ('crashed', 'Worker exited with code %s' % worker.process.exitcode)
+				elif self.timeout is not None and time.time() - worker.started > self.timeout:
+					error = ('timeout', 'No result after %s seconds' % self.timeout)
+				else:
+					continue
+				
+				self._replace(worker, kill=True)
+				if attempts < self.retries:
+					retry.append((file_path, attempts + 1))
+				else:
+					self.quarantine.add(file_path)
+					yield (file_path, error[0], error[1])
+	
+	def map(self, func, file_paths):
+		"""
+		:return: List of (path, status, result) tuples, see imap_unordered()
+		"""
+		return list(self.imap_unordered(func, file_paths))
+	
+	def close(self):
+		"""
+		Stops the worker processes.
+		"""
+		for worker in self.workers:
+			worker.stop(kill=worker.task is not None)
+		self.workers = []
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
+
+
+def supervised_read( file_paths, workers=4, timeout=60.0, retries=1, quarantine=None ):
+	"""
+	Reads the AVM of files with avm_from_file() in supervised worker processes.
+	
+	:return: Iterator of (path, status, AVM dictionary or message) tuples, see AVMSupervisedPool.imap_unordered()
+	"""
+	pool = AVMSupervisedPool(workers, timeout, retries, quarantine)
+	try:
+		for result in pool.imap_unordered(avm_from_file, file_paths):
+			yield result
+	finally:
+		pool.close()
@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Memory-mapped columnar storage for collections of AVM records.
+
+The file holds one column per AVM field, laid out as little endian fixed-width arrays
+(floats, timestamps, controlled vocabulary codes, list offsets) and byte heaps for strings.
+A reader maps the file with :mod:`mmap`, so opening a catalog costs nothing and worker
+processes reading the same file share the pages of the operating system's file cache.
+When NumPy is available, :meth:`AVMColumnReader.column` returns zero-copy arrays over the
+mapping.
+
+File layout::
+
+	'AVMCOL1\\0'	magic (8 bytes)
+	uint64			length of the header
+	header			JSON description of the columns and their sections
+	sections		arrays, each aligned on 8 bytes
+"""
+
+import os
+import sys
+import mmap
+import math
+import array
+import struct
+import calendar
+import datetime
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from dateutil import tz
+
+from libavm.specs import *
+from libavm.datatypes import AVMStringCV, AVMUnorderedList
+
+
+__all__ = ['AVMColumnWriter', 'AVMColumnReader', 'column_kind']
+
+
+MAGIC = 'AVMCOL1\0'
+
+# Section type -> (struct format, array typecode)
+SECTION_TYPES = {
+	'f8': ('d', 'd'),
+	'i4': ('i', 'i'),
+	'i2': ('h', 'h'),
+	'u1': ('B', 'B'),
+	'u8': ('Q', None),
+}
+
+# Marker for datetimes without timezone
+NAIVE = -32768
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def column_kind( avmdt ):
+	"""
+	Maps an AVM data type to the kind of column storing it.
+	
+	:return: One of 'float', 'date', 'datetime', 'cv', 'string', 'floatlist', 'datetimelist', 'cvlist' or 'stringlist'
+	"""
+	if isinstance(avmdt, AVMOrderedFloatList):
+		return 'floatlist'
+	if isinstance(avmdt, AVMDateTimeList):
+		return 'datetimelist'
+	if isinstance(avmdt, AVMOrderedListCV):
+		return 'cvlist'
+	if isinstance(avmdt, AVMUnorderedList):
+		return 'stringlist'
+	if isinstance(avmdt, AVMStringCV):
+		return 'cv'
+	if isinstance(avmdt, AVMFloat):
+		return 'float'
+	if isinstance(avmdt, AVMDateTime):
+		return 'datetime'
+	if isinstance(avmdt, AVMDate):
+		return 'date'
+	return 'string'
+
+# Column kind -> sections
+KIND_SECTIONS = {
+	'float': [('values', 'f8')],
+	'date': [('values', 'i4')],
+	'datetime': [('values', 'f8'), ('tz', 'i2')],
+	'cv': [('codes', 'u1')],
+	'string': [('offsets', 'u8'), ('heap', 'u1')],
+	'floatlist': [('offsets', 'u8'), ('values', 'f8')],
+	'datetimelist': [('offsets', 'u8'), ('values', 'f8'), ('tz', 'i2')],
+	'cvlist': [('offsets', 'u8'), ('codes', 'u1')],
+	'stringlist': [('offsets', 'u8'), ('items', 'u8'), ('heap', 'u1')],
+}
+
+
+def _encode_float( value ):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return float('nan')
+
+def encode_datetime( value ):
+	"""
+	:return: (UTC timestamp, timezone offset in minutes or NAIVE)
+	"""
+	if not isinstance(value, datetime.date):
+		return (float('nan'), NAIVE)
+	if not isinstance(value, datetime.datetime):
+		value = datetime.datetime(value.year, value.month, value.day)
+	
+	offset = value.utcoffset()
+	if offset is None:
+		minutes = NAIVE
+	else:
+		minutes = (offset.days * 86400 + offset.seconds) // 60
+	return (calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6, minutes)
+
+def decode_datetime( timestamp, minutes ):
+	"""
+	Inverse of encode_datetime()
+	
+	:return: Python datetime object, or None
+	"""
+	if math.isnan(timestamp):
+		return None
+	value = EPOCH + datetime.timedelta(seconds=timestamp)
+	if minutes == NAIVE:
+		return value
+	return (value + datetime.timedelta(minutes=minutes)).replace(tzinfo=tz.tzoffset(None, minutes * 60))
+
+def _decode_float( value ):
+	if math.isnan(value):
+		return None
+	return value
+
+
+class _Column( object ):
+	"""
+	In-memory buffers of a column being written.
+	"""
+	def __init__(self, name, kind, vocabulary=None):
+		self.name = name
+		self.kind = kind
+		self.vocabulary = list(vocabulary or [])
+		self.codes = dict([(value, i + 1) for i, value in enumerate(self.vocabulary)])
+		self.sections = {}
+		for section, section_type in KIND_SECTIONS[kind]:
+			typecode = SECTION_TYPES[section_type][1]
+			if section == 'heap':
+				self.sections[section] = bytearray()
+			elif typecode is None:
+				self.sections[section] = [0]
+			else:
+				self.sections[section] = array.array(typecode)
+	
+	def code(self, value):
+		"""
+		:return: Controlled vocabulary code of value (0 for no value).  Values outside the vocabulary are appended to it.
+		"""
+		if not value or value == '-':
+			return 0
+		if value not in self.codes:
+			if len(self.vocabulary) >= 255:
+				raise ValueError("Too many distinct values in column '%s'." % self.name)
+			self.vocabulary.append(value)
+			self.codes[value] = len(self.vocabulary)
+		return self.codes[value]
+	
+	def append_string(self, value):
+		heap = self.sections['heap']
+		if value:
+			if isinstance(value, unicode):
+				value = value.encode('utf-8')
+			heap.extend(value)
+		return len(heap)
+	
+	def append(self, value):
+		sections = self.sections
+		kind = self.kind
+		
+		if kind == 'float':
+			sections['values'].append(_encode_float(value))
+		elif kind == 'date':
+			if isinstance(value, datetime.date):
+				sections['values'].append(value.toordinal())
+			else:
+				sections['values'].append(0)
+		elif kind == 'datetime':
+			timestamp, minutes = encode_datetime(value)
+			sections['values'].append(timestamp)
+			sections['tz'].append(minutes)
+		elif kind == 'cv':
+			sections['codes'].append(self.code(value))
+		elif kind == 'string':
+			sections['offsets'].append(self.append_string(value))
+		else:
+			values = value or []
+			if kind == 'floatlist':
+				sections['values'].extend([_encode_float(item) for item in values])
+			elif kind == 'datetimelist':
+				for item in values:
+					timestamp, minutes = encode_datetime(item)
+					sections['values'].append(timestamp)
+					sections['tz'].append(minutes)
+			elif kind == 'cvlist':
+				sections['codes'].extend([self.code(item) for item in values])
+			elif kind == 'stringlist':
+				items = sections['items']
+				for item in values:
+					items.append(self.append_string(item))
+			sections['offsets'].append(sections['offsets'][-1] + len(values))
+	
+	def tostring(self, section):
+		"""
+		:return: Little endian bytes of a section
+		"""
+		values = self.sections[section]
+		if isinstance(values, bytearray):
+			return str(values)
+		if isinstance(values, list):
+			chunks = []
+			for i in range(0, len(values), 65536):
+				chunk = values[i:i + 65536]
+				chunks.append(struct.pack('<%dQ' % len(chunk), *chunk))
+			return ''.join(chunks)
+		if sys.byteorder != 'little':
+			values = array.array(values.typecode, values)
+			values.byteswap()
+		return values.tostring()
+
+
+class AVMColumnWriter( object ):
+	"""
+	Writes AVM records to a columnar file.  Columns are accumulated in compact arrays and
+	written out by close()::
+	
+		writer = AVMColumnWriter('catalog.avmc')
+		for file_path in file_paths:
+			writer.write(file_path, avm_from_file(file_path))
+		writer.close()
+	
+	:param file_path:	Path of the file to write
+	:param fields:		List of fields to store, default to all fields of the specification
+	:param specs:		AVM specification dictionary, default to SPECS_1_1
+	"""
+	def __init__(self, file_path, fields=None, specs=SPECS_1_1):
+		self.file_path = file_path
+		if fields is None:
+			fields = sorted(specs.keys())
+		self.fields = fields
+		self.num_rows = 0
+		
+		self.keys = _Column('_key', 'string')
+		self.columns = []
+		for field in fields:
+			avmdt = specs[field]
+			self.columns.append(_Column(field, column_kind(avmdt), getattr(avmdt, 'controlled_vocabulary', None)))
+	
+	def write(self, key, data):
+		"""
+		Appends a record.
+		
+		:param key: Record key, e.g. the file path
+		:param data: AVM dictionary
+		"""
+		self.keys.append(key)
+		for column in self.columns:
+			column.append(data.get(column.name))
+		self.num_rows += 1
+	
+	def close(self):
+		"""
+		Writes the file.  It is replaced atomically, so readers never see a partial file.
+		"""
+		header = {'num_rows': self.num_rows, 'columns': []}
+		chunks = []
+		offset = 0
+		
+		for column in [self.keys] + self.columns:
+			description = {'name': column.name, 'kind': column.kind, 'sections': {}}
+			if column.kind in ('cv', 'cvlist'):
+				description['vocabulary'] = column.vocabulary
+			
+			for section, section_type in KIND_SECTIONS[column.kind]:
+				data = column.tostring(section)
+				itemsize = struct.calcsize('<' + SECTION_TYPES[section_type][0])
+				description['sections'][section] = [section_type, offset, len(data) // itemsize]
+				
+				chunks.append(data)
+				padding = -len(data) % 8
+				chunks.append('\0' * padding)
+				offset += len(data) + padding
+			header['columns'].append(description)
+		
+		header = json.dumps(header)
+		header += ' ' * (-(len(header) + 16) % 8)
+		
+		tmp_path = '%s.tmp' % self.file_path
+		f = open(tmp_path, 'wb')
+		try:
+			f.write(MAGIC)
+			f.write(struct.pack('<Q', len(header)))
+			f.write(header)
+			for chunk in chunks:
+				f.write(chunk)
+		finally:
+			f.close()
+		os.rename(tmp_path, self.file_path)
+
+
+class AVMColumnReader( object ):
+	"""
+	Reads a columnar file written by AVMColumnWriter through a read-only memory map.  Records
+	are decoded on access only::
+	
+		reader = AVMColumnReader('catalog.avmc')
+		reader[0]							# AVM dictionary of the first record
+		reader.get(0, 'Spatial.Scale')		# A single value
+		reader.column('Spatial.Rotation')	# NumPy array (zero-copy)
+	
+	Floats are decoded as Python floats, and missing entries of lists as None.
+	
+	:param file_path: Path of the file to read
+	"""
+	def __init__(self, file_path):
+		self.file_path = file_path
+		f = open(file_path, 'rb')
+		try:
+			self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+		
+		if self.mmap[:8] != MAGIC:
+			self.mmap.close()
+			raise ValueError("%s is not an AVM columnar file." % file_path)
+		
+		header_length = struct.unpack_from('<Q', self.mmap, 8)[0]
+		header = json.loads(self.mmap[16:16 + header_length])
+		data_offset = 16 + header_length
+		
+		self.num_rows = header['num_rows']
+		self.columns = {}
+		self.fields = []
+		for description in header['columns']:
+			name = str(description['name'])
+			sections = {}
+			for section, (section_type, offset, count) in description['sections'].iteritems():
+				sections[str(section)] = (str(section_type), data_offset + offset, count)
+			description['sections'] = sections
+			if 'vocabulary' in description:
+				description['vocabulary'] = [value.encode('utf-8') for value in description['vocabulary']]
+			self.columns[name] = description
+			if name != '_key':
+				self.fields.append(name)
+	
+	def close(self):
+		self.mmap.close()
+	
+	def __len__(self):
+		return self.num_rows
+	
+	def _read(self, column, section, start, count=1):
+		section_type, offset, length = column['sections'][section]
+		fmt = SECTION_TYPES[section_type][0]
+		itemsize = struct.calcsize('<' + fmt)
+		return struct.unpack_from('<%d%s' % (count, fmt), self.mmap, offset + start * itemsize)
+	
+	def _bytes(self, column, start, end):
+		offset = column['sections']['heap'][1]
+		return self.mmap[offset + start:offset + end]
+	
+	def _range(self, column, row):
+		return self._read(column, 'offsets', row, 2)
+	
+	def get(self, row, field):
+		"""
+		:return: Value of a field in a row, or None
+		"""
+		if row < 0:
+			row += self.num_rows
+		if not 0 <= row < self.num_rows:
+			raise IndexError("Row out of range.")
+		if field not in self.columns:
+			raise KeyError, "The key '%s' is not stored" % field
+		
+		column = self.columns[field]
+		kind = column['kind']
+		
+		if kind == 'float':
+			return _decode_float(self._read(column, 'values', row)[0])
+		elif kind == 'date':
+			ordinal = self._read(column, 'values', row)[0]
+			if ordinal:
+				return datetime.date.fromordinal(ordinal)
+			return None
+		elif kind == 'datetime':
+			return decode_datetime(self._read(column, 'values', row)[0], self._read(column, 'tz', row)[0])
+		elif kind == 'cv':
+			code = self._read(column, 'codes', row)[0]
+			if code:
+				return column['vocabulary'][code - 1]
+			return None
+		elif kind == 'string':
+			start, end = self._range(column, row)
+			if start == end:
+				return None
+			return self._bytes(column, start, end)
+		
+		start, end = self._range(column, row)
+		if start == end:
+			return None
+		count = end - start
+		
+		if kind == 'floatlist':
+			return [_decode_float(value) for value in self._read(column, 'values', start, count)]
+		elif kind == 'datetimelist':
+			timestamps = self._read(column, 'values', start, count)
+			minutes = self._read(column, 'tz', start, count)
+			return [decode_datetime(timestamps[i], minutes[i]) for i in range(count)]
+		elif kind == 'cvlist':
+			vocabulary = column['vocabulary']
+			return [code and vocabulary[code - 1] or None for code in self._read(column, 'codes', start, count)]
+		elif kind == 'stringlist':
+			offsets = self._read(column, 'items', start, count + 1)
+			return [self._bytes(column, offsets[i], offsets[i + 1]) for i in range(count)]
+	
+	def key(self, row):
+		"""
+		:return: Record key of a row
+		"""
+		return self.get(row, '_key')
+	
+	def keys(self):
+		"""
+		:return: List of record keys
+		"""
+		return [self.key(row) for row in range(self.num_rows)]
+	
+	def __getitem__(self, row):
+		"""
+		:return: AVM dictionary of a row, without the missing fields
+		"""
+		data = {}
+		for field in self.fields:
+			value = self.get(row, field)
+			if value is not None:
+				data[field] = value
+		return data
+	
+	def __iter__(self):
+		for row in range(self.num_rows):
+			yield self[row]
+	
+	def column(self, field):
+		"""
+		Zero-copy NumPy views of the sections of a column, e.g. ``values`` for float columns,
+		``codes`` for controlled vocabulary columns, or ``offsets`` and ``values`` for float
+		lists.  Requires NumPy.
+		
+		:return: Dictionary of section name to NumPy array
+		"""
+		if numpy is None:
+			raise ImportError("AVMColumnReader.column() requires NumPy.")
+		if field not in self.columns:
+			raise KeyError, "The key '%s' is not stored" % field
+		
+		arrays = {}
+		for section, (section_type, offset, count) in self.columns[field]['sections'].iteritems():
+			arrays[section] = numpy.frombuffer(self.mmap, dtype='<' + section_type, count=count, offset=offset)
+		return arrays
+	
+	def vocabulary(self, field):
+		"""
+		:return: List of values of a controlled vocabulary column; code n stands for entry n - 1
+		"""
+		return self.columns[field]['vocabulary']
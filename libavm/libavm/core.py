@@ -40,9 +40,116 @@ except ImportError:
 
 from libavm.specs import *
 import datetime
+import threading
 
 
-__all__ = ['AVMMeta']
+__all__ = ['AVMMeta', 'XMPMetaPool', 'to_rows', 'xmp_stats']
+
+
+#
+# XMPMeta allocation
+#
+
+_xmp_counts = {'allocated': 0, 'reused': 0, 'released': 0, 'discarded': 0}
+_xmp_lock = threading.Lock()
+_namespaces_registered = False
+# Packet of an empty XMPMeta object, parsed to clear pooled objects
+_empty_packet = None
+
+def _register_namespaces( xmp ):
+	"""
+	Registers the AVM schemas.  The namespace registry of the XMP Toolkit is global, so this is
+	done only once per process.
+	"""
+	global _namespaces_registered
+	if _namespaces_registered:
+		return
+	with _xmp_lock:
+		if not _namespaces_registered:
+			for SCHEMA, PREFIX in AVM_SCHEMAS.items():
+				xmp.register_namespace(SCHEMA, PREFIX)
+			_namespaces_registered = True
+
+def _new_xmp( **kwargs ):
+	"""
+	:return: New XMPMeta object, counted in xmp_stats()
+	"""
+	xmp = libxmp.XMPMeta(**kwargs)
+	with _xmp_lock:
+		_xmp_counts['allocated'] += 1
+	_register_namespaces(xmp)
+	return xmp
+
+def xmp_stats():
+	"""
+	:return: Dictionary with the number of XMPMeta objects allocated by the library, taken from an XMPMetaPool instead, released to a pool, and discarded by full pools
+	"""
+	with _xmp_lock:
+		return dict(_xmp_counts)
+
+
+class XMPMetaPool(object):
+	"""
+	Bounded pool of empty XMPMeta objects, to avoid allocating a new native object for every
+	AVMMeta in tight loops.  Pooled objects are cleared when released::
+	
+		pool = XMPMetaPool()
+		for avm_dict in records:
+			with AVMMeta(avm_dict=avm_dict, pool=pool) as avm:
+				packets.append(avm.xmp.serialize_to_str())
+	
+	:param maxsize: Maximum number of idle XMPMeta objects kept
+	"""
+	def __init__(self, maxsize=16):
+		self.maxsize = maxsize
+		self.idle = []
+		self.lock = threading.Lock()
+	
+	def __len__(self):
+		return len(self.idle)
+	
+	def acquire(self):
+		"""
+		:return: An empty XMPMeta object, from the pool if possible
+		"""
+		with self.lock:
+			xmp = self.idle.pop() if self.idle else None
+		if xmp is None:
+			return _new_xmp()
+		with _xmp_lock:
+			_xmp_counts['reused'] += 1
+		return xmp
+	
+	def release(self, xmp):
+		"""
+		Clears an XMPMeta object and returns it to the pool.  The object must not be used by the
+		caller afterwards.
+		
+		:param xmp: XMPMeta object, e.g. from acquire()
+		"""
+		global _empty_packet
+		if _empty_packet is None:
+			# Parsing the packet of an empty object replaces all properties.  Not counted as an
+			# allocation, since it happens once per process.
+			_empty_packet = libxmp.XMPMeta().serialize_to_str()
+		try:
+			xmp.parse_from_str(_empty_packet)
+		except libxmp.XMPError:
+			counter = 'discarded'
+		else:
+			with self.lock:
+				if len(self.idle) < self.maxsize:
+					self.idle.append(xmp)
+					counter = 'released'
+				else:
+					counter = 'discarded'
+		with _xmp_lock:
+			_xmp_counts[counter] += 1
+	
+	def clear(self):
+		""" Drops the idle XMPMeta objects """
+		with self.lock:
+			self.idle = []
 
 
 class AVMMeta(object):
@@ -50,36 +157,60 @@ class AVMMeta(object):
 	AVMMeta is a class offering direct access and validation of AVM metadata.  An AVM dictionary
 	or XMPMeta object may be passed to the constructor.  Priority will be given to the AVM dictionary.
 	
+	AVMMeta objects can be pickled, e.g. to return them from process pool workers.  Depending on
+	their ``pickle_format`` either the serialized XMP packet is shipped ('packet', which preserves
+	non-AVM properties) or a tuple of the AVM values in specification order ('fields', more
+	compact and faster to restore).  Unpickled objects keep the format they were pickled with.  Unpickled objects parse the packet or rebuild the XMP
+	lazily, on first access to ``data`` or ``xmp``.
+	
+	AVMMeta objects may be shared between threads: item access, to_string() and lazy
+	restoration are serialized by a reentrant lock, so concurrent readers see consistent data.
+	
+	A passed XMPMeta object is used as is.  Otherwise a new one is allocated, or taken from an
+	XMPMetaPool; release() or the end of a with block returns it to the pool.
+	
 	:param avm_dict:	Python dictionary containing AVM
 	:param xmp: 	XMPMeta object
-	:param version:	AVM version, default to the current (1.1)
+	:param version:	AVM version, "1.1" (default) or "1.2"
+	:param pool:	XMPMetaPool used when no XMPMeta object is passed
+	:param pickle_format:	'packet' (default) or 'fields'
 	"""
-	def __init__(self, avm_dict=None, xmp=None, version="1.1"):
+	def __init__(self, avm_dict=None, xmp=None, version="1.1", pool=None, pickle_format='packet'):
+		if pickle_format not in ('packet', 'fields'):
+			raise ValueError("Unsupported pickle format '%s'." % pickle_format)
+		self.version = version
+		self.pickle_format = pickle_format
+		self._pending = None
+		self._pool = None
+		self._lock = threading.RLock()
+		
 		# Dictionary storage for AVM, synchronizes with the XMP packet
 		self.data = {}
-		# Create an XMPMeta object
-		self.xmp = libxmp.XMPMeta()
 				
 		# Check the version type
-		if version == "1.1":
-			self.specs = SPECS_1_1
-		
-		# Register all avm schema
-		for SCHEMA, PREFIX in AVM_SCHEMAS.items():
-			self.xmp.register_namespace(SCHEMA, PREFIX)
+		if version not in SPECS:
+			raise ValueError("Unsupported AVM version '%s'." % version)
+		self.specs = SPECS[version]
 		
 		# Pass an XMPMeta object
 		if xmp:
 			# Parse for AVM
 			self.xmp = xmp
+			_register_namespaces(xmp)
 			# Synchronize XMP data with dictionary
-			for key, value in self.specs.items():
-				avmdt = self.specs[key]
+			for key, avmdt in self.specs.items():
 				try:
-					if avmdt.get_data(self.xmp):
-						self.data[key] = avmdt.get_data(self.xmp)
+					value = avmdt.get_data(xmp)
+					if value:
+						self.data[key] = value
 				except:
 					continue
+		elif pool is not None:
+			self.xmp = pool.acquire()
+			self._pool = pool
+		else:
+			# Create an XMPMeta object
+			self.xmp = _new_xmp()
 				
 		# Pass an AVM dictionary
 		if avm_dict:
@@ -94,8 +225,9 @@ class AVMMeta(object):
 		
 		if key in self.specs:
 			avmdt = self.specs[key]
-			if avmdt.set_data(self.xmp, value):
-				self.data[key] = avmdt.get_data(self.xmp)
+			with self._lock:
+				if avmdt.set_data(self.xmp, value):
+					self.data[key] = avmdt.get_data(self.xmp)
 		else:
 			raise KeyError, "The key '%s' is not an AVM field" % key
 	
@@ -103,7 +235,8 @@ class AVMMeta(object):
 		
 		if key in self.specs:
 			avmdt = self.specs[key]
-			return avmdt.get_data(self.xmp)
+			with self._lock:
+				return avmdt.get_data(self.xmp)
 		else:
 			raise KeyError, "The key '%s' is not an AVM field" % key
 	
@@ -111,10 +244,127 @@ class AVMMeta(object):
 		
 		if key in self.specs:
 			avmdt = self.specs[key]
-			avmdt.delete_data(self.xmp)
+			with self._lock:
+				avmdt.delete_data(self.xmp)
+				self.data.pop(key, None)
+	
+	def copy(self):
+		"""
+		:return: Independent copy of the object, with a copy of its XMP packet
+		"""
+		with self._lock:
+			xmp = self.xmp.clone()
+		return AVMMeta(xmp=xmp, version=self.version, pickle_format=self.pickle_format)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+	
+	def release(self):
+		"""
+		Returns the XMPMeta object to the pool it was taken from, if any.  The object must not be
+		used afterwards.
+		"""
+		with self._lock:
+			pool, self._pool = self._pool, None
+			if pool is not None:
+				xmp, self._xmp = self._xmp, None
+				self._data = {}
+				pool.release(xmp)
 	
 			
 	
+	#
+	# Lazy restoration of unpickled objects
+	#
+	def _get_xmp(self):
+		if self._pending is not None:
+			with self._lock:
+				if self._pending is not None:
+					self._restore()
+		return self._xmp
+	
+	def _set_xmp(self, xmp):
+		self._xmp = xmp
+	
+	xmp = property(_get_xmp, _set_xmp)
+	
+	def _get_data(self):
+		pending = self._pending
+		if pending is not None and pending[0] == 'packet':
+			with self._lock:
+				if self._pending is not None:
+					self._restore()
+		return self._data
+	
+	def _set_data(self, data):
+		self._data = data
+	
+	data = property(_get_data, _set_data)
+	
+	def _restore(self):
+		"""
+		Rebuilds the XMP packet (and the AVM dictionary) of an unpickled object.
+		"""
+		pickle_format, payload = self._pending
+		self._pending = None
+		
+		if pickle_format == 'packet':
+			xmp = _new_xmp(xmp_str=payload)
+		else:
+			xmp = _new_xmp()
+		self._xmp = xmp
+		
+		if pickle_format == 'packet':
+			self._data = {}
+			for key, avmdt in self.specs.items():
+				try:
+					value = avmdt.get_data(xmp)
+					if value:
+						self._data[key] = value
+				except:
+					continue
+		else:
+			for key, value in self._data.items():
+				try:
+					self.specs[key].set_data(xmp, value)
+				except:
+					continue
+	
+	def __getstate__(self):
+		with self._lock:
+			if self._pending is not None and self._pending[0] == self.pickle_format:
+				return (self.version,) + self._pending
+			if self._pending is not None:
+				self._restore()
+			if self._xmp is None:
+				raise ValueError("The AVMMeta object was released to its pool and cannot be pickled.")
+			
+			if self.pickle_format == 'fields':
+				pickle_format = 'fields'
+				payload = tuple([self._data.get(key) for key in sorted(self.specs.keys())])
+			else:
+				pickle_format = 'packet'
+				payload = self._xmp.serialize_to_str()
+		return (self.version, pickle_format, payload)
+	
+	def __setstate__(self, state):
+		self.version, pickle_format, payload = state
+		self.pickle_format = pickle_format
+		self.specs = SPECS[self.version]
+		self._pool = None
+		self._lock = threading.RLock()
+		
+		self._xmp = None
+		self._data = {}
+		if pickle_format == 'fields':
+			for key, value in zip(sorted(self.specs.keys()), payload):
+				if value is not None:
+					self._data[key] = value
+		self._pending = (pickle_format, payload)
+	
 	def to_string(self, key):
 		"""
 		Method to decompress data to a SQL-friendly string.
@@ -123,8 +373,56 @@ class AVMMeta(object):
 		"""
 		if key in self.specs:
 			avmdt = self.specs[key]
-			return avmdt.to_string(self.xmp)
+			with self._lock:
+				return avmdt.to_string(self.xmp)
 		else:
 			raise KeyError, "The key '%s' is not an AVM field" % key
+	
+	def to_row(self, fields):
+		"""
+		Method to decompress several fields at once to a tuple of SQL-friendly strings, formatted
+		as by to_string().  Each field is decoded from the XMP packet only once.
+		
+		:param fields: List of AVM fields
+		
+		:return: Tuple of strings (UTF-8), None for missing fields
+		"""
+		xmp = self.xmp
+		row = []
+		with self._lock:
+			for key in fields:
+				if key not in self.specs:
+					raise KeyError, "The key '%s' is not an AVM field" % key
+				avmdt = self.specs[key]
+				row.append(avmdt.format_value(avmdt.get_data(xmp)))
+		return tuple(row)
+
+
+def to_rows(records, fields, specs=SPECS_1_1):
+	"""
+	Generator converting many records to tuples of SQL-friendly strings, formatted as by
+	AVMMeta.to_string().  Records may be AVMMeta objects, or AVM dictionaries as returned by
+	avm_from_file(), which are formatted without building an XMP packet.
+	
+	:param records: Iterable of AVMMeta objects or AVM dictionaries
+	:param fields: List of AVM fields
+	:param specs: AVM specification dictionary used for AVM dictionaries, default to SPECS_1_1
+	
+	:return: Iterator of tuples
+	"""
+	for key in fields:
+		if key not in specs:
+			raise KeyError, "The key '%s' is not an AVM field" % key
+	formatters = [(key, specs[key].format_value) for key in fields]
+	
+	for record in records:
+		if isinstance(record, AVMMeta):
+			yield record.to_row(fields)
+		else:
+			row = []
+			for key, format_value in formatters:
+				value = record.get(key)
+				row.append(format_value(value) if value else None)
+			yield tuple(row)
 
 
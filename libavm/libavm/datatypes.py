@@ -64,6 +64,9 @@ class AVMData( object ):
 	"""
 	Abstract AVM data class.  All other data classes inherit from AVMData.
 	"""
+	# Column type used to store the data in a SQL database
+	sql_type = 'TEXT'
+	
 	def __init__(self, ns, path, deprecated=False, **kwargs ):
 		""" """
 		self.namespace = ns
@@ -103,8 +106,9 @@ class AVMData( object ):
 		:return: Object.  Depending on the data type, different objects will be returned.  If the data does not exist
 		in the xmp packet, then the None object is returned
 		"""
-		if xmp_packet.get_property(self.namespace, self.path):
-			return xmp_packet.get_property(self.namespace, self.path)
+		value = xmp_packet.get_property(self.namespace, self.path)
+		if value:
+			return value
 	
 	def delete_data(self, xmp_packet):
 		"""
@@ -112,14 +116,34 @@ class AVMData( object ):
 		"""
 		xmp_packet.delete_property(self.namespace, self.path)
 	
+	def copy_data(self, source, target):
+		"""
+		Copies the data from an XMP packet to another as is, without checking it again.
+		Should be overridden when appropriate.
+		"""
+		value = source.get_property(self.namespace, self.path)
+		if value is None:
+			self.delete_data(target)
+		else:
+			target.set_property(self.namespace, self.path, value)
+	
+	def format_value(self, value):
+		"""
+		Formats a value, as returned by get_data(), in a SQL-friendly string format.
+		Should be overridden when appropriate.
+		
+		:return: String (UTF-8)
+		"""
+		if value:
+			return value
+	
 	def to_string(self, xmp_packet):
 		"""
 		Method to retrieve data from an XMP packet in a SQL-friendly string format.
 		
 		:return: String (UTF-8)
 		"""
-		if self.get_data(xmp_packet):
-			return self.get_data(xmp_packet)
+		return self.format_value(self.get_data(xmp_packet))
 
 
 
@@ -318,6 +342,16 @@ class AVMLocalizedString( AVMString ):
 		:return: String
 		"""
 		return xmp_packet.get_localized_text(self.namespace, self.path, self.generic_lang, self.specific_lang)
+	
+	def copy_data(self, source, target):
+		"""
+		Copies the localized data from an XMP packet to another as is.
+		"""
+		value = source.get_localized_text(self.namespace, self.path, self.generic_lang, self.specific_lang)
+		if value is None:
+			self.delete_data(target)
+		else:
+			target.set_localized_text(self.namespace, self.path, self.generic_lang, self.specific_lang, value)
 
 
 
@@ -325,6 +359,8 @@ class AVMFloat( AVMData ):
 	""" 
 	Data type for float fields
 	"""
+	sql_type = 'REAL'
+	
 	def check_data(self, value):
 		"""
 		Checks that data can be represented as a number.
@@ -374,18 +410,17 @@ class AVMDate( AVMData ):
 			except:
 				return value
 
-	def to_string(self, xmp_packet):
+	def format_value(self, value):
 		"""
-		Method to retrieve data from an XMP packet in a SQL-friendly string format.
+		Formats a date in ISO format.
 		
 		:return: String (UTF-8)
 		"""
-		if self.get_data(xmp_packet):
-			data = self.get_data(xmp_packet)
+		if value:
 			try:
-				return data.isoformat()
+				return value.isoformat()
 			except:
-				return data
+				return value
 
 
 
@@ -415,23 +450,26 @@ class AVMDateTime( AVMData ):
 			return parser.parse( value )
 		return None
 
-	def to_string(self, xmp_packet):
+	def format_value(self, value):
 		"""
-		Method to retrieve data from an XMP packet in a SQL-friendly string format.
+		Formats a date in ISO format.
 		
 		:return: String (UTF-8)
 		"""
-		if self.get_data(xmp_packet):
-			data = self.get_data(xmp_packet)
+		if value:
 			try:
-				return data.isoformat()
+				return value.isoformat()
 			except:
-				return data
+				return value
 
 class AVMUnorderedList( AVMData ):
 	"""
 	Generic data type for lists (i.e xmp bag arrays)
 	"""
+	array_options = {
+		'prop_value_is_array': True,
+	}
+	
 	def __init__(self, ns, path, **kwargs):
 		# Optional keyword arguments
 		if 'length' in kwargs:
@@ -519,12 +557,8 @@ class AVMUnorderedList( AVMData ):
 		# Delete the data for replacement
 		self.delete_data(xmp_packet)
 		
-		arr_options = {
-			'prop_value_is_array': True,
-		}
-		
 		for value in values:
-			if xmp_packet.append_array_item(self.namespace, self.path, value, arr_options):
+			if xmp_packet.append_array_item(self.namespace, self.path, value, self.array_options):
 				continue
 			else:
 				return False
@@ -550,19 +584,27 @@ class AVMUnorderedList( AVMData ):
 			items.append(item)
 			
 		return items
+	
+	def copy_data(self, source, target):
+		"""
+		Copies the items from an XMP packet to another as is, replacing the existing ones.
+		"""
+		self.delete_data(target)
+		for i in range(1, source.count_array_items(self.namespace, self.path) + 1):
+			item = source.get_array_item(self.namespace, self.path, i).keys()[0]
+			target.append_array_item(self.namespace, self.path, item, self.array_options)
 
-	def to_string(self, xmp_packet):
+	def format_value(self, value):
 		"""
-		Method to retrieve data from an XMP packet in a SQL-friendly string format.
+		Formats a list as a semicolon separated string.
 		
 		:return: String (UTF-8)
 		"""
-		if self.get_data(xmp_packet):
-			data = self.get_data(xmp_packet)
+		if value:
 			try:
-				return ';'.join(data)
+				return ';'.join(value)
 			except:
-				return data
+				return value
 
 
 class AVMUnorderedStringList( AVMUnorderedList ):
@@ -600,6 +642,11 @@ class AVMOrderedList( AVMUnorderedList ):
 	"""
 	Data type for ordered lists (i.e. seq arrays)
 	"""	
+	array_options = {
+		'prop_value_is_array': True,
+		'prop_array_is_ordered': True
+	}
+	
 	def set_data(self, xmp_packet, values):
 		""" 
 		Checks the data before injecting to the XMP packets.
@@ -615,13 +662,8 @@ class AVMOrderedList( AVMUnorderedList ):
 		# Delete the data for replacement
 		self.delete_data(xmp_packet)
 		
-		arr_options= {
-			'prop_value_is_array': True,
-			'prop_array_is_ordered': True
-		}
-		
 		for value in values:
-			if xmp_packet.append_array_item(self.namespace, self.path, value, arr_options):
+			if xmp_packet.append_array_item(self.namespace, self.path, value, self.array_options):
 				continue
 			else:
 				return False
@@ -782,18 +824,17 @@ class AVMDateTimeList( AVMOrderedList ):
 			
 		return items
 
-	def to_string(self, xmp_packet):
+	def format_value(self, value):
 		"""
-		Method to retrieve data from an XMP packet in a SQL-friendly string format.
+		Formats a list of dates as a semicolon separated string of dates in ISO format.
 		
 		:return: String (UTF-8)
 		"""
-		if self.get_data(xmp_packet):
-			data = self.get_data(xmp_packet)
+		if value:
 			try:
 				tmp_data = []
-				for item in data:
+				for item in value:
 					tmp_data.append(item.isoformat())
 				return ';'.join(tmp_data)
 			except:
-				return data
+				return value
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Bulk loading of AVM records into SQL databases.
+
+The table schema is generated from a specification dictionary, with one column per AVM
+field typed by the ``sql_type`` of its data type.  Records are converted to row tuples in a
+single pass, using the same formatting as :meth:`libavm.AVMMeta.to_string` (lists joined
+with semicolons, dates in ISO format), and inserted with ``executemany`` in chunked
+transactions::
+
+	import sqlite3
+	from libavm.db import *
+	
+	connection = sqlite3.connect('avm.db')
+	create_table(connection, 'avm')
+	load_records(connection, 'avm', ((path, avm_from_file(path)) for path in paths))
+
+The functions work with any DB-API connection; the default placeholder suits :mod:`sqlite3`.
+
+Loading is bound by the database module rather than by the formatting of the values: with
+:mod:`sqlite3` under Python 2.7, binding the parameters of a row of all 61 fields of the 1.1
+specification caps the load at 17,000 to 20,000 rows/s (``python benchmarks.py db``),
+whatever the synchronous and journal settings.  Loading a subset of the fields is
+proportionally faster, e.g. over 100,000 rows/s for 10 fields.
+"""
+
+try:
+	import sqlite3
+except ImportError:
+	sqlite3 = None
+
+from libavm.specs import *
+
+
+__all__ = ['create_table', 'table_schema', 'record_to_row', 'load_records']
+
+
+def _quote( name ):
+	return '"%s"' % name.replace('"', '""')
+
+def _fields( specs, fields ):
+	if fields is None:
+		fields = sorted(specs.keys())
+	return fields
+
+def table_schema( table, specs=SPECS_1_1, fields=None, key_column='key' ):
+	"""
+	Generates the CREATE TABLE statement for a table of AVM records.
+	
+	:param table: Name of the table
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	:param fields: List of fields to store, default to all fields of the specification
+	:param key_column: Name of the primary key column holding the record key
+	
+	:return: String
+	"""
+	columns = ['%s TEXT PRIMARY KEY' % _quote(key_column)]
+	for field in _fields(specs, fields):
+		columns.append('%s %s' % (_quote(field), specs[field].sql_type))
+	return 'CREATE TABLE IF NOT EXISTS %s (\n\t%s\n)' % (_quote(table), ',\n\t'.join(columns))
+
+def create_table( connection, table, specs=SPECS_1_1, fields=None, key_column='key' ):
+	"""
+	Creates a table for AVM records if it does not exist yet.  See table_schema().
+	"""
+	connection.execute(table_schema(table, specs, fields, key_column))
+	connection.commit()
+
+def record_to_row( key, data, fields, specs=SPECS_1_1 ):
+	"""
+	Converts an AVM dictionary to a row tuple, formatting every value like
+	:meth:`libavm.AVMMeta.to_string`.
+	
+	:return: Tuple starting with the record key, followed by the values of fields
+	"""
+	return _row(key, data, _formatters(fields, specs))
+
+def _formatters( fields, specs ):
+	return [(field, specs[field].format_value) for field in fields]
+
+def _row( key, data, formatters ):
+	get = data.get
+	row = [key]
+	for field, format_value in formatters:
+		value = get(field)
+		row.append(None if value is None else format_value(value))
+	return tuple(row)
+
+def load_records( connection, table, records, specs=SPECS_1_1, fields=None, key_column='key', chunk_size=50000, placeholder='?', durable=True ):
+	"""
+	Inserts or replaces records in a table created by create_table().  Rows are inserted
+	chunk_size at a time with executemany(), each chunk in its own transaction.
+	
+	:param connection: DB-API connection
+	:param table: Name of the table
+	:param records: Iterable of (key, AVM dictionary) tuples
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	:param fields: List of fields to store, default to all fields of the specification
+	:param key_column: Name of the primary key column
+	:param chunk_size: Number of rows per transaction
+	:param placeholder: Parameter placeholder of the database module
+	:param durable: Boolean, False to turn off the synchronous writes and the journal file of SQLite databases during the load, at the risk of a corrupt database if the system crashes
+	
+	:return: Number of records loaded
+	"""
+	if not durable and sqlite3 is not None and isinstance(connection, sqlite3.Connection):
+		connection.commit()
+		synchronous = connection.execute('PRAGMA synchronous').fetchone()[0]
+		journal_mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+		connection.execute('PRAGMA synchronous=OFF')
+		connection.execute('PRAGMA journal_mode=MEMORY')
+		try:
+			return load_records(connection, table, records, specs, fields, key_column, chunk_size, placeholder)
+		finally:
+			connection.commit()
+			connection.execute('PRAGMA journal_mode=%s' % journal_mode)
+			connection.execute('PRAGMA synchronous=%d' % synchronous)
+	
+	fields = _fields(specs, fields)
+	formatters = _formatters(fields, specs)
+	statement = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+		_quote(table),
+		', '.join([_quote(column) for column in [key_column] + fields]),
+		', '.join([placeholder] * (len(fields) + 1)),
+	)
+	
+	count = 0
+	rows = []
+	cursor = connection.cursor()
+	for key, data in records:
+		rows.append(_row(key, data, formatters))
+		if len(rows) >= chunk_size:
+			cursor.executemany(statement, rows)
+			connection.commit()
+			count += len(rows)
+			rows = []
+	
+	if rows:
+		cursor.executemany(statement, rows)
+		connection.commit()
+		count += len(rows)
+	return count
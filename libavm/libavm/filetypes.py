@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Detection of the file formats supported by the XMP Toolkit.
+
+Formats are identified by extension, and confirmed from the first bytes of the file for the
+formats having a recognizable signature, so that e.g. an HTML error page saved as ``.jpg`` is
+not handed to Exempi.
+
+Opening a file with ``XMPFiles.open_file`` is costly, even for files Exempi ends up rejecting.
+:func:`classify` reads the first bytes of a file once to pick the open flags suited to its
+format, or to tell that the file is hopeless (missing, empty, truncated or not what its
+extension claims) so it can be skipped without calling Exempi at all.
+"""
+
+import os
+
+
+__all__ = ['EXTENSIONS', 'sniff', 'file_type', 'extension_type', 'classify', 'open_flags']
+
+
+# File extensions of the formats supported by the XMP Toolkit, as in the test samples
+EXTENSIONS = {
+	'.tif': 'tiff',
+	'.tiff': 'tiff',
+	'.jpg': 'jpeg',
+	'.jpeg': 'jpeg',
+	'.png': 'png',
+	'.gif': 'gif',
+	'.psd': 'photoshop',
+	'.eps': 'eps',
+	'.ai': 'illustrator',
+	'.pdf': 'pdf',
+	'.indd': 'indesign',
+	'.avi': 'avi',
+	'.mov': 'mov',
+	'.mp3': 'mp3',
+	'.wav': 'wav',
+	'.xmp': 'xmp',
+}
+
+# (offset, signature, format) of the formats recognizable from their first bytes
+SIGNATURES = [
+	(0, 'II*\0', 'tiff'),
+	(0, 'MM\0*', 'tiff'),
+	(0, '\xff\xd8\xff', 'jpeg'),
+	(0, '\x89PNG\r\n\x1a\n', 'png'),
+	(0, 'GIF87a', 'gif'),
+	(0, 'GIF89a', 'gif'),
+	(0, '8BPS', 'photoshop'),
+	(0, '%!PS-Adobe', 'eps'),
+	(0, '\xc5\xd0\xd3\xc6', 'eps'),
+	(0, '%PDF-', 'pdf'),
+	(8, 'AVI ', 'avi'),
+	(8, 'WAVE', 'wav'),
+	(0, '\x06\x06\xed\xf5\xd8\x1d\x46\xe5', 'indesign'),
+	(4, 'ftyp', 'mov'),
+	(4, 'moov', 'mov'),
+	(4, 'mdat', 'mov'),
+	(4, 'wide', 'mov'),
+	(0, 'ID3', 'mp3'),
+	(0, '<?xpacket', 'xmp'),
+	(0, '<x:xmpmeta', 'xmp'),
+	(0, '<x:xapmeta', 'xmp'),
+]
+
+# Signatures allowed anywhere in the first SNIFF_SIZE bytes.  PDF readers accept a preamble
+# (e.g. a MIME header) before the %PDF- header, as long as it starts in the first 1024 bytes.
+PREAMBLE_SIGNATURES = [
+	('%PDF-', 'pdf'),
+]
+
+# Number of bytes read to recognize a format
+SNIFF_SIZE = 1024
+
+# Smallest possible size of a file of each format with an XMP packet.  Shorter files are
+# truncated.
+MINIMUM_SIZES = {
+	'tiff': 26,
+	'jpeg': 24,
+	'png': 45,
+	'gif': 35,
+	'photoshop': 38,
+	'pdf': 64,
+	'avi': 24,
+	'wav': 24,
+	'xmp': 20,
+}
+
+# Formats whose files always start with their signature
+STRICT_FORMATS = set(['tiff', 'jpeg', 'png', 'gif', 'photoshop', 'eps', 'pdf', 'avi', 'wav', 'indesign'])
+
+# Formats stored in the container of another format
+ALIASES = {
+	('illustrator', 'pdf'): 'illustrator',
+	('illustrator', 'eps'): 'illustrator',
+}
+
+# Keyword arguments of XMPFiles.open_file() by format.  Exempi has smart handlers for most
+# formats, which locate the XMP from the file structure and fail fast on damaged files.  PDF
+# and Illustrator files have none, so packet scanning is requested directly rather than
+# after trying all the handlers.
+OPEN_FLAGS = {
+	'pdf': {'open_usepacketscanning': True},
+	'illustrator': {'open_usepacketscanning': True},
+	None: {},
+}
+SMART_HANDLER_FLAGS = {'open_usesmarthandler': True}
+
+
+def extension_type( file_path ):
+	"""
+	:return: Format of a file according to its extension, or None if it is not supported
+	"""
+	return EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+
+def sniff( file_path ):
+	"""
+	Recognizes the format of a file from its first bytes.
+	
+	:return: Format, or None if the file cannot be read or has no known signature
+	"""
+	try:
+		with open(file_path, 'rb') as f:
+			head = f.read(SNIFF_SIZE)
+	except IOError:
+		return None
+	return _match(head)
+
+def _match( head ):
+	for offset, signature, format in SIGNATURES:
+		if head[offset:offset + len(signature)] == signature:
+			return format
+	for signature, format in PREAMBLE_SIGNATURES:
+		if signature in head:
+			return format
+	return None
+
+def file_type( file_path, sniff_content=True ):
+	"""
+	Determines the format of a file from its extension, checked against its content when
+	sniff_content is True.  A file whose content does not match the signature expected for
+	its extension is rejected; formats without a known signature are accepted by extension.
+	
+	:return: Format, or None if the file is not supported
+	"""
+	format = extension_type(file_path)
+	if format is None or not sniff_content:
+		return format
+	
+	sniffed = sniff(file_path)
+	return _resolve(format, sniffed)
+
+def _resolve( format, sniffed ):
+	if (format, sniffed) in ALIASES:
+		return ALIASES[(format, sniffed)]
+	if sniffed is not None:
+		return sniffed
+	if format in STRICT_FORMATS:
+		return None
+	return format
+
+def classify( file_path ):
+	"""
+	Determines how to read the XMP of a file from its extension, size and first bytes.
+	
+	:return: (format, reason) tuple.  format is None for files of unknown format; reason is None, or a string explaining why the file is hopeless and should not be opened.
+	"""
+	try:
+		with open(file_path, 'rb') as f:
+			head = f.read(SNIFF_SIZE)
+			f.seek(0, os.SEEK_END)
+			size = f.tell()
+	except IOError, e:
+		return (None, 'Cannot read file: %s' % e.strerror)
+	
+	if size == 0:
+		return (None, 'Empty file')
+	
+	sniffed = _match(head)
+	format = extension_type(file_path)
+	if format is None:
+		format = sniffed
+	else:
+		resolved = _resolve(format, sniffed)
+		if resolved is None:
+			return (format, 'Content does not match the %s format' % format)
+		format = resolved
+	
+	if size < MINIMUM_SIZES.get(format, 0):
+		return (format, 'File is truncated')
+	return (format, None)
+
+def open_flags( format, for_update=False ):
+	"""
+	Chooses the options of XMPFiles.open_file() for a format.
+	
+	:param format: Format, as returned by classify()
+	:param for_update: Boolean to open the file for update rather than for reading
+	
+	:return: Dictionary of keyword arguments
+	"""
+	flags = dict(OPEN_FLAGS.get(format, SMART_HANDLER_FLAGS))
+	if for_update:
+		flags['open_forupdate'] = True
+	else:
+		flags['open_read'] = True
+		flags['open_onlyxmp'] = True
+	return flags
@@ -0,0 +1,1119 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Indexes over collections of AVM records.
+
+A record is an AVM dictionary, as returned by :func:`libavm.utils.avm_from_file` or held
+in ``AVMMeta.data``, identified by a record key (usually the path of the file it was read from).
+Indexes are updated incrementally with :meth:`AVMIndex.add` and :meth:`AVMIndex.remove`, and
+may be persisted next to the files they describe with :meth:`AVMIndex.save`.
+"""
+
+import os
+import re
+import math
+import zlib
+import bisect
+import binascii
+import calendar
+import datetime
+import cPickle as pickle
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from libavm.specs import *
+from libavm.datatypes import AVMStringCV
+
+
+__all__ = [
+	'AVMIndex',
+	'AVMBitmapIndex',
+	'AVMCategoryIndex',
+	'AVMTextIndex',
+	'AVMIntervalIndex',
+	'AVMHashIndex',
+	'refresh_indexes',
+]
+
+
+#
+# Bitmap helpers
+#
+
+def _bitmap_from_rows( rows ):
+	"""
+	Builds a bitmap (a Python long with bit n set for row n) from an iterable of row numbers
+	in a single pass.
+	"""
+	rows = list(rows)
+	if not rows:
+		return 0L
+	
+	bits = bytearray((max(rows) >> 3) + 1)
+	for row in rows:
+		bits[row >> 3] |= 1 << (row & 7)
+	bits.reverse()
+	return long(binascii.hexlify(bits), 16)
+
+def _rows_from_bitmap( bitmap ):
+	"""
+	Iterates over the row numbers set in a bitmap, in increasing order.
+	"""
+	hex_value = '%x' % bitmap
+	if len(hex_value) % 2:
+		hex_value = '0' + hex_value
+	bits = bytearray(binascii.unhexlify(hex_value))
+	bits.reverse()
+	
+	for offset, byte in enumerate(bits):
+		if not byte:
+			continue
+		for bit in range(8):
+			if byte & (1 << bit):
+				yield (offset << 3) + bit
+
+def _compress_bitmap( bitmap ):
+	"""
+	:return: zlib compressed, big endian representation of a bitmap
+	"""
+	hex_value = '%x' % bitmap
+	if len(hex_value) % 2:
+		hex_value = '0' + hex_value
+	return zlib.compress(binascii.unhexlify(hex_value))
+
+def _decompress_bitmap( data ):
+	"""
+	Inverse of _compress_bitmap()
+	"""
+	hex_value = binascii.hexlify(zlib.decompress(data))
+	return long(hex_value or '0', 16)
+
+
+def refresh_indexes( indexes, file_paths, prune=True ):
+	"""
+	Brings several indexes up to date with a set of files, using the file paths as record
+	keys.  Only files whose size or modification time changed since the last refresh are
+	read, and each of them is read once for all indexes.
+	
+	:param indexes: List of AVMIndex instances
+	:param file_paths: Iterable of file paths
+	:param prune: Remove keys of files that are missing or not in file_paths.  By default it is set to True.
+	
+	:return: Number of files read
+	"""
+	from libavm.utils import avm_from_file, file_stamp
+	
+	changed = dict([(id(index), []) for index in indexes])
+	seen = set()
+	num_read = 0
+	
+	for file_path in file_paths:
+		stamp = file_stamp(file_path)
+		if stamp is None:
+			continue
+		seen.add(file_path)
+		
+		stale = [index for index in indexes if index.stamps.get(file_path) != stamp]
+		if not stale:
+			continue
+		
+		data = avm_from_file(file_path)
+		num_read += 1
+		for index in stale:
+			index.stamps[file_path] = stamp
+			changed[id(index)].append((file_path, data))
+	
+	for index in indexes:
+		if changed[id(index)]:
+			index.update(changed[id(index)])
+		
+		if prune:
+			for file_path in index.stamps.keys():
+				if file_path not in seen:
+					del index.stamps[file_path]
+					index.remove(file_path)
+	
+	return num_read
+
+
+class AVMIndex( object ):
+	"""
+	Abstract index class.  All other index classes inherit from AVMIndex and should define
+	add(), remove() and keys().
+	
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	def __init__(self, specs=SPECS_1_1):
+		self.specs = specs
+		# File path -> (size, mtime) when the file was last indexed by refresh()
+		self.stamps = {}
+	
+	def add(self, key, data):
+		"""
+		Indexes an AVM dictionary under a record key.  If the key is already present, its
+		previous entry is replaced.
+		"""
+		raise NotImplementedError
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		raise NotImplementedError
+	
+	def keys(self):
+		"""
+		:return: List of indexed record keys
+		"""
+		raise NotImplementedError
+	
+	def update(self, records):
+		"""
+		Indexes many records at once.
+		
+		:param records: Iterable of (key, AVM dictionary) tuples
+		"""
+		for key, data in records:
+			self.add(key, data)
+	
+	def refresh(self, file_paths, prune=True):
+		"""
+		Brings the index up to date with a set of files, using the file paths as record
+		keys.  See :func:`refresh_indexes`.
+		"""
+		return refresh_indexes([self], file_paths, prune)
+	
+	def __contains__(self, key):
+		return key in self.keys()
+	
+	def __len__(self):
+		return len(self.keys())
+	
+	def save(self, file_path):
+		"""
+		Writes the index to disk.  The file is replaced atomically, so readers never see a
+		partially written index.
+		"""
+		tmp_path = '%s.tmp' % file_path
+		f = open(tmp_path, 'wb')
+		try:
+			pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+		os.rename(tmp_path, file_path)
+	
+	@classmethod
+	def load(cls, file_path):
+		"""
+		Reads an index previously written with save().
+		
+		:return: AVMIndex instance
+		"""
+		f = open(file_path, 'rb')
+		try:
+			index = pickle.load(f)
+		finally:
+			f.close()
+		
+		if not isinstance(index, cls):
+			raise TypeError("File does not contain a %s." % cls.__name__)
+		return index
+
+
+class AVMBitmapIndex( AVMIndex ):
+	"""
+	Bitmap index over controlled vocabulary fields.  Each distinct value of a field is
+	mapped to a bitmap with one bit per record, so boolean combinations of filters are
+	evaluated with bitwise operations on the bitmaps.  Bitmaps are stored as Python longs
+	in memory and zlib compressed on disk.
+	
+	Record keys are mapped to row numbers; rows freed by remove() are reused.
+	
+	:param fields:	List of fields to index.  Defaults to all controlled vocabulary fields of
+					the specification plus ``Subject.Category``.
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	def __init__(self, fields=None, specs=SPECS_1_1):
+		super( AVMBitmapIndex, self).__init__(specs)
+		
+		if fields is None:
+			fields = [key for key, avmdt in specs.items() if isinstance(avmdt, AVMStringCV)]
+			fields.append('Subject.Category')
+		
+		self.fields = sorted(fields)
+		self.bitmaps = dict([(field, {}) for field in self.fields])
+		
+		# Record key <-> row number
+		self.rows = {}
+		self.row_keys = []
+		self.free_rows = []
+		# Row number -> list of (field, value) set for that row
+		self.row_values = []
+		self.live = 0L
+	
+	def format_value(self, field, value):
+		"""
+		Formats a value the way the data type stores it (e.g. capitalized CV entries).
+		"""
+		avmdt = self.specs.get(field)
+		if hasattr(avmdt, 'format_data'):
+			return avmdt.format_data(value)
+		return value
+	
+	def _values(self, data):
+		"""
+		:return: List of (field, value) tuples present in an AVM dictionary
+		"""
+		values = []
+		for field in self.fields:
+			value = data.get(field)
+			if not value:
+				continue
+			if isinstance(value, basestring):
+				value = [value]
+			for item in set(value):
+				if item and item != '-':
+					values.append((field, item))
+		return values
+	
+	def _allocate(self, key):
+		if self.free_rows:
+			row = self.free_rows.pop()
+			self.row_keys[row] = key
+		else:
+			row = len(self.row_keys)
+			self.row_keys.append(key)
+			self.row_values.append(None)
+		self.rows[key] = row
+		return row
+	
+	def add(self, key, data):
+		"""
+		Indexes an AVM dictionary under a record key.
+		"""
+		self.update([(key, data)])
+	
+	def update(self, records):
+		"""
+		Indexes many records at once.  Bits for all records are collected first, and each
+		affected bitmap is rebuilt only once.
+		
+		:param records: Iterable of (key, AVM dictionary) tuples
+		"""
+		new_rows = {}
+		live_rows = []
+		
+		for key, data in records:
+			self.remove(key)
+			row = self._allocate(key)
+			values = self._values(data)
+			self.row_values[row] = values
+			live_rows.append(row)
+			for field_value in values:
+				new_rows.setdefault(field_value, []).append(row)
+		
+		for (field, value), rows in new_rows.iteritems():
+			bitmaps = self.bitmaps[field]
+			bitmaps[value] = bitmaps.get(value, 0L) | _bitmap_from_rows(rows)
+		self.live |= _bitmap_from_rows(live_rows)
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		row = self.rows.pop(key, None)
+		if row is None:
+			return
+		
+		mask = ~(1L << row)
+		for field, value in self.row_values[row]:
+			bitmaps = self.bitmaps[field]
+			bitmaps[value] &= mask
+			if not bitmaps[value]:
+				del bitmaps[value]
+		self.live &= mask
+		
+		self.row_keys[row] = None
+		self.row_values[row] = None
+		self.free_rows.append(row)
+	
+	def keys(self):
+		return self.rows.keys()
+	
+	def __contains__(self, key):
+		return key in self.rows
+	
+	def __len__(self):
+		return len(self.rows)
+	
+	#
+	# Queries
+	#
+	def values(self, field):
+		"""
+		:return: List of indexed values for a field
+		"""
+		return self.bitmaps[field].keys()
+	
+	def lookup(self, field, value):
+		"""
+		:return: Bitmap of the records having value in field
+		"""
+		if field not in self.bitmaps:
+			raise KeyError, "The field '%s' is not indexed" % field
+		return self.bitmaps[field].get(self.format_value(field, value), 0L)
+	
+	def universe(self):
+		"""
+		:return: Bitmap of all records in the index
+		"""
+		return self.live
+	
+	def complement(self, bitmap):
+		"""
+		:return: Bitmap of the records not in bitmap
+		"""
+		return self.live & ~bitmap
+	
+	def count(self, bitmap):
+		"""
+		:return: Number of records in bitmap
+		"""
+		return bin(bitmap).count('1')
+	
+	def resolve(self, bitmap):
+		"""
+		:return: List of record keys in bitmap
+		"""
+		return [self.row_keys[row] for row in _rows_from_bitmap(bitmap & self.live)]
+	
+	def filter(self, conditions):
+		"""
+		Evaluates a faceted filter.  Conditions on different fields are combined with AND,
+		while a list of values for a single field is combined with OR::
+		
+			index.filter({
+				'Type': 'Observation',
+				'Spectral.Band': ['Infrared', 'Optical'],
+				'Spatial.Quality': 'Full',
+			})
+		
+		:param conditions: Dictionary of field to value or list of values
+		
+		:return: Bitmap of the matching records
+		"""
+		result = self.live
+		for field, values in conditions.iteritems():
+			if isinstance(values, basestring):
+				values = [values]
+			
+			matches = 0L
+			for value in values:
+				matches |= self.lookup(field, value)
+			result &= matches
+		return result
+	
+	#
+	# Persistence
+	#
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['bitmaps'] = dict([
+			(field, dict([(value, _compress_bitmap(bitmap)) for value, bitmap in bitmaps.iteritems()]))
+			for field, bitmaps in self.bitmaps.iteritems()
+		])
+		state['live'] = _compress_bitmap(self.live)
+		return state
+	
+	def __setstate__(self, state):
+		state['bitmaps'] = dict([
+			(field, dict([(value, _decompress_bitmap(data)) for value, data in bitmaps.iteritems()]))
+			for field, bitmaps in state['bitmaps'].iteritems()
+		])
+		state['live'] = _decompress_bitmap(state['live'])
+		self.__dict__.update(state)
+
+
+class _CategoryNode( object ):
+	"""
+	Node of the Subject.Category trie.  ``records`` holds every record key found in the
+	subtree rooted at the node, with the number of codes through which it was reached.
+	"""
+	__slots__ = ('children', 'records')
+	
+	def __init__(self):
+		self.children = {}
+		self.records = {}
+	
+	def __getstate__(self):
+		return (self.children, self.records)
+	
+	def __setstate__(self, state):
+		self.children, self.records = state
+
+
+class AVMCategoryIndex( AVMIndex ):
+	"""
+	Prefix trie over the hierarchical ``Subject.Category`` codes (e.g. ``B.4.1.2``).  Each
+	node keeps the set of records found below it, so subtree membership and counts are
+	answered without visiting the rest of the trie::
+	
+		index.members('B.4.*')	# All nebulae
+		index.count('B.4')
+	
+	:param field:	Field holding the category codes, default to ``Subject.Category``
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	def __init__(self, field='Subject.Category', specs=SPECS_1_1):
+		super( AVMCategoryIndex, self).__init__(specs)
+		self.field = field
+		self.root = _CategoryNode()
+		# Record key -> list of codes
+		self.codes = {}
+	
+	def split_code(self, code):
+		"""
+		Splits a category code or query prefix into its components.  A trailing ``*`` is
+		ignored, so ``B.4.*``, ``B.4.`` and ``B.4`` are equivalent.
+		
+		:return: List of strings
+		"""
+		code = code.strip().rstrip('*').rstrip('.')
+		if not code:
+			return []
+		return [part.strip() for part in code.split('.')]
+	
+	def _node(self, prefix):
+		node = self.root
+		for part in self.split_code(prefix):
+			node = node.children.get(part)
+			if node is None:
+				return None
+		return node
+	
+	def add(self, key, data):
+		"""
+		Indexes the category codes of an AVM dictionary under a record key.
+		"""
+		self.remove(key)
+		
+		codes = data.get(self.field) or []
+		if isinstance(codes, basestring):
+			codes = [codes]
+		codes = [code for code in set(codes) if code and code != '-']
+		self.codes[key] = codes
+		
+		for code in codes:
+			node = self.root
+			node.records[key] = node.records.get(key, 0) + 1
+			for part in self.split_code(code):
+				node = node.children.setdefault(part, _CategoryNode())
+				node.records[key] = node.records.get(key, 0) + 1
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		codes = self.codes.pop(key, None)
+		if codes is None:
+			return
+		
+		for code in codes:
+			path = [self.root]
+			for part in self.split_code(code):
+				path.append(path[-1].children[part])
+			
+			for node in path:
+				if node.records[key] == 1:
+					del node.records[key]
+				else:
+					node.records[key] -= 1
+			
+			# Prune nodes left without records
+			parts = self.split_code(code)
+			for depth in range(len(parts), 0, -1):
+				if path[depth].records:
+					break
+				del path[depth - 1].children[parts[depth - 1]]
+	
+	def keys(self):
+		return self.codes.keys()
+	
+	def __contains__(self, key):
+		return key in self.codes
+	
+	def __len__(self):
+		return len(self.codes)
+	
+	#
+	# Queries
+	#
+	def members(self, prefix):
+		"""
+		:param prefix: Category code or prefix, e.g. ``B.4`` or ``B.4.*``
+		
+		:return: List of record keys with a category in the subtree
+		"""
+		node = self._node(prefix)
+		if node is None:
+			return []
+		return node.records.keys()
+	
+	def count(self, prefix):
+		"""
+		:return: Number of records with a category in the subtree
+		"""
+		node = self._node(prefix)
+		if node is None:
+			return 0
+		return len(node.records)
+	
+	def children(self, prefix=''):
+		"""
+		:return: Dictionary of the child codes directly below prefix, and their record counts
+		"""
+		node = self._node(prefix)
+		if node is None:
+			return {}
+		
+		parts = self.split_code(prefix)
+		return dict([
+			('.'.join(parts + [part]), len(child.records))
+			for part, child in node.children.iteritems()
+		])
+
+
+class AVMTextIndex( AVMIndex ):
+	"""
+	Full-text inverted index over string fields.  Text is split into words and case folded;
+	for every word the index stores the records and word positions it occurs at, which
+	allows ranked keyword queries as well as phrase queries::
+	
+		index.search('orion nebula')		# Records containing both words
+		index.search('"orion nebula" hubble')	# Phrase and word
+	
+	Results are ranked by tf-idf.
+	
+	:param fields:	List of fields to index, default to ``Title``, ``Headline``, ``Description``,
+					``Subject.Name`` and ``Spectral.Notes``.
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	word_re = re.compile(r'\w+', re.UNICODE)
+	phrase_re = re.compile(r'"([^"]*)"|(\S+)')
+	
+	# Position gap between fields, so phrases never match across two fields
+	field_gap = 1000
+	
+	def __init__(self, fields=None, specs=SPECS_1_1):
+		super( AVMTextIndex, self).__init__(specs)
+		
+		if fields is None:
+			fields = ['Title', 'Headline', 'Description', 'Subject.Name', 'Spectral.Notes']
+		self.fields = fields
+		
+		# Word -> { record key -> [positions] }
+		self.postings = {}
+		# Record key -> number of words
+		self.lengths = {}
+		# Record key -> distinct words
+		self.words = {}
+	
+	def tokenize(self, text):
+		"""
+		Splits text into case folded words.
+		
+		:return: List of unicode strings
+		"""
+		if isinstance(text, str):
+			text = text.decode('utf-8', 'replace')
+		return [word.lower() for word in self.word_re.findall(text)]
+	
+	def _positions(self, data):
+		"""
+		:return: Dictionary of word to positions, and the total number of words
+		"""
+		positions = {}
+		length = 0
+		offset = 0
+		for field in self.fields:
+			value = data.get(field)
+			if not value:
+				continue
+			if not isinstance(value, basestring):
+				value = ' '.join([item for item in value if item and item != '-'])
+			
+			words = self.tokenize(value)
+			for position, word in enumerate(words):
+				positions.setdefault(word, []).append(offset + position)
+			length += len(words)
+			offset += len(words) + self.field_gap
+		return positions, length
+	
+	def add(self, key, data):
+		"""
+		Indexes the text fields of an AVM dictionary under a record key.
+		"""
+		self.remove(key)
+		
+		positions, length = self._positions(data)
+		for word, word_positions in positions.iteritems():
+			self.postings.setdefault(word, {})[key] = word_positions
+		self.lengths[key] = length
+		self.words[key] = positions.keys()
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		if key not in self.lengths:
+			return
+		
+		for word in self.words.pop(key):
+			postings = self.postings[word]
+			del postings[key]
+			if not postings:
+				del self.postings[word]
+		del self.lengths[key]
+	
+	def keys(self):
+		return self.lengths.keys()
+	
+	def __contains__(self, key):
+		return key in self.lengths
+	
+	def __len__(self):
+		return len(self.lengths)
+	
+	#
+	# Queries
+	#
+	def parse_query(self, query):
+		"""
+		Splits a query into terms.  Words in double quotes form a phrase.
+		
+		:return: List of terms, each term being a list of words
+		"""
+		terms = []
+		for phrase, word in self.phrase_re.findall(query):
+			words = self.tokenize(phrase or word)
+			if words:
+				terms.append(words)
+		return terms
+	
+	def _phrase_matches(self, phrase, candidates):
+		"""
+		:return: Dictionary of record key to number of occurrences of the phrase
+		"""
+		matches = {}
+		first = self.postings[phrase[0]]
+		for key in candidates:
+			starts = set(first[key])
+			for offset, word in enumerate(phrase[1:]):
+				positions = self.postings[word][key]
+				starts &= set([position - offset - 1 for position in positions])
+				if not starts:
+					break
+			if starts:
+				matches[key] = len(starts)
+		return matches
+	
+	def search(self, query, limit=None):
+		"""
+		Finds the records containing every word and phrase of the query.
+		
+		:param query: Query string
+		:param limit: Maximum number of results
+		
+		:return: List of (record key, score) tuples, best match first
+		"""
+		terms = self.parse_query(query)
+		if not terms:
+			return []
+		
+		words = set([word for term in terms for word in term])
+		for word in words:
+			if word not in self.postings:
+				return []
+		
+		# Intersect starting from the rarest word
+		ordered = sorted(words, key=lambda word: len(self.postings[word]))
+		candidates = set(self.postings[ordered[0]])
+		for word in ordered[1:]:
+			candidates.intersection_update(self.postings[word])
+			if not candidates:
+				return []
+		
+		num_records = float(len(self.lengths))
+		scores = dict([(key, 0.0) for key in candidates])
+		
+		for term in terms:
+			if len(term) == 1:
+				postings = self.postings[term[0]]
+				frequencies = dict([(key, len(postings[key])) for key in candidates])
+			else:
+				frequencies = self._phrase_matches(term, candidates)
+				candidates = set(frequencies)
+				if not candidates:
+					return []
+			
+			idf = math.log(1.0 + num_records / len(self.postings[term[0]]))
+			for key in candidates:
+				scores[key] += (1.0 + math.log(frequencies[key])) * idf
+		
+		results = [(key, scores[key] / math.sqrt(self.lengths[key])) for key in candidates]
+		results.sort(key=lambda result: result[1], reverse=True)
+		
+		if limit is not None:
+			results = results[:limit]
+		return results
+
+
+def _timestamp( value ):
+	"""
+	Converts a date or datetime to seconds since the epoch.  Naive datetimes are taken to be
+	UTC.  Numbers are returned unchanged.
+	"""
+	if isinstance(value, datetime.datetime):
+		return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+	if isinstance(value, datetime.date):
+		return float(calendar.timegm(value.timetuple()))
+	return float(value)
+
+
+class AVMIntervalIndex( AVMIndex ):
+	"""
+	Interval index over exposures.  Each entry of ``Temporal.StartTime`` is paired with the
+	corresponding ``Temporal.IntegrationTime`` (in seconds) to form the interval
+	[start, start + integration time].  Missing integration times give zero length
+	intervals.
+	
+	Intervals are kept sorted by start, alongside an implicit max-end tree, so overlap and
+	stabbing queries take logarithmic time plus the size of the result.  The sorted arrays
+	are built in one go (with NumPy when available) the first time the index is queried
+	after a change::
+	
+		index.overlapping(datetime.date(2012, 3, 1), datetime.date(2012, 3, 5))
+		index.containing(datetime.datetime(2012, 3, 2, 12, 0))
+	
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	start_field = 'Temporal.StartTime'
+	duration_field = 'Temporal.IntegrationTime'
+	
+	def __init__(self, specs=SPECS_1_1):
+		super( AVMIntervalIndex, self).__init__(specs)
+		# Record key -> list of (start, end) timestamps
+		self.intervals = {}
+		self._dirty = True
+		self._clear()
+	
+	def _clear(self):
+		self._keys = []
+		self._starts = []
+		self._sorted_ends = []
+		self._tree = []
+		self._size = 0
+	
+	def _intervals(self, data):
+		starts = data.get(self.start_field) or []
+		durations = data.get(self.duration_field) or []
+		
+		intervals = []
+		for i, start in enumerate(starts):
+			if not isinstance(start, datetime.date):
+				continue
+			try:
+				duration = float(durations[i])
+			except (IndexError, TypeError, ValueError):
+				duration = 0.0
+			
+			start = _timestamp(start)
+			intervals.append((start, start + max(duration, 0.0)))
+		return intervals
+	
+	def add(self, key, data):
+		"""
+		Indexes the exposures of an AVM dictionary under a record key.
+		"""
+		self.remove(key)
+		intervals = self._intervals(data)
+		if intervals:
+			self.intervals[key] = intervals
+			self._dirty = True
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		if self.intervals.pop(key, None) is not None:
+			self._dirty = True
+	
+	def keys(self):
+		return self.intervals.keys()
+	
+	def __contains__(self, key):
+		return key in self.intervals
+	
+	def __len__(self):
+		return len(self.intervals)
+	
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		for name in ('_keys', '_starts', '_sorted_ends', '_tree', '_size'):
+			del state[name]
+		state['_dirty'] = True
+		return state
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._clear()
+	
+	def build(self):
+		"""
+		Sorts the intervals and builds the max-end tree.  Called automatically by the query
+		methods when the index has changed.
+		"""
+		keys = []
+		starts = []
+		ends = []
+		for key, intervals in self.intervals.iteritems():
+			for start, end in intervals:
+				keys.append(key)
+				starts.append(start)
+				ends.append(end)
+		
+		size = 1
+		while size < len(starts):
+			size <<= 1
+		
+		if numpy is not None and starts:
+			starts = numpy.array(starts, dtype=numpy.float64)
+			ends = numpy.array(ends, dtype=numpy.float64)
+			order = numpy.argsort(starts, kind='mergesort')
+			
+			tree = numpy.empty(2 * size, dtype=numpy.float64)
+			tree.fill(-numpy.inf)
+			tree[size:size + len(order)] = ends[order]
+			level = size
+			while level > 1:
+				tree[level // 2:level] = numpy.maximum(tree[level:2 * level:2], tree[level + 1:2 * level:2])
+				level //= 2
+			
+			self._keys = [keys[i] for i in order.tolist()]
+			self._starts = starts[order].tolist()
+			self._sorted_ends = numpy.sort(ends).tolist()
+			self._tree = tree.tolist()
+		else:
+			order = sorted(range(len(starts)), key=starts.__getitem__)
+			
+			tree = [float('-inf')] * (2 * size)
+			for i, j in enumerate(order):
+				tree[size + i] = ends[j]
+			for node in range(size - 1, 0, -1):
+				tree[node] = max(tree[2 * node], tree[2 * node + 1])
+			
+			self._keys = [keys[j] for j in order]
+			self._starts = [starts[j] for j in order]
+			self._sorted_ends = sorted(ends)
+			self._tree = tree
+		
+		self._size = size
+		self._dirty = False
+	
+	#
+	# Queries
+	#
+	def _positions(self, start, end):
+		"""
+		:return: Positions (in start order) of the intervals overlapping [start, end]
+		"""
+		if self._dirty:
+			self.build()
+		
+		# Only intervals starting before the end of the query can overlap it
+		limit = bisect.bisect_right(self._starts, end)
+		if not limit:
+			return []
+		
+		positions = []
+		tree = self._tree
+		stack = [(1, 0, self._size)]
+		while stack:
+			node, low, width = stack.pop()
+			if low >= limit or tree[node] < start:
+				continue
+			if width == 1:
+				positions.append(low)
+				continue
+			width //= 2
+			stack.append((2 * node + 1, low + width, width))
+			stack.append((2 * node, low, width))
+		return positions
+	
+	def overlapping(self, start, end):
+		"""
+		Finds records with an exposure overlapping the time range [start, end].
+		
+		:param start: Date, datetime or timestamp
+		:param end: Date, datetime or timestamp
+		
+		:return: List of record keys
+		"""
+		positions = self._positions(_timestamp(start), _timestamp(end))
+		keys = []
+		seen = set()
+		for position in positions:
+			key = self._keys[position]
+			if key not in seen:
+				seen.add(key)
+				keys.append(key)
+		return keys
+	
+	def containing(self, moment):
+		"""
+		Finds records with an exposure in progress at a given moment.
+		
+		:return: List of record keys
+		"""
+		return self.overlapping(moment, moment)
+	
+	def count_overlapping(self, start, end):
+		"""
+		Counts the exposures overlapping the time range [start, end], using binary searches
+		only.
+		
+		:return: Number of exposures
+		"""
+		if self._dirty:
+			self.build()
+		
+		start = _timestamp(start)
+		end = _timestamp(end)
+		started = bisect.bisect_right(self._starts, end)
+		finished = bisect.bisect_left(self._sorted_ends, start)
+		return max(started - finished, 0)
+
+
+class AVMHashIndex( AVMIndex ):
+	"""
+	Hash index over identifier fields, answering questions like "which file has this
+	``ID``" or "which images share this ``DatasetID``" in constant time.  List fields such
+	as ``DatasetID`` are indexed under each of their values.
+	
+	:param fields:	List of fields to index, default to ``ID``, ``ResourceID``, ``PublisherID``
+					and ``DatasetID``.
+	:param specs:	AVM specification dictionary, default to SPECS_1_1
+	"""
+	def __init__(self, fields=None, specs=SPECS_1_1):
+		super( AVMHashIndex, self).__init__(specs)
+		
+		if fields is None:
+			fields = ['ID', 'ResourceID', 'PublisherID', 'DatasetID']
+		self.fields = fields
+		
+		# Field -> { value -> set of record keys }
+		self.tables = dict([(field, {}) for field in fields])
+		# Record key -> list of (field, value)
+		self.values = {}
+	
+	def add(self, key, data):
+		"""
+		Indexes the identifiers of an AVM dictionary under a record key.
+		"""
+		self.remove(key)
+		
+		values = []
+		for field in self.fields:
+			value = data.get(field)
+			if not value:
+				continue
+			if isinstance(value, basestring):
+				value = [value]
+			for item in set(value):
+				if item and item != '-':
+					self.tables[field].setdefault(item, set()).add(key)
+					values.append((field, item))
+		self.values[key] = values
+	
+	def remove(self, key):
+		"""
+		Removes a record key from the index.  Unknown keys are ignored.
+		"""
+		values = self.values.pop(key, None)
+		if values is None:
+			return
+		
+		for field, value in values:
+			keys = self.tables[field][value]
+			keys.discard(key)
+			if not keys:
+				del self.tables[field][value]
+	
+	def keys(self):
+		return self.values.keys()
+	
+	def __contains__(self, key):
+		return key in self.values
+	
+	def __len__(self):
+		return len(self.values)
+	
+	#
+	# Queries
+	#
+	def lookup(self, field, value):
+		"""
+		:return: List of record keys having value in field
+		"""
+		if field not in self.tables:
+			raise KeyError, "The field '%s' is not indexed" % field
+		return list(self.tables[field].get(value, ()))
+	
+	def lookup_many(self, field, values):
+		"""
+		Looks up many values of a field at once.
+		
+		:return: Dictionary of value to list of record keys.  Values without records are omitted.
+		"""
+		if field not in self.tables:
+			raise KeyError, "The field '%s' is not indexed" % field
+		
+		table = self.tables[field]
+		results = {}
+		for value in values:
+			if value in table:
+				results[value] = list(table[value])
+		return results
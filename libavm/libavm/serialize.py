@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Streaming export and import of AVM records.
+
+Records are (key, AVM dictionary) tuples, e.g. a file path and the result of
+:func:`libavm.utils.avm_from_file`.  Writers and readers handle one record at a time, so
+memory use does not depend on the size of the collection.  Two formats are available:
+
+* JSON Lines, one JSON object per line, with the record key under ``_key``.  Datetimes are
+  written as ISO 8601 strings and floats as numbers.
+* A compact binary format, where fields are identified by a number and values are packed
+  according to their data type (floats and timestamps as IEEE doubles).
+
+In both formats values are typed by the specification, so readers return datetimes and
+floats; missing entries of float lists are returned as None.
+"""
+
+import struct
+import datetime
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+from dateutil import parser, tz
+
+from libavm.specs import *
+from libavm.columnar import column_kind, encode_datetime, decode_datetime
+
+
+__all__ = ['dump_jsonl', 'load_jsonl', 'dump_binary', 'load_binary']
+
+
+def _float( value ):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+def _utf8( value ):
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	return value
+
+ISO_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d']
+
+def parse_datetime( value ):
+	"""
+	Parses an ISO 8601 string as written by isoformat().  Naive values are tried with strptime
+	first, which is much faster than the generic dateutil parser.
+	"""
+	if isinstance(value, datetime.date):
+		return value
+	if not value:
+		return None
+	
+	tzinfo = None
+	if len(value) > 19 and value[-6] in '+-' and value[-3] == ':':
+		try:
+			minutes = int(value[-5:-3]) * 60 + int(value[-2:])
+		except ValueError:
+			return parser.parse(value)
+		if value[-6] == '-':
+			minutes = -minutes
+		tzinfo = tz.tzoffset(None, minutes * 60)
+		value = value[:-6]
+	
+	for iso_format in ISO_FORMATS:
+		try:
+			return datetime.datetime.strptime(value, iso_format).replace(tzinfo=tzinfo)
+		except ValueError:
+			continue
+	return parser.parse(value)
+
+
+#
+# JSON Lines
+#
+
+def _to_json( kind, value ):
+	if kind == 'float':
+		return _float(value)
+	elif kind in ('date', 'datetime'):
+		if isinstance(value, datetime.date):
+			return value.isoformat()
+		return value
+	elif kind == 'floatlist':
+		return [_float(item) for item in value]
+	elif kind == 'datetimelist':
+		return [isinstance(item, datetime.date) and item.isoformat() or None for item in value]
+	elif kind in ('cvlist', 'stringlist'):
+		return list(value)
+	return value
+
+def _from_json( kind, value ):
+	if kind == 'date':
+		value = parse_datetime(value)
+		if isinstance(value, datetime.datetime):
+			value = value.date()
+		return value
+	elif kind == 'datetime':
+		return parse_datetime(value)
+	elif kind == 'datetimelist':
+		return [parse_datetime(item) for item in value]
+	elif kind in ('cvlist', 'stringlist'):
+		return [_utf8(item) for item in value]
+	return _utf8(value)
+
+def dump_jsonl( records, fileobj, specs=SPECS_1_1 ):
+	"""
+	Writes records as JSON Lines.
+	
+	:param records: Iterable of (key, AVM dictionary) tuples
+	:param fileobj: File object opened for writing
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: Number of records written
+	"""
+	kinds = dict([(key, column_kind(avmdt)) for key, avmdt in specs.items()])
+	
+	count = 0
+	for key, data in records:
+		line = {'_key': key}
+		for field, value in data.iteritems():
+			if field in kinds and value is not None:
+				line[field] = _to_json(kinds[field], value)
+		fileobj.write(json.dumps(line, separators=(',', ':')))
+		fileobj.write('\n')
+		count += 1
+	return count
+
+def load_jsonl( fileobj, specs=SPECS_1_1 ):
+	"""
+	Reads records written by dump_jsonl().
+	
+	:param fileobj: File object opened for reading
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: Iterator of (key, AVM dictionary) tuples
+	"""
+	kinds = dict([(key, column_kind(avmdt)) for key, avmdt in specs.items()])
+	
+	for line in fileobj:
+		if not line.strip():
+			continue
+		
+		line = json.loads(line)
+		key = _utf8(line.pop('_key', None))
+		data = {}
+		for field, value in line.iteritems():
+			field = str(field)
+			if field in kinds and value is not None:
+				data[field] = _from_json(kinds[field], value)
+		yield key, data
+
+
+#
+# Binary format
+#
+
+BINARY_MAGIC = 'AVMB1\0'
+
+_uint8 = struct.Struct('<B')
+_uint16 = struct.Struct('<H')
+_uint32 = struct.Struct('<I')
+_double = struct.Struct('<d')
+_int32 = struct.Struct('<i')
+_timestamp = struct.Struct('<dh')
+
+def _pack_string( value ):
+	value = _utf8(value) or ''
+	return _uint32.pack(len(value)) + value
+
+def _pack_value( kind, value ):
+	if kind == 'float':
+		value = _float(value)
+		if value is None:
+			value = float('nan')
+		return _double.pack(value)
+	elif kind == 'date':
+		if isinstance(value, datetime.datetime):
+			value = value.date()
+		return _int32.pack(isinstance(value, datetime.date) and value.toordinal() or 0)
+	elif kind == 'datetime':
+		return _timestamp.pack(*encode_datetime(value))
+	elif kind == 'floatlist':
+		values = [_float(item) for item in value]
+		values = [item is None and float('nan') or item for item in values]
+		return _uint16.pack(len(values)) + struct.pack('<%dd' % len(values), *values)
+	elif kind == 'datetimelist':
+		return _uint16.pack(len(value)) + ''.join([_timestamp.pack(*encode_datetime(item)) for item in value])
+	elif kind in ('cvlist', 'stringlist'):
+		return _uint16.pack(len(value)) + ''.join([_pack_string(item) for item in value])
+	return _pack_string(value)
+
+def _unpack_value( kind, buf, offset ):
+	"""
+	:return: (value, new offset)
+	"""
+	if kind == 'float':
+		value = _double.unpack_from(buf, offset)[0]
+		if value != value:
+			value = None
+		return value, offset + 8
+	elif kind == 'date':
+		ordinal = _int32.unpack_from(buf, offset)[0]
+		return ordinal and datetime.date.fromordinal(ordinal) or None, offset + 4
+	elif kind == 'datetime':
+		return decode_datetime(*_timestamp.unpack_from(buf, offset)), offset + _timestamp.size
+	elif kind in ('floatlist', 'datetimelist', 'cvlist', 'stringlist'):
+		count = _uint16.unpack_from(buf, offset)[0]
+		offset += 2
+		if kind == 'floatlist':
+			values = struct.unpack_from('<%dd' % count, buf, offset)
+			return [None if value != value else value for value in values], offset + 8 * count
+		values = []
+		for i in range(count):
+			value, offset = _unpack_value(kind == 'datetimelist' and 'datetime' or 'string', buf, offset)
+			values.append(value)
+		return values, offset
+	
+	length = _uint32.unpack_from(buf, offset)[0]
+	offset += 4
+	return buf[offset:offset + length], offset + length
+
+def dump_binary( records, fileobj, specs=SPECS_1_1 ):
+	"""
+	Writes records in the compact binary format.
+	
+	:param records: Iterable of (key, AVM dictionary) tuples
+	:param fileobj: File object opened for writing in binary mode
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: Number of records written
+	"""
+	fields = sorted(specs.keys())
+	header = json.dumps(fields)
+	fileobj.write(BINARY_MAGIC + _uint32.pack(len(header)) + header)
+	
+	numbers = dict([(field, i) for i, field in enumerate(fields)])
+	kinds = dict([(field, column_kind(specs[field])) for field in fields])
+	
+	count = 0
+	for key, data in records:
+		parts = [_pack_string(key)]
+		num_fields = 0
+		for field, value in data.iteritems():
+			if field in numbers and value is not None:
+				parts.append(_uint8.pack(numbers[field]))
+				parts.append(_pack_value(kinds[field], value))
+				num_fields += 1
+		
+		record = _uint16.pack(num_fields) + ''.join(parts)
+		fileobj.write(_uint32.pack(len(record)) + record)
+		count += 1
+	return count
+
+def load_binary( fileobj, specs=SPECS_1_1 ):
+	"""
+	Reads records written by dump_binary().
+	
+	:param fileobj: File object opened for reading in binary mode
+	:param specs: AVM specification dictionary, default to SPECS_1_1
+	
+	:return: Iterator of (key, AVM dictionary) tuples
+	"""
+	if fileobj.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+		raise ValueError("Not an AVM binary stream.")
+	
+	length = _uint32.unpack(fileobj.read(4))[0]
+	fields = [str(field) for field in json.loads(fileobj.read(length))]
+	kinds = [field in specs and column_kind(specs[field]) or 'string' for field in fields]
+	
+	while True:
+		prefix = fileobj.read(4)
+		if len(prefix) < 4:
+			break
+		
+		length = _uint32.unpack(prefix)[0]
+		record = fileobj.read(length)
+		if len(record) < length:
+			raise ValueError("Truncated AVM binary stream.")
+		
+		num_fields = _uint16.unpack_from(record, 0)[0]
+		key, offset = _unpack_value('string', record, 2)
+		data = {}
+		for i in range(num_fields):
+			number = _uint8.unpack_from(record, offset)[0]
+			value, offset = _unpack_value(kinds[number], record, offset + 1)
+			data[fields[number]] = value
+		yield key, data
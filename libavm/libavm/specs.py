@@ -40,6 +40,37 @@ from libavm.cv import *
 from libxmp.consts import *
 
 
+class AVMSpecs( dict ):
+	"""
+	Immutable dictionary mapping AVM fields to their data types.  Specifications are shared by
+	all AVMMeta objects and threads, so they cannot be modified in place; derive() creates a
+	new specification instead.
+	"""
+	def _immutable(self, *args, **kwargs):
+		raise TypeError("AVM specifications are immutable, use derive() instead.")
+	
+	__setitem__ = _immutable
+	__delitem__ = _immutable
+	clear = _immutable
+	pop = _immutable
+	popitem = _immutable
+	setdefault = _immutable
+	update = _immutable
+	
+	def __reduce__(self):
+		return (AVMSpecs, (dict(self),))
+	
+	def derive(self, changes):
+		"""
+		:param changes: Dictionary of fields to add or replace
+		
+		:return: New AVMSpecs with the fields of this specification and the changes
+		"""
+		specs = dict(self)
+		specs.update(changes)
+		return AVMSpecs(specs)
+
+
 AVM_SCHEMAS = {
     XMP_NS_IPTCCore: 'Iptc4xmpCore',
     XMP_NS_DC: 'dc',
@@ -48,7 +79,7 @@ AVM_SCHEMAS = {
     XMP_NS_Photoshop: 'photoshop',
 }
 
-SPECS_1_1 = {
+SPECS_1_1 = AVMSpecs({
     # Creator Metadata
     'Creator' : AVMString(XMP_NS_Photoshop, 'photoshop:Source'),
     'CreatorURL': AVMURL(XMP_NS_IPTCCore, 'Iptc4xmpCore:CreatorContactInfo/Iptc4xmpCore:CiUrlWork'),
@@ -111,10 +142,17 @@ SPECS_1_1 = {
     'RelatedResources': AVMUnorderedStringList(XMP_NS_AVM, 'avm:RelatedResources'),
     'MetadataDate': AVMDateTime(XMP_NS_AVM, 'avm:MetadataDate'),
     'MetadataVersion': AVMFloat(XMP_NS_AVM, 'avm:MetadataVersion'),
-}
+})
     
-SPECS_1_2 = SPECS_1_1
-# Content Metadata
-SPECS_1_2['PublicationID'] = AVMUnorderedStringList(XMP_NS_AVM, 'avm:PublicationID')
-SPECS_1_2['ProposalID'] = AVMUnorderedStringList(XMP_NS_AVM, 'avm:ProposalID')
-SPECS_1_2["RelatedResources"] = AVMUnorderedStringList(XMP_NS_AVM, 'avm:RelatedResources', deprecated=True)
\ No newline at end of file
+SPECS_1_2 = SPECS_1_1.derive({
+    # Content Metadata
+    'PublicationID': AVMUnorderedStringList(XMP_NS_AVM, 'avm:PublicationID'),
+    'ProposalID': AVMUnorderedStringList(XMP_NS_AVM, 'avm:ProposalID'),
+    'RelatedResources': AVMUnorderedStringList(XMP_NS_AVM, 'avm:RelatedResources', deprecated=True),
+})
+
+# Specifications by AVM version
+SPECS = {
+    '1.1': SPECS_1_1,
+    '1.2': SPECS_1_2,
+}
\ No newline at end of file
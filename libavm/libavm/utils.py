@@ -29,33 +29,123 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE
 
+import os
+import copy
+import mmap
+import time
+import fcntl
+import struct
+import atexit
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
 import libavm
+from libavm.filetypes import classify, open_flags
 try:
 	import libxmp
 	from libxmp import XMPError
 except ImportError:
 	pass
 
-__all__ = ['avm_from_file', 'avm_obj_from_file', 'avm_to_file']
+__all__ = [
+	'avm_from_file',
+	'avm_obj_from_file',
+	'avm_to_file',
+	'xmp_to_file',
+	'AVMCache',
+	'AVMDiskStore',
+	'AVMSharedStore',
+	'enable_cache',
+	'disable_cache',
+	'get_cache',
+	'file_stamp',
+	'READ_STRATEGIES',
+	'sidecar_path',
+	'sync_sidecars',
+	'AVMWriteBehind',
+	'XMPSession',
+	'AVMSessionPool',
+	'handle_stats',
+	'enable_xmp_pool',
+	'disable_xmp_pool',
+]
 
 #
 # Easy read/write functions 
 #
 
-def avm_from_file( file_path ):
+# Options of XMPFiles.open_file() for the read strategies
+READ_STRATEGIES = {
+	'default': {'open_read': True},
+	'onlyxmp': {'open_read': True, 'open_onlyxmp': True},
+	'smarthandler': {'open_read': True, 'open_onlyxmp': True, 'open_usesmarthandler': True},
+	'packetscanning': {'open_read': True, 'open_usepacketscanning': True},
+	'limitscanning': {'open_read': True, 'open_onlyxmp': True, 'open_limitscanning': True},
+}
+
+def _read_xmp( file_path, strategy='auto', format=None ):
+	"""
+	Reads the XMP packet of a file.
+	
+	With the 'auto' strategy, the format of the file is detected first, to open it with the
+	options suited to the format, to parse XMP sidecar files directly, and to reject hopeless
+	files without calling Exempi.  Files that cannot be opened with these options are opened
+	again with the default options.  Other strategies open every file with the options given
+	by READ_STRATEGIES.
+	
+	:param format: Format of the file, if already found by libavm.filetypes.classify() with the 'auto' strategy
+	
+	:return: XMPMeta object, or None if the file has no XMP
+	:raises: XMPError if the file cannot be opened
+	"""
+	if strategy == 'auto':
+		if format is None:
+			format, reason = classify(file_path)
+			if reason is not None:
+				raise XMPError(reason)
+		
+		if format == 'xmp':
+			with open(file_path, 'rb') as f:
+				return libxmp.XMPMeta(xmp_str=f.read())
+		try:
+			with XMPSession(file_path, **open_flags(format)) as session:
+				return session.get_xmp()
+		except XMPError:
+			# e.g. no smart handler accepts the file, while the default handler selection may
+			flags = READ_STRATEGIES['default']
+	elif strategy in READ_STRATEGIES:
+		flags = READ_STRATEGIES[strategy]
+	else:
+		raise ValueError("Unknown read strategy '%s'." % strategy)
+	
+	with XMPSession(file_path, **flags) as session:
+		return session.get_xmp()
+
+def avm_from_file( file_path, strategy='auto', sidecar=False, format=None ):
 	"""
 	Function to retrieve the XMP packet from a file
 	
 	:param file_path: Path to file
+	:param strategy: How to open the file: 'auto' to choose the options from the format of the file, or one of READ_STRATEGIES
+	:param sidecar: Boolean to read the XMP sidecar of the file instead, when it is fresh.  See sidecar_path().
+	:param format: Format of the file as found by libavm.filetypes.classify(), to skip detecting it again with the 'auto' strategy
 	
 	:return: A dictionary with AVM data
 	"""
-	xmpfile = libxmp.files.XMPFiles()
+	if sidecar:
+		path = _fresh_sidecar(file_path)
+		if path is not None:
+			file_path, format = path, None
+	
+	if _cache is not None:
+		return _cache.get_data(file_path, strategy, format) or {}
 	
 	try:
-		xmpfile.open_file(file_path, open_option=libxmp.files.XMP_OPEN_READ)
-		xmp = xmpfile.get_xmp()
-		xmpfile.close_file()
+		xmp = _read_xmp(file_path, strategy, format)
 	except libxmp.XMPError:
 		return {}
 	
@@ -63,64 +153,1078 @@ def avm_from_file( file_path ):
 	return avm.data
 
 
-def avm_obj_from_file( file_path ):
+def avm_obj_from_file( file_path, strategy='auto', sidecar=False, format=None ):
 	"""
 	Function to retrieve the XMP packet from a file
 	
 	:param file_path: Path to file
+	:param strategy: How to open the file, see avm_from_file()
+	:param sidecar: Boolean to read the XMP sidecar of the file when it is fresh, see avm_from_file()
+	:param format: Format of the file, if known, see avm_from_file()
 	
 	:return: A dictionary with AVM data
 	"""
-	xmpfile = libxmp.files.XMPFiles()
+	if sidecar:
+		path = _fresh_sidecar(file_path)
+		if path is not None:
+			file_path, format = path, None
+	
+	if _cache is not None:
+		return _cache.get(file_path, strategy, format)
 	
 	try:
-		xmpfile.open_file(file_path, open_option=libxmp.files.XMP_OPEN_READ)
-		xmp = xmpfile.get_xmp()
-		xmpfile.close_file()
+		xmp = _read_xmp(file_path, strategy, format)
 	except libxmp.XMPError:
 		return None
 	
 	avm = libavm.AVMMeta(xmp=xmp)
 	return avm
 
-def avm_to_file( file_path, dict={}, replace=False ):
+def avm_to_file( file_path, dict={}, replace=False, sidecar=False, embed=False ):
 	"""
 	Function to inject AVM into a file.  Preserves existing XMP in the file, while replacing
 	fields passed through dict.
 	
 	If a field is an unordered list, then data is appended to existing values
 	
+	In sidecar mode the XMP is written to the sidecar of the file, starting from the XMP of
+	the fresh sidecar if any, else of the file.  The file itself is only updated if embed is
+	True; otherwise sync_sidecars() embeds the sidecar later.
 	
 	:param file_path: Path to file
 	:param dict: A dictionary containing AVM metadata
 	:param xmp: An XMPMeta instance
 	:param replace: Boolean to replace the exisiting XMP in the file.  By default it is set to False.
+	:param sidecar: Boolean to write to the XMP sidecar of the file.  See sidecar_path().
+	:param embed: Boolean to also write the XMP into the file in sidecar mode
 	
 	:return: Boolean
 	
 	.. todo:: Improve avm_to_file function.  Add ability to input an XMP file
 	"""
-	xmpfile = libxmp.files.XMPFiles()
+	if sidecar:
+		return _avm_to_sidecar(file_path, dict, replace, embed)
+	
+	if _cache is not None:
+		_cache.invalidate(file_path)
 	
 	try:
-		xmpfile.open_file(file_path, open_forupdate=True)
+		session = XMPSession(file_path, open_forupdate=True)
 	except libxmp.XMPError:
 		return False
+	
+	avm = None
+	try:
+		with session:
+			if replace is True:
+				xmp = None
+			else:
+				xmp = session.get_xmp()
+			
+			avm = libavm.AVMMeta(xmp=xmp, avm_dict=dict, pool=_xmp_pool)
+			return session.put_xmp(avm.xmp)
+	finally:
+		if avm is not None:
+			avm.release()
 
-	if replace is True:
-		xmp = libxmp.XMPMeta()
-	else:
-		xmp = xmpfile.get_xmp()
-		if xmp:
-			pass
-		else:
-			xmp = libxmp.XMPMeta()
+
+def xmp_to_file( file_path, xmp ):
+	"""
+	Function to write an XMP packet to a file as is, replacing the XMP of the file.  Unlike
+	avm_to_file(), the packet is neither read back nor validated.
+	
+	:param file_path: Path to file
+	:param xmp: An XMPMeta instance
+	
+	:return: Boolean
+	"""
+	if _cache is not None:
+		_cache.invalidate(file_path)
+	
+	try:
+		session = XMPSession(file_path, open_forupdate=True)
+	except libxmp.XMPError:
+		return False
+	
+	with session:
+		return session.put_xmp(xmp)
+
+
+#
+# Sessions
+#
+
+# Objects closed at interpreter exit, without keeping them alive
+_close_at_exit = weakref.WeakSet()
+
+def _close_all():
+	for obj in list(_close_at_exit):
+		obj.close()
+
+atexit.register(_close_all)
+
+_handles = {'open': 0, 'opened': 0, 'peak': 0}
+_handles_lock = threading.Lock()
+
+def handle_stats():
+	"""
+	:return: Dictionary with the number of XMPFiles handles currently open, opened since the start of the process, and open at the same time at most
+	"""
+	with _handles_lock:
+		return dict(_handles)
+
+class XMPSession( object ):
+	"""
+	An open XMPFiles handle, closed by close() or at the end of a with block, also when an
+	exception is raised in the block::
+	
+		with XMPSession(file_path, open_forupdate=True) as session:
+			xmp = session.get_xmp()
+			...
+			session.put_xmp(xmp)
+	
+	Changes are written to the file when the session is closed.
+	
+	:param file_path: Path to file
+	:param flags: Options of XMPFiles.open_file(), e.g. open_forupdate=True
+	:raises: XMPError if the file cannot be opened
+	"""
+	def __init__(self, file_path, **flags):
+		self.file_path = file_path
+		self.for_update = bool(flags.get('open_forupdate'))
+		self.modified = False
+		
+		self.xmpfile = libxmp.files.XMPFiles()
+		self.xmpfile.open_file(file_path, **flags)
+		with _handles_lock:
+			_handles['open'] += 1
+			_handles['opened'] += 1
+			_handles['peak'] = max(_handles['peak'], _handles['open'])
+	
+	@property
+	def closed(self):
+		return self.xmpfile is None
 	
-	avm = libavm.AVMMeta(xmp=xmp, avm_dict=dict)
+	def get_xmp(self):
+		"""
+		:return: XMPMeta object, or None if the file has no XMP
+		"""
+		return self.xmpfile.get_xmp()
 	
-	if xmpfile.can_put_xmp(avm.xmp):
-		xmpfile.put_xmp(avm.xmp)
-		xmpfile.close_file()
+	def put_xmp(self, xmp):
+		"""
+		Replaces the XMP of the file, if the file format allows it.
+		
+		:return: Boolean
+		"""
+		if not self.xmpfile.can_put_xmp(xmp):
+			return False
+		self.xmpfile.put_xmp(xmp)
+		self.modified = True
+		if _cache is not None:
+			_cache.invalidate(self.file_path)
 		return True
-	else:
-		return False
\ No newline at end of file
+	
+	def close(self, close_flags=0):
+		"""
+		Closes the handle, writing the changes to the file.  Closing twice is harmless.
+		"""
+		if self.xmpfile is None:
+			return
+		xmpfile = self.xmpfile
+		self.xmpfile = None
+		try:
+			xmpfile.close_file(close_flags)
+		finally:
+			with _handles_lock:
+				_handles['open'] -= 1
+			if self.modified and _cache is not None:
+				_cache.invalidate(self.file_path)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
+
+
+class AVMSessionPool( object ):
+	"""
+	Bounded pool of sessions open for update, for repeated read/modify/write cycles on the same
+	files without reopening them.  At most maxsize files are open at once; when the pool is
+	full, the least recently used idle session is closed, or callers wait for one.  A session
+	is used by one thread at a time.  Changes reach the file when its session is closed, by
+	eviction, release() or close(); pools not closed are closed when garbage collected or at
+	interpreter exit::
+	
+		with AVMSessionPool(maxsize=8) as pool:
+			with pool.session('mosaic.tif') as session:
+				avm = libavm.AVMMeta(xmp=session.get_xmp())
+				avm['Title'] = 'Orion'
+				session.put_xmp(avm.xmp)
+	
+	:param maxsize: Maximum number of open sessions
+	"""
+	def __init__(self, maxsize=16):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._sessions = OrderedDict()
+		self._busy = set()
+		self._opening = 0
+		self._condition = threading.Condition()
+		_close_at_exit.add(self)
+	
+	def __del__(self):
+		# Sessions are already closed at interpreter exit, when module globals may be gone
+		if self._sessions:
+			self.close()
+	
+	def _acquire(self, file_path):
+		evicted = None
+		self._condition.acquire()
+		try:
+			while True:
+				if file_path in self._busy:
+					self._condition.wait()
+					continue
+				session = self._sessions.pop(file_path, None)
+				if session is not None:
+					self._sessions[file_path] = session
+					self._busy.add(file_path)
+					self.hits += 1
+					return session
+				if len(self._sessions) + self._opening < self.maxsize:
+					break
+				idle = [path for path in self._sessions if path not in self._busy]
+				if idle:
+					evicted = self._sessions.pop(idle[0])
+					self.evictions += 1
+					break
+				self._condition.wait()
+			self._busy.add(file_path)
+			self._opening += 1
+			self.misses += 1
+		finally:
+			self._condition.release()
+		
+		session = None
+		try:
+			if evicted is not None:
+				evicted.close()
+			session = XMPSession(file_path, open_forupdate=True)
+			return session
+		finally:
+			self._condition.acquire()
+			try:
+				self._opening -= 1
+				if session is None:
+					self._busy.discard(file_path)
+					self._condition.notify_all()
+				else:
+					self._sessions[file_path] = session
+			finally:
+				self._condition.release()
+	
+	def _release(self, file_path, discard=False):
+		self._condition.acquire()
+		try:
+			self._busy.discard(file_path)
+			session = discard and self._sessions.pop(file_path, None)
+			self._condition.notify_all()
+		finally:
+			self._condition.release()
+		if session:
+			session.close()
+	
+	@contextmanager
+	def session(self, file_path):
+		"""
+		Context manager lending the session of a file, opening it if needed.  If the block raises
+		an exception, the session is closed and dropped from the pool.
+		
+		:raises: XMPError if the file cannot be opened
+		"""
+		file_path = os.path.abspath(file_path)
+		session = self._acquire(file_path)
+		try:
+			yield session
+		except:
+			self._release(file_path, discard=True)
+			raise
+		self._release(file_path)
+	
+	def release(self, file_path):
+		"""
+		Closes the session of a file, writing its changes, unless it is in use.
+		"""
+		file_path = os.path.abspath(file_path)
+		self._condition.acquire()
+		try:
+			if file_path in self._busy:
+				return
+			session = self._sessions.pop(file_path, None)
+		finally:
+			self._condition.release()
+		if session is not None:
+			session.close()
+	
+	def close(self):
+		"""
+		Closes all idle sessions, writing their changes.
+		"""
+		self._condition.acquire()
+		try:
+			sessions = [self._sessions.pop(path) for path in list(self._sessions) if path not in self._busy]
+		finally:
+			self._condition.release()
+		for session in sessions:
+			session.close()
+	
+	def stats(self):
+		"""
+		:return: Dictionary with the number of open sessions, hits, misses and evictions
+		"""
+		self._condition.acquire()
+		try:
+			return {
+				'open': len(self._sessions),
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+			}
+		finally:
+			self._condition.release()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
+
+
+#
+# Sidecar files
+#
+
+def sidecar_path( file_path ):
+	"""
+	:return: Path of the XMP sidecar of a file, the file name followed by .xmp, e.g. mosaic.tif.xmp.  Files sharing a base name in different formats have distinct sidecars.
+	"""
+	return file_path + '.xmp'
+
+def _fresh_sidecar( file_path ):
+	"""
+	:return: Path of the sidecar of a file if it exists and is newer than the file, else None.  A sidecar modified in the same instant as its file is stale, as after embedding it on file systems with a coarse modification time.
+	"""
+	if os.path.splitext(file_path)[1].lower() == '.xmp':
+		return None
+	
+	path = sidecar_path(file_path)
+	stamp = file_stamp(path)
+	if stamp is None:
+		return None
+	file_path_stamp = file_stamp(file_path)
+	if file_path_stamp is None or stamp[1] > file_path_stamp[1]:
+		return path
+	return None
+
+def _write_sidecar( file_path, xmp ):
+	"""
+	Writes the sidecar of a file atomically.
+	"""
+	path = sidecar_path(file_path)
+	if _cache is not None:
+		_cache.invalidate(path)
+	
+	tmp_path = '%s.%d.tmp' % (path, os.getpid())
+	with open(tmp_path, 'wb') as f:
+		f.write(xmp.serialize_to_str())
+	os.rename(tmp_path, path)
+
+def _avm_to_sidecar( file_path, dict, replace, embed ):
+	if not os.path.exists(file_path):
+		return False
+	
+	xmp = None
+	if not replace:
+		# Starting from an empty packet would drop the properties of the file once embedded
+		try:
+			xmp = _read_xmp(_fresh_sidecar(file_path) or file_path)
+		except libxmp.XMPError:
+			return False
+	
+	with libavm.AVMMeta(xmp=xmp, avm_dict=dict, pool=_xmp_pool) as avm:
+		_write_sidecar(file_path, avm.xmp)
+		
+		if embed:
+			return xmp_to_file(file_path, avm.xmp)
+		return True
+
+def sync_sidecars( file_paths, remove=False ):
+	"""
+	Embeds the fresh sidecars of files into the files, e.g. to apply the writes deferred by
+	avm_to_file(sidecar=True) during off-peak hours.  Once embedded, a sidecar is older than
+	its file and no longer read.
+	
+	:param file_paths: Iterable of paths of the files, e.g. from libavm.walk.walk_files()
+	:param remove: Boolean to delete the sidecars once embedded
+	
+	:return: List of (path, status) tuples, with status 'embedded', 'failed', or 'skipped' for files without a fresh sidecar
+	"""
+	results = []
+	for file_path in file_paths:
+		path = _fresh_sidecar(file_path)
+		if path is None or not os.path.exists(file_path):
+			results.append((file_path, 'skipped'))
+			continue
+		
+		try:
+			xmp = _read_xmp(path)
+		except libxmp.XMPError:
+			xmp = None
+		if xmp is None or not xmp_to_file(file_path, xmp):
+			results.append((file_path, 'failed'))
+			continue
+		
+		if remove:
+			os.remove(path)
+		results.append((file_path, 'embedded'))
+	return results
+
+
+#
+# Write-behind
+#
+
+def _write_behind_timer( ref, condition ):
+	"""
+	Timer thread of an AVMWriteBehind queue, writing the files whose oldest edit is due.  The
+	queue is only referenced while it has pending edits, so that an idle queue can be garbage
+	collected.
+	"""
+	condition.acquire()
+	try:
+		while True:
+			queue = ref()
+			if queue is None or queue._closed:
+				return
+			timeout = queue._dispatch_due()
+			if timeout is None:
+				queue = None
+			condition.wait(timeout)
+	finally:
+		condition.release()
+
+def _write_behind_collected( pool, condition ):
+	"""
+	Stops the threads of a garbage collected AVMWriteBehind queue.
+	"""
+	def collected( ref ):
+		condition.acquire()
+		try:
+			condition.notify_all()
+		finally:
+			condition.release()
+		pool.close()
+	return collected
+
+class AVMWriteBehind( object ):
+	"""
+	Write-behind queue for avm_to_file().  Successive edits of a file are merged into one
+	pending write, field by field with the latest value winning, and written once the oldest
+	edit is delay seconds old, once max_pending files are pending, or on flush().  Writes run
+	on a pool of threads; a file is never written by two threads at once, and edits received
+	during a write are written after it.
+	
+	close() writes all pending edits, and is called at interpreter exit for queues still in
+	use.  Idle queues no longer referenced are garbage collected::
+	
+		queue = AVMWriteBehind(delay=5.0)
+		queue.write('mosaic.tif', {'Title': 'Orion'})
+		queue.write('mosaic.tif', {'Headline': 'Orion Nebula'})  # Same write as the title
+	
+	:param delay: Seconds an edit may wait before being written
+	:param max_pending: Number of pending files triggering a flush
+	:param workers: Number of writer threads
+	:param sidecar: Boolean to write to sidecar files, see avm_to_file()
+	:param on_error: Function called with the path and the exception (or None) of a failed write
+	"""
+	def __init__(self, delay=2.0, max_pending=100, workers=2, sidecar=False, on_error=None):
+		self.delay = delay
+		self.max_pending = max_pending
+		self.sidecar = sidecar
+		self.on_error = on_error
+		
+		self.edits = 0
+		self.writes = 0
+		self.errors = 0
+		
+		self._pending = OrderedDict()
+		self._in_flight = set()
+		self._condition = threading.Condition()
+		self._closed = False
+		self._pool = ThreadPool(workers)
+		self._ref = weakref.ref(self, _write_behind_collected(self._pool, self._condition))
+		self._timer = threading.Thread(target=_write_behind_timer, args=(self._ref, self._condition))
+		self._timer.daemon = True
+		self._timer.start()
+		_close_at_exit.add(self)
+	
+	def write(self, file_path, data, replace=False):
+		"""
+		Queues an edit of a file.  With replace, the edit discards the pending edits of the file
+		and replaces its XMP when written.
+		
+		:param file_path: Path to file
+		:param data: A dictionary containing AVM metadata
+		:param replace: Boolean to replace the existing XMP of the file
+		"""
+		file_path = os.path.abspath(file_path)
+		self._condition.acquire()
+		try:
+			if self._closed:
+				raise ValueError("The write-behind queue is closed.")
+			
+			entry = self._pending.get(file_path)
+			if entry is None:
+				self._pending[file_path] = [dict(data), replace, time.time()]
+			elif replace:
+				entry[0:2] = [dict(data), True]
+			else:
+				entry[0].update(data)
+			self.edits += 1
+			
+			if len(self._pending) >= self.max_pending:
+				self._dispatch(self._pending.keys())
+			self._condition.notify_all()
+		finally:
+			self._condition.release()
+	
+	def pending(self, file_path):
+		"""
+		:return: Copy of the merged edits waiting to be written for a file, or None
+		"""
+		self._condition.acquire()
+		try:
+			entry = self._pending.get(os.path.abspath(file_path))
+			return entry and dict(entry[0])
+		finally:
+			self._condition.release()
+	
+	def _dispatch(self, file_paths):
+		"""
+		Hands pending files to the writers.  Must be called with the condition acquired.
+		"""
+		for file_path in file_paths:
+			if file_path in self._in_flight or file_path not in self._pending:
+				continue
+			data, replace, queued = self._pending.pop(file_path)
+			self._in_flight.add(file_path)
+			self._pool.apply_async(self._write, (file_path, data, replace))
+	
+	def _write(self, file_path, data, replace):
+		error = None
+		try:
+			written = avm_to_file(file_path, data, replace=replace, sidecar=self.sidecar)
+		except Exception, e:
+			written = False
+			error = e
+		
+		self._condition.acquire()
+		try:
+			self._in_flight.discard(file_path)
+			self.writes += 1
+			if not written:
+				self.errors += 1
+			self._condition.notify_all()
+		finally:
+			self._condition.release()
+		
+		if not written and self.on_error is not None:
+			self.on_error(file_path, error)
+	
+	def _dispatch_due(self):
+		"""
+		Hands the files whose oldest edit is due to the writers.  Must be called with the
+		condition acquired.
+		
+		:return: Seconds until the next edit is due, or None if no edit is waiting
+		"""
+		now = time.time()
+		self._dispatch([file_path for file_path, entry in self._pending.items() if now - entry[2] >= self.delay])
+		
+		waiting = [entry[2] + self.delay - now for file_path, entry in self._pending.items() if file_path not in self._in_flight]
+		return waiting and max(0.01, min(waiting)) or None
+	
+	def flush(self):
+		"""
+		Writes all pending edits and waits for the writes to complete.
+		"""
+		self._condition.acquire()
+		try:
+			while self._pending or self._in_flight:
+				self._dispatch(self._pending.keys())
+				self._condition.wait(1.0)
+		finally:
+			self._condition.release()
+	
+	def close(self):
+		"""
+		Writes all pending edits and stops the threads.  Further edits are refused.
+		"""
+		self._condition.acquire()
+		try:
+			if self._closed:
+				return
+			self._closed = True
+			self._condition.notify_all()
+		finally:
+			self._condition.release()
+		
+		_close_at_exit.discard(self)
+		self._timer.join()
+		self.flush()
+		self._pool.close()
+		self._pool.join()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
+
+
+#
+# Caching
+#
+
+def file_stamp( file_path ):
+	"""
+	:return: (size, mtime) of a file, or None if it cannot be accessed
+	"""
+	try:
+		stat = os.stat(file_path)
+	except OSError:
+		return None
+	return (stat.st_size, stat.st_mtime)
+
+
+class AVMDiskStore( object ):
+	"""
+	On-disk second tier for :class:`AVMCache`.  Serialized XMP packets are kept in one
+	file per image, so they survive process restarts.
+	
+	:param directory: Directory holding the cached packets.  It is created if needed.
+	"""
+	def __init__(self, directory):
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+	
+	def _path(self, file_path):
+		return os.path.join(self.directory, hashlib.md5(file_path).hexdigest())
+	
+	def get(self, file_path, stamp):
+		"""
+		:return: Serialized XMP packet stored for the file, or None if missing or stale
+		"""
+		try:
+			f = open(self._path(file_path), 'rb')
+		except IOError:
+			return None
+		try:
+			header = f.readline().rstrip('\n')
+			if header != repr((file_path, stamp)):
+				return None
+			return f.read()
+		finally:
+			f.close()
+	
+	def set(self, file_path, stamp, packet):
+		"""
+		Stores the serialized XMP packet of a file.
+		"""
+		path = self._path(file_path)
+		tmp_path = '%s.%d.tmp' % (path, os.getpid())
+		f = open(tmp_path, 'wb')
+		try:
+			f.write(repr((file_path, stamp)) + '\n')
+			f.write(packet)
+		finally:
+			f.close()
+		os.rename(tmp_path, path)
+	
+	def delete(self, file_path):
+		"""
+		Removes the packet stored for a file.
+		"""
+		try:
+			os.remove(self._path(file_path))
+		except OSError:
+			pass
+
+
+class AVMSharedStore( object ):
+	"""
+	Second tier for :class:`AVMCache` shared by all processes of a host, e.g. the workers of
+	a pre-fork server.  Serialized XMP packets are kept in fixed size slots of a memory
+	mapped file, so every process reads the same pages.
+	
+	Reads take no lock: each slot carries a sequence number which writers make odd while
+	they update the slot, and readers retry when it changed under them.  Writers serialize
+	on a thread lock and an exclusive ``flock`` of the file.  Each path may live in one of two slots; an empty
+	slot is used first, and when both are taken, the least recently written one is evicted.
+	
+	:param file_path: Path of the shared file.  It is created if needed.
+	:param slots: Number of slots
+	:param slot_size: Size of a slot in bytes.  Larger packets are not stored.
+	"""
+	magic = 'AVMSHM1\0'
+	_empty_digest = '\0' * 16
+	header_format = '<8sII'
+	# Sequence number, path digest, stamp (size, mtime), write time, packet length
+	slot_format = '<Q16sQddI4x'
+	
+	def __init__(self, file_path, slots=4096, slot_size=65536):
+		self.file_path = file_path
+		self.header_size = struct.calcsize(self.header_format)
+		self.slot_header_size = struct.calcsize(self.slot_format)
+		
+		self.pid = None
+		self.lock_file = None
+		self.thread_lock = threading.Lock()
+		
+		f = open(file_path, 'a+b')
+		try:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			f.seek(0, os.SEEK_END)
+			if f.tell() < self.header_size:
+				f.truncate(0)
+				f.write(struct.pack(self.header_format, self.magic, slots, slot_size))
+				f.truncate(self.header_size + slots * slot_size)
+				f.flush()
+			
+			f.seek(0)
+			magic, self.slots, self.slot_size = struct.unpack(self.header_format, f.read(self.header_size))
+			if magic != self.magic:
+				raise ValueError("%s is not an AVM shared cache file." % file_path)
+			self.mmap = mmap.mmap(f.fileno(), self.header_size + self.slots * self.slot_size)
+		finally:
+			fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+			f.close()
+	
+	def _lock(self):
+		# flock locks belong to the open file, which is shared with forked children, so each
+		# process opens its own.  Threads of a process share it, and a second flock() from
+		# another thread succeeds at once, so they take the thread lock first.
+		self.thread_lock.acquire()
+		try:
+			if self.pid != os.getpid():
+				self.lock_file = open(self.file_path, 'rb')
+				self.pid = os.getpid()
+			fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+		except:
+			self.thread_lock.release()
+			raise
+	
+	def _unlock(self):
+		try:
+			fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+		finally:
+			self.thread_lock.release()
+	
+	def _candidates(self, digest):
+		first, second = struct.unpack('<QQ', digest)
+		return [
+			self.header_size + (first % self.slots) * self.slot_size,
+			self.header_size + (second % self.slots) * self.slot_size,
+		]
+	
+	def _read_slot(self, offset):
+		"""
+		:return: Slot header tuple and packet, read consistently, or None
+		"""
+		for attempt in range(3):
+			header = struct.unpack_from(self.slot_format, self.mmap, offset)
+			if header[0] % 2:
+				continue
+			start = offset + self.slot_header_size
+			packet = self.mmap[start:start + header[5]]
+			if struct.unpack_from('<Q', self.mmap, offset)[0] == header[0]:
+				return header, packet
+		return None
+	
+	def _write_slot(self, offset, digest, stamp, packet, written=None):
+		# A writer killed mid-write leaves the sequence odd; derive the odd value from it
+		# rather than incrementing, so the next write makes the slot readable again
+		sequence = struct.unpack_from('<Q', self.mmap, offset)[0] | 1
+		struct.pack_into('<Q', self.mmap, offset, sequence)
+		start = offset + self.slot_header_size
+		self.mmap[start:start + len(packet)] = packet
+		struct.pack_into(self.slot_format, self.mmap, offset,
+			sequence + 1, digest, stamp[0], stamp[1], time.time() if written is None else written, len(packet))
+	
+	def get(self, file_path, stamp):
+		"""
+		:return: Serialized XMP packet stored for the file, or None if missing or stale
+		"""
+		digest = hashlib.md5(file_path).digest()
+		for offset in self._candidates(digest):
+			slot = self._read_slot(offset)
+			if slot is None:
+				continue
+			header, packet = slot
+			if header[1] == digest:
+				if (header[2], header[3]) == tuple(stamp):
+					return packet
+				return None
+		return None
+	
+	def set(self, file_path, stamp, packet):
+		"""
+		Stores the serialized XMP packet of a file.
+		"""
+		if len(packet) > self.slot_size - self.slot_header_size:
+			return
+		
+		digest = hashlib.md5(file_path).digest()
+		candidates = self._candidates(digest)
+		
+		self._lock()
+		try:
+			headers = [struct.unpack_from(self.slot_format, self.mmap, offset) for offset in candidates]
+			target = None
+			for offset, header in zip(candidates, headers):
+				if header[1] == digest:
+					target = offset
+					break
+			if target is None:
+				# Use an empty slot, or evict the least recently written one.  Deleted slots
+				# have a zero write time.
+				if headers[1][4] < headers[0][4]:
+					target = candidates[1]
+				else:
+					target = candidates[0]
+			self._write_slot(target, digest, stamp, packet)
+		finally:
+			self._unlock()
+	
+	def delete(self, file_path):
+		"""
+		Removes the packet stored for a file.
+		"""
+		digest = hashlib.md5(file_path).digest()
+		
+		self._lock()
+		try:
+			for offset in self._candidates(digest):
+				if struct.unpack_from(self.slot_format, self.mmap, offset)[1] == digest:
+					self._write_slot(offset, self._empty_digest, (0, 0.0), '', written=0.0)
+		finally:
+			self._unlock()
+
+
+class AVMCache( object ):
+	"""
+	Read-through cache of parsed AVM, keyed by file path and read strategy, and validated
+	against the size and modification time of the file.  At most maxsize AVMMeta objects are
+	kept in memory and the least recently used is evicted first.  An optional store (e.g.
+	:class:`AVMDiskStore`) keeps serialized packets of files read with the 'auto' strategy as
+	a second tier.
+	
+	The cached objects are never handed out: get() returns a copy, which callers may modify.
+	
+	:param maxsize: Maximum number of AVMMeta objects kept in memory
+	:param store: Optional second tier storage
+	"""
+	def __init__(self, maxsize=128, store=None):
+		self.maxsize = maxsize
+		self.store = store
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.store_hits = 0
+		self.evictions = 0
+	
+	def get(self, file_path, strategy='auto', format=None):
+		"""
+		:param strategy: How to open the file on a miss, see avm_from_file()
+		:param format: Format of the file, if known, see avm_from_file()
+		
+		:return: Copy of the AVMMeta object for the file, or None if it could not be read
+		"""
+		avm = self._get(file_path, strategy, format)
+		if avm is None:
+			return None
+		return avm.copy()
+	
+	def get_data(self, file_path, strategy='auto', format=None):
+		"""
+		:param strategy: How to open the file on a miss, see avm_from_file()
+		:param format: Format of the file, if known, see avm_from_file()
+		
+		:return: Copy of the AVM dictionary of the file, or None if it could not be read
+		"""
+		avm = self._get(file_path, strategy, format)
+		if avm is None:
+			return None
+		return copy.deepcopy(avm.data)
+	
+	def _get(self, file_path, strategy, format):
+		"""
+		:return: The cached AVMMeta object, shared and not to be modified
+		"""
+		if strategy != 'auto' and strategy not in READ_STRATEGIES:
+			raise ValueError("Unknown read strategy '%s'." % strategy)
+		
+		file_path = os.path.abspath(file_path)
+		key = (file_path, strategy)
+		stamp = file_stamp(file_path)
+		if stamp is None:
+			self.invalidate(file_path)
+			return None
+		
+		self.lock.acquire()
+		try:
+			entry = self.entries.pop(key, None)
+			if entry is not None and entry[0] == stamp:
+				self.entries[key] = entry
+				self.hits += 1
+				return entry[1]
+			self.misses += 1
+		finally:
+			self.lock.release()
+		
+		xmp = None
+		store = self.store if strategy == 'auto' else None
+		if store is not None:
+			packet = store.get(file_path, stamp)
+			if packet is not None:
+				xmp = libxmp.XMPMeta(xmp_str=packet)
+				self.lock.acquire()
+				try:
+					self.store_hits += 1
+				finally:
+					self.lock.release()
+		
+		if xmp is None:
+			try:
+				xmp = _read_xmp(file_path, strategy, format)
+			except libxmp.XMPError:
+				return None
+			if xmp is not None and store is not None:
+				store.set(file_path, stamp, xmp.serialize_to_str())
+		
+		avm = libavm.AVMMeta(xmp=xmp)
+		
+		self.lock.acquire()
+		try:
+			self.entries[key] = (stamp, avm)
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+		finally:
+			self.lock.release()
+		return avm
+	
+	def invalidate(self, file_path):
+		"""
+		Drops a file, read with any strategy, from both tiers of the cache.
+		"""
+		file_path = os.path.abspath(file_path)
+		self.lock.acquire()
+		try:
+			for key in [key for key in self.entries if key[0] == file_path]:
+				del self.entries[key]
+		finally:
+			self.lock.release()
+		if self.store is not None:
+			self.store.delete(file_path)
+	
+	def clear(self):
+		"""
+		Empties the in-memory tier and resets the statistics.
+		"""
+		self.lock.acquire()
+		try:
+			self.entries.clear()
+			self.hits = self.misses = self.store_hits = self.evictions = 0
+		finally:
+			self.lock.release()
+	
+	def stats(self):
+		"""
+		:return: Dictionary with the number of hits, misses, second tier hits, evictions and entries
+		"""
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'store_hits': self.store_hits,
+			'evictions': self.evictions,
+			'size': len(self.entries),
+		}
+
+
+_cache = None
+
+def enable_cache( maxsize=128, cache_dir=None, shared_file=None ):
+	"""
+	Enables a process wide :class:`AVMCache` used by avm_from_file() and avm_obj_from_file(),
+	and invalidated by avm_to_file().
+	
+	:param maxsize: Maximum number of AVMMeta objects kept in memory
+	:param cache_dir: Optional directory for the on-disk second tier
+	:param shared_file: Optional file for a second tier shared between processes (see :class:`AVMSharedStore`)
+	
+	:return: The AVMCache instance
+	"""
+	global _cache
+	if cache_dir and shared_file:
+		raise ValueError("Only one of cache_dir and shared_file may be given.")
+	
+	store = None
+	if cache_dir:
+		store = AVMDiskStore(cache_dir)
+	elif shared_file:
+		store = AVMSharedStore(shared_file)
+	_cache = AVMCache(maxsize, store)
+	return _cache
+
+def disable_cache():
+	"""
+	Disables the process wide cache.
+	"""
+	global _cache
+	_cache = None
+
+def get_cache():
+	"""
+	:return: The process wide AVMCache, or None if caching is disabled
+	"""
+	return _cache
+
+
+_xmp_pool = None
+
+def enable_xmp_pool( maxsize=16 ):
+	"""
+	Enables a process wide :class:`XMPMetaPool`, reusing the XMPMeta objects of avm_to_file()
+	when a file has no XMP packet or replace is True.
+	
+	:param maxsize: Maximum number of idle XMPMeta objects kept
+	
+	:return: The XMPMetaPool instance
+	"""
+	global _xmp_pool
+	_xmp_pool = libavm.XMPMetaPool(maxsize)
+	return _xmp_pool
+
+def disable_xmp_pool():
+	"""
+	Disables the process wide XMPMeta pool.
+	"""
+	global _xmp_pool
+	_xmp_pool = None
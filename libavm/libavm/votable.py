@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Streaming VOTable writer for AVM records.
+
+Every AVM field becomes a FIELD of the table: floats are written as doubles, fixed length
+float lists (e.g. Spatial.Scale) as double arrays, and all other fields as strings formatted
+like :meth:`libavm.AVMMeta.to_string`.  FIELDs carry a UCD and unit where AVM defines one.
+ObsCore-style position columns (``s_ra``, ``s_dec`` and ``s_fov``) are derived from the
+spatial fields; ``s_ra`` and ``s_dec`` are left empty for images in other frames than ICRS
+or FK5, e.g. galactic coordinates.
+
+Rows are formatted as they are written and flushed every ``chunk_size`` records, so the
+table never has to be held in memory::
+
+	from libavm.votable import AVMVOTableWriter
+	
+	writer = AVMVOTableWriter(open('avm.vot', 'wb'))
+	for file_path in file_paths:
+		writer.write(file_path, avm_from_file(file_path))
+	writer.close()
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+from libavm.specs import *
+from libavm.datatypes import AVMFloat, AVMOrderedFloatList, AVMDate, AVMDateTime
+
+
+__all__ = ['AVMVOTableWriter', 'field_metadata', 'FIELD_UCDS', 'FIELD_UNITS']
+
+
+# UCD1+ words for AVM fields
+FIELD_UCDS = {
+	'ID': 'meta.id',
+	'Title': 'meta.title',
+	'Headline': 'meta.note',
+	'Description': 'meta.note',
+	'Creator': 'meta.curation',
+	'CreatorURL': 'meta.ref.url;meta.curation',
+	'ReferenceURL': 'meta.ref.url',
+	'ResourceURL': 'meta.ref.url',
+	'RelatedResources': 'meta.ref.url',
+	'Date': 'time.release',
+	'Facility': 'instr.obsty',
+	'Instrument': 'instr',
+	'Subject.Name': 'meta.id;src',
+	'Subject.Category': 'meta.code.class',
+	'Spectral.Band': 'instr.bandpass',
+	'Spectral.Bandpass': 'instr.filter',
+	'Spectral.CentralWavelength': 'em.wl.central',
+	'Temporal.StartTime': 'time.start',
+	'Temporal.IntegrationTime': 'time.duration',
+	'Spatial.CoordinateFrame': 'pos.frame',
+	'Spatial.Equinox': 'time.equinox',
+	'Spatial.ReferenceValue': 'pos.eq',
+	'Spatial.ReferenceDimension': 'pos.wcs.naxis',
+	'Spatial.ReferencePixel': 'pos.wcs.crpix',
+	'Spatial.Scale': 'pos.wcs.scale',
+	'Spatial.Rotation': 'pos.posAng',
+	'Spatial.CoordsystemProjection': 'pos.wcs.ctype',
+	'Spatial.CDMatrix': 'pos.wcs.cdmatrix',
+}
+
+# Units of AVM fields, as defined by the AVM standard
+FIELD_UNITS = {
+	'Spectral.CentralWavelength': 'nm',
+	'Temporal.IntegrationTime': 's',
+	'Spatial.ReferenceValue': 'deg',
+	'Spatial.ReferenceDimension': 'pix',
+	'Spatial.ReferencePixel': 'pix',
+	'Spatial.Scale': 'deg/pix',
+	'Spatial.Rotation': 'deg',
+	'Spatial.CDMatrix': 'deg/pix',
+}
+
+# Columns derived from the spatial fields
+POSITION_FIELDS = [
+	('s_ra', 'pos.eq.ra;meta.main', 'Right ascension of the reference pixel'),
+	('s_dec', 'pos.eq.dec;meta.main', 'Declination of the reference pixel'),
+	('s_fov', 'phys.angSize;instr.fov', 'Largest angular extent of the image'),
+]
+
+# Coordinate frames whose reference values are published as s_ra and s_dec.  A missing frame
+# defaults to ICRS.
+_EQUATORIAL_FRAMES = set(['ICRS', 'FK5'])
+
+# Values written as null cells.  Zero is a value.
+_EMPTY_VALUES = (None, '', [])
+
+_NAN = 'NaN'
+
+
+def field_metadata( field, avmdt ):
+	"""
+	Maps an AVM field to VOTable FIELD attributes.
+	
+	:param field: Name of the AVM field
+	:param avmdt: AVM data type of the field
+	
+	:return: Dictionary of FIELD attributes (name, datatype, arraysize, ucd, unit, xtype)
+	"""
+	attributes = {'name': field}
+	if isinstance(avmdt, AVMFloat):
+		attributes['datatype'] = 'double'
+	elif isinstance(avmdt, AVMOrderedFloatList) and avmdt.strict_length:
+		attributes['datatype'] = 'double'
+		attributes['arraysize'] = str(avmdt.length)
+	else:
+		attributes['datatype'] = 'char'
+		attributes['arraysize'] = '*'
+	
+	# Lists of dates are written as semicolon separated strings, not single timestamps
+	if isinstance(avmdt, (AVMDate, AVMDateTime)):
+		attributes['xtype'] = 'timestamp'
+	if field in FIELD_UCDS:
+		attributes['ucd'] = FIELD_UCDS[field]
+	if field in FIELD_UNITS:
+		attributes['unit'] = FIELD_UNITS[field]
+	return attributes
+
+def _float( value ):
+	try:
+		return repr(float(value))
+	except (TypeError, ValueError):
+		return _NAN
+
+def _text( value ):
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+	return escape(str(value))
+
+def _fov( data ):
+	try:
+		scale = data['Spatial.Scale']
+		dimension = data['Spatial.ReferenceDimension']
+		return max(abs(float(scale[0])) * float(dimension[0]), abs(float(scale[1])) * float(dimension[1]))
+	except (KeyError, IndexError, TypeError, ValueError):
+		return None
+
+
+class AVMVOTableWriter( object ):
+	"""
+	Writes AVM records to a VOTable (TABLEDATA serialization) incrementally.  The header
+	is written on construction, and close() terminates the document.
+	
+	:param stream:		File-like object opened for writing
+	:param fields:		List of fields to write, default to all fields of the specification
+	:param specs:		AVM specification dictionary, default to SPECS_1_1
+	:param positions:	Derive the s_ra, s_dec and s_fov columns from the spatial fields
+	:param chunk_size:	Number of rows formatted before writing them to the stream
+	:param name:		Name of the table
+	"""
+	def __init__(self, stream, fields=None, specs=SPECS_1_1, positions=True, chunk_size=1000, name='avm'):
+		self.stream = stream
+		if fields is None:
+			fields = sorted(specs.keys())
+		self.fields = fields
+		self.positions = positions
+		self.chunk_size = chunk_size
+		self.num_rows = 0
+		self._rows = []
+		
+		# One formatter per field, chosen once for the whole table
+		self._formatters = []
+		for field in fields:
+			avmdt = specs[field]
+			attributes = field_metadata(field, avmdt)
+			if attributes['datatype'] == 'char':
+				self._formatters.append((field, self._format_text(avmdt)))
+			elif 'arraysize' in attributes:
+				self._formatters.append((field, self._format_array))
+			else:
+				self._formatters.append((field, _float))
+		
+		self._write_header(name, specs)
+	
+	def _format_text(self, avmdt):
+		format_value = avmdt.format_value
+		return lambda value: _text(format_value(value))
+	
+	def _format_array(self, values):
+		return ' '.join([_float(value) for value in values])
+	
+	def _write_header(self, name, specs):
+		lines = [
+			'<?xml version="1.0" encoding="UTF-8"?>',
+			'<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">',
+			'<RESOURCE type="results">',
+			'<TABLE name=%s>' % quoteattr(name),
+			'<FIELD name="key" datatype="char" arraysize="*" ucd="meta.id;meta.main"/>',
+		]
+		if self.positions:
+			for column, ucd, description in POSITION_FIELDS:
+				lines.append('<FIELD name="%s" datatype="double" ucd="%s" unit="deg"><DESCRIPTION>%s</DESCRIPTION></FIELD>' % (column, ucd, description))
+		for field in self.fields:
+			attributes = field_metadata(field, specs[field])
+			lines.append('<FIELD %s/>' % ' '.join(['%s=%s' % (key, quoteattr(attributes[key])) for key in ('name', 'datatype', 'arraysize', 'xtype', 'ucd', 'unit') if key in attributes]))
+		lines.append('<DATA>')
+		lines.append('<TABLEDATA>')
+		self.stream.write('\n'.join(lines) + '\n')
+	
+	def write(self, key, data):
+		"""
+		Appends a record.
+		
+		:param key: Key of the record, e.g. the file path
+		:param data: AVM dictionary
+		"""
+		cells = [_text(key)]
+		
+		if self.positions:
+			reference = data.get('Spatial.ReferenceValue')
+			frame = data.get('Spatial.CoordinateFrame') or 'ICRS'
+			if reference and frame.upper() in _EQUATORIAL_FRAMES:
+				cells.append(_float(reference[0]))
+				cells.append(_float(reference[1]) if len(reference) > 1 else _NAN)
+			else:
+				cells.append('')
+				cells.append('')
+			fov = _fov(data)
+			cells.append('' if fov is None else repr(fov))
+		
+		for field, format_value in self._formatters:
+			value = data.get(field)
+			cells.append('' if value in _EMPTY_VALUES else format_value(value))
+		
+		self._rows.append('<TR><TD>%s</TD></TR>\n' % '</TD><TD>'.join(cells))
+		self.num_rows += 1
+		if len(self._rows) >= self.chunk_size:
+			self.flush()
+	
+	def write_records(self, records):
+		"""
+		Appends many records.
+		
+		:param records: Iterable of (key, AVM dictionary) tuples
+		"""
+		for key, data in records:
+			self.write(key, data)
+	
+	def flush(self):
+		"""
+		Writes the pending rows to the stream.
+		"""
+		if self._rows:
+			self.stream.write(''.join(self._rows))
+			self._rows = []
+	
+	def close(self):
+		"""
+		Writes the pending rows and terminates the document.  The stream is not closed.
+		"""
+		self.flush()
+		self.stream.write('</TABLEDATA>\n</DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n')
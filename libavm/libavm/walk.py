@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+"""
+Streaming traversal of directory trees.
+
+:func:`walk_files` yields the supported files of a tree one at a time, without building a
+list of the tree, and :func:`iter_avm` reads files from any iterable with a pool of threads
+connected by bounded queues.  Together they process archives of any size in constant
+memory::
+
+	from libavm.walk import *
+	
+	for file_path, avm_data in read_tree('/archive', workers=8):
+		...
+"""
+
+import os
+import stat
+import Queue
+import threading
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+from libavm.filetypes import EXTENSIONS, classify
+from libavm.utils import avm_from_file
+
+
+__all__ = ['walk_files', 'iter_avm', 'read_tree']
+
+
+def _listdir( directory ):
+	"""
+	Fallback for scandir(): yields (name, path, is_dir, is_file) of the entries of a directory.
+	"""
+	for name in os.listdir(directory):
+		path = os.path.join(directory, name)
+		try:
+			mode = os.lstat(path).st_mode
+		except OSError:
+			continue
+		yield name, path, stat.S_ISDIR(mode), stat.S_ISREG(mode)
+
+def _scandir( directory ):
+	for entry in scandir(directory):
+		try:
+			yield entry.name, entry.path, entry.is_dir(follow_symlinks=False), entry.is_file(follow_symlinks=False)
+		except OSError:
+			continue
+
+def walk_files( root, extensions=None, sniff=True, onerror=None ):
+	"""
+	Generator yielding the paths of the supported files of a directory tree, depth first.
+	Symbolic links are not followed.  XMP sidecars of files of the tree (e.g. mosaic.tif.xmp
+	next to mosaic.tif) are skipped, as they describe the file they belong to.
+	
+	:param root: Directory to walk
+	:param extensions: Set of lower case extensions to yield, default to all supported formats
+	:param sniff: Boolean to skip hopeless files, e.g. empty or not matching their extension, see libavm.filetypes.classify()
+	:param onerror: Function called with the OSError raised when a directory cannot be listed
+	
+	:return: Iterator of paths
+	"""
+	for path, format in _walk(root, extensions, sniff, onerror):
+		yield path
+
+def _walk( root, extensions, sniff, onerror ):
+	"""
+	walk_files(), yielding (path, format) tuples.  The format is the one found by classify(),
+	or None when the files are not sniffed.
+	"""
+	if extensions is None:
+		extensions = EXTENSIONS
+	entries = scandir is not None and _scandir or _listdir
+	
+	# Only the iterators of the directories on the current path are kept
+	stack = []
+	try:
+		stack.append(entries(root))
+	except OSError, e:
+		if onerror is not None:
+			onerror(e)
+		return
+	
+	while stack:
+		try:
+			name, path, is_dir, is_file = stack[-1].next()
+		except StopIteration:
+			stack.pop()
+			continue
+		except OSError, e:
+			stack.pop()
+			if onerror is not None:
+				onerror(e)
+			continue
+		
+		if is_dir:
+			try:
+				stack.append(entries(path))
+			except OSError, e:
+				if onerror is not None:
+					onerror(e)
+		elif is_file and os.path.splitext(name)[1].lower() in extensions:
+			if name[-4:].lower() == '.xmp' and os.path.isfile(path[:-4]):
+				# Sidecar, see libavm.utils.sidecar_path()
+				continue
+			if not sniff:
+				yield path, None
+				continue
+			format, reason = classify(path)
+			if reason is None:
+				yield path, format
+
+
+_DONE = object()
+
+def _put( queue, item, stop ):
+	"""
+	Blocking put which gives up once stop is set.
+	
+	:return: Boolean, False if stopped
+	"""
+	while not stop.is_set():
+		try:
+			queue.put(item, timeout=0.1)
+			return True
+		except Queue.Full:
+			continue
+	return False
+
+def iter_avm( file_paths, workers=4, queue_size=256, reader=avm_from_file ):
+	"""
+	Reads the AVM of files with a pool of threads.  Paths are consumed from file_paths only as
+	fast as the workers read them: both the queue of paths and the queue of results hold at
+	most queue_size items, so memory does not depend on the number of files.
+	
+	:param file_paths: Iterable of paths, e.g. walk_files()
+	:param workers: Number of reader threads
+	:param queue_size: Size of the queues between the stages
+	:param reader: Function reading a file, default to avm_from_file()
+	
+	:return: Iterator of (path, AVM dictionary) tuples in completion order.  The dictionary is None if the reader raised an exception.
+	"""
+	paths = Queue.Queue(queue_size)
+	results = Queue.Queue(queue_size)
+	stop = threading.Event()
+	
+	def produce():
+		try:
+			for file_path in file_paths:
+				if not _put(paths, file_path, stop):
+					return
+		finally:
+			for i in range(workers):
+				_put(paths, _DONE, stop)
+	
+	def consume():
+		try:
+			while not stop.is_set():
+				try:
+					file_path = paths.get(timeout=0.1)
+				except Queue.Empty:
+					continue
+				if file_path is _DONE:
+					break
+				try:
+					data = reader(file_path)
+				except Exception:
+					data = None
+				if not _put(results, (file_path, data), stop):
+					break
+		finally:
+			_put(results, _DONE, stop)
+	
+	threads = [threading.Thread(target=produce)] + [threading.Thread(target=consume) for i in range(workers)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	
+	try:
+		running = workers
+		while running:
+			result = results.get()
+			if result is _DONE:
+				running -= 1
+			else:
+				yield result
+	finally:
+		stop.set()
+		for thread in threads:
+			thread.join()
+
+def read_tree( root, workers=4, queue_size=256, extensions=None, sniff=True ):
+	"""
+	Reads the AVM of the supported files of a directory tree, see walk_files() and iter_avm().
+	
+	:return: Iterator of (path, AVM dictionary) tuples
+	"""
+	# The formats found by the walk are passed on, so files are not classified twice
+	for (path, format), data in iter_avm(_walk(root, extensions, sniff, None), workers, queue_size, _read_classified):
+		yield path, data
+
+def _read_classified( item ):
+	path, format = item
+	return avm_from_file(path, format=format)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+"""
+Benchmarks for the Python AVM Library.  Run from the test directory::
+
+	python benchmarks.py			# All benchmarks
+	python benchmarks.py pickle		# Selected benchmarks
+"""
+
+import sys
+import os
+import os.path
+import time
+import datetime
+import cPickle as pickle
+import StringIO
+import sqlite3
+import tempfile
+import shutil
+
+sys.path.append(os.path.pardir)
+
+from libavm import AVMMeta
+from libavm.utils import avm_from_file, avm_obj_from_file, avm_to_file, READ_STRATEGIES
+from libavm.votable import AVMVOTableWriter
+from libavm.db import create_table, load_records
+from libavm.walk import iter_avm
+
+from samples import samplefiles, make_temp_samples, remove_temp_samples
+
+avm_dict = {
+	'Creator': 'Sample Creator',
+	'Contact.Name': ['Sample Name 1', 'Sample Name 2', 'Sample Name 3'],
+	'Title': 'Lorem ipsum',
+	'Description': 'Cum sociis natoque penatibus et magnis dis parturient montes, nascetur ridiculus mus.',
+	'Subject.Category': ['A.1.2.3', 'B.4.5.6', 'C.7.8.9'],
+	'Date': datetime.date.today(),
+	'ID': 'heic123456',
+	'Type': 'Observation',
+	'Facility': ['Hubble Space Telescope', 'Spitzer Space Telescope', 'Chandra X-ray Observatory'],
+	'Spectral.Band': ['Optical', 'Infrared', 'X-ray'],
+	'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10), datetime.datetime(2012, 3, 2, 10), datetime.datetime(2012, 3, 3, 10)],
+	'Temporal.IntegrationTime': [300.0, 300.0, 300.0],
+	'Spatial.ReferenceValue': [123.0, 45.0],
+	'Spatial.Scale': [0.001, 0.001],
+	'Spatial.Rotation': 90.0,
+}
+
+benchmarks = {}
+
+def benchmark( name ):
+	""" Registers a benchmark function under a name """
+	def register( func ):
+		benchmarks[name] = func
+		return func
+	return register
+
+def timed( func, number=100 ):
+	"""
+	:return: Average time of a call in milliseconds
+	"""
+	start = time.time()
+	for i in xrange(number):
+		func()
+	return (time.time() - start) * 1000.0 / number
+
+def report( name, milliseconds, baseline=None ):
+	if baseline:
+		print '  %-40s %9.3f ms  (x%.1f)' % (name, milliseconds, baseline / milliseconds)
+	else:
+		print '  %-40s %9.3f ms' % (name, milliseconds)
+
+
+@benchmark('pickle')
+def bench_pickle():
+	""" Pickle round trip of AVMMeta versus reading the file again """
+	for file_path in sorted(samplefiles):
+		avm = avm_obj_from_file(file_path)
+		if avm is None:
+			continue
+		print file_path
+		
+		read = timed(lambda: avm_obj_from_file(file_path).data)
+		report('avm_obj_from_file', read)
+		
+		for pickle_format in ('packet', 'fields'):
+			avm.pickle_format = pickle_format
+			size = len(pickle.dumps(avm, pickle.HIGHEST_PROTOCOL))
+			round_trip = timed(lambda: pickle.loads(pickle.dumps(avm, pickle.HIGHEST_PROTOCOL)).data)
+			report('pickle round trip, %s (%d bytes)' % (pickle_format, size), round_trip, read)
+
+
+@benchmark('votable')
+def bench_votable():
+	""" Streaming VOTable output of the sample records """
+	records = []
+	for file_path in sorted(samplefiles):
+		data = avm_from_file(file_path)
+		if data:
+			records.append((file_path, data))
+	if not records:
+		return
+	records = records * (1000 / len(records) + 1)
+	
+	def write():
+		writer = AVMVOTableWriter(StringIO.StringIO())
+		writer.write_records(records)
+		writer.close()
+	
+	milliseconds = timed(write, number=10)
+	report('%d rows (%.0f rows/s)' % (len(records), len(records) * 1000.0 / milliseconds), milliseconds)
+
+
+@benchmark('db')
+def bench_db():
+	""" Bulk load of the sample records into a SQLite database file """
+	records = []
+	for file_path in sorted(samplefiles):
+		data = avm_from_file(file_path)
+		if data:
+			records.append(data)
+	if not records:
+		return
+	records = [('%s-%d' % (i, j), data) for i in range(100000 / len(records) + 1) for j, data in enumerate(records)]
+	
+	tempdir = tempfile.mkdtemp()
+	try:
+		def load():
+			connection = sqlite3.connect(os.path.join(tempdir, 'avm.db'))
+			create_table(connection, 'avm')
+			load_records(connection, 'avm', records)
+			connection.execute('DROP TABLE avm')
+			connection.close()
+		
+		milliseconds = timed(load, number=3)
+		report('%d rows (%.0f rows/s)' % (len(records), len(records) * 1000.0 / milliseconds), milliseconds)
+	finally:
+		shutil.rmtree(tempdir)
+
+
+@benchmark('strategies')
+def bench_strategies():
+	""" Read strategies of avm_from_file, relative to the default options of XMPFiles """
+	for file_path in sorted(samplefiles):
+		print file_path
+		
+		baseline = timed(lambda: avm_from_file(file_path, strategy='default'))
+		report('default', baseline)
+		for strategy in ['auto'] + sorted(READ_STRATEGIES):
+			if strategy == 'default':
+				continue
+			if avm_from_file(file_path, strategy=strategy) != avm_from_file(file_path, strategy='default'):
+				report('%s (different result)' % strategy, timed(lambda: avm_from_file(file_path, strategy=strategy)), baseline)
+			else:
+				report(strategy, timed(lambda: avm_from_file(file_path, strategy=strategy)), baseline)
+
+
+@benchmark('threads')
+def bench_threads():
+	""" Scaling of iter_avm() with the number of reader threads """
+	file_paths = sorted(samplefiles) * 50
+	
+	def read( workers ):
+		return lambda: list(iter_avm(file_paths, workers=workers))
+	
+	baseline = timed(read(1), number=3)
+	report('%d files, 1 thread' % len(file_paths), baseline)
+	for workers in (2, 4, 8, 16, 32):
+		report('%d files, %d threads' % (len(file_paths), workers), timed(read(workers), number=3), baseline)
+
+
+def main( names ):
+	make_temp_samples()
+	try:
+		for file_path in samplefiles:
+			avm_to_file(file_path, avm_dict, replace=True)
+		
+		for name in names or sorted(benchmarks):
+			print '== %s ==' % name
+			benchmarks[name]()
+	finally:
+		remove_temp_samples()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
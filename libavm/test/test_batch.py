@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+import unittest
+
+import os
+import csv
+import time
+import signal
+import shutil
+import datetime
+import tempfile
+import StringIO
+
+import libavm.batch
+from libavm.batch import import_csv, read_csv, parse_value, path_lock, propagate_avm, rendition_overrides, \
+    run_job, shard_of, AVMJournal, AVMSupervisedPool, AVMQuarantine
+from libavm.specs import SPECS_1_1
+from libavm.utils import avm_from_file, avm_obj_from_file, xmp_to_file
+from libavm import AVMMeta
+from libxmp.consts import XMP_NS_TIFF
+
+CSV_DATA = """path,Title,Spectral.Band,Spatial.Scale,Date,Notes
+a.jpg,Orion,Optical;Infrared,0.001;-,2010-01-01,Lorem
+b.jpg,Eagle,Bogus,,,
+,Pillars,,,,
+missing.jpg,Crab,,,,
+"""
+
+def misbehave(file_path):
+    if 'hang' in file_path:
+        time.sleep(60)
+    elif 'crash' in file_path:
+        os.kill(os.getpid(), signal.SIGSEGV)
+    elif 'error' in file_path:
+        raise ValueError('Lorem ipsum')
+    return file_path.upper()
+
+class AVMBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tempdir, 'avm.csv')
+        with open(self.csv_path, 'wb') as f:
+            f.write(CSV_DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_parse_value(self):
+        self.assertEqual(parse_value(SPECS_1_1['Spatial.Scale'], '0.001;-'), ['0.001', ''])
+        self.assertEqual(parse_value(SPECS_1_1['Date'], '2010-01-01'), datetime.datetime(2010, 1, 1))
+        self.assertEqual(parse_value(SPECS_1_1['Temporal.StartTime'], '2012-03-01T10:00:00; 2012-03-02T10:00:00'),
+            [datetime.datetime(2012, 3, 1, 10), datetime.datetime(2012, 3, 2, 10)])
+
+    def test_read_csv(self):
+        rows = read_csv(StringIO.StringIO(CSV_DATA))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][:3], (2, 'a.jpg', {
+            'Title': 'Orion',
+            'Spectral.Band': ['Optical', 'Infrared'],
+            'Spatial.Scale': ['0.001', ''],
+            'Date': datetime.datetime(2010, 1, 1),
+        }))
+        self.assertEqual(rows[0][3], [])
+        self.assertEqual(len(rows[1][3]), 1)
+        self.assert_(rows[1][3][0].startswith('Spectral.Band'))
+        self.assertEqual(rows[2][3], ['path: missing'])
+
+        rows = read_csv(StringIO.StringIO(CSV_DATA), mapping={'Notes': 'Headline'})
+        self.assertEqual(rows[0][2], {'Headline': 'Lorem'})
+        self.assertRaises(KeyError, read_csv, StringIO.StringIO(CSV_DATA), {'Notes': 'Lorem'})
+
+    def test_import_csv(self):
+        # Rows logged as imported are skipped when resuming
+        log_path = self.csv_path + '.log'
+        with open(log_path, 'wb') as f:
+            csv.writer(f).writerows([['line', 'path', 'status', 'message'], [2, 'a.jpg', 'ok', '']])
+
+        results = import_csv(self.csv_path, workers=2)
+        self.assertEqual(sorted([(line, status) for line, path, status, message in results]),
+            [(3, 'invalid'), (4, 'invalid'), (5, 'failed')])
+
+        with open(log_path, 'rb') as f:
+            logged = [(row['line'], row['status']) for row in csv.DictReader(f)]
+        self.assertEqual(sorted(logged), [('2', 'ok'), ('3', 'invalid'), ('4', 'invalid'), ('5', 'failed')])
+
+        self.assertEqual(len(import_csv(self.csv_path, resume=False)), 4)
+
+    def test_import_csv_interrupted(self):
+        with open(self.csv_path, 'wb') as f:
+            f.write('path,Title\n' + ''.join(['file%d.jpg,Orion\n' % i for i in range(400)]))
+        calls = []
+
+        def write_rows(task):
+            calls.append(task[0])
+            time.sleep(0.001)
+            # Not a row: logging it fails
+            return [None]
+
+        original = libavm.batch._write_rows
+        libavm.batch._write_rows = write_rows
+        try:
+            self.assertRaises(csv.Error, import_csv, self.csv_path, workers=2)
+        finally:
+            libavm.batch._write_rows = original
+        # Queued files are dropped, not written without being logged
+        self.assert_(len(calls) < 100)
+
+    def test_rendition_overrides(self):
+        data = {
+            'Spatial.Scale': ['-0.001', '0.001'],
+            'Spatial.ReferencePixel': ['500.5', '250.5'],
+            'Spatial.ReferenceDimension': ['1000', '500'],
+        }
+        self.assertEqual(rendition_overrides(data, 100, 50), {
+            'Spatial.Scale': ['-0.01', '0.01'],
+            'Spatial.ReferencePixel': ['50.5', '25.5'],
+            'Spatial.ReferenceDimension': ['100', '50'],
+        })
+        self.assertEqual(rendition_overrides({}, 100, 50), {})
+
+    def test_propagate_avm(self):
+        targets = [os.path.join(self.tempdir, name) for name in ('a.jpg', 'b.jpg')]
+        results = propagate_avm({'Title': 'Orion'}, targets, {targets[1]: {'Spectral.Band': ['Bogus']}})
+        self.assertEqual([status for path, status, message in results], ['failed', 'invalid'])
+        self.assertEqual([path for path, status, message in results], targets)
+
+    def test_propagate_avm_merge(self):
+        target = os.path.join(self.tempdir, 'c.jpg')
+        with open(target, 'wb') as f:
+            f.write('\xff\xd8\xff\xe0' + '\0' * 64)
+        xmp = AVMMeta(avm_dict={'Title': 'Rendition', 'Headline': 'Lorem ipsum'}).xmp
+        xmp.set_property(XMP_NS_TIFF, 'tiff:Model', 'Camera')
+        self.assertTrue(xmp_to_file(target, xmp))
+        
+        results = propagate_avm({'Title': 'Orion'}, [target], {target: {'Spectral.Band': ['Optical']}})
+        self.assertEqual(results, [(target, 'ok', '')])
+        self.assertEqual(avm_from_file(target), {'Title': 'Orion', 'Headline': 'Lorem ipsum', 'Spectral.Band': ['Optical']})
+        self.assertEqual(avm_obj_from_file(target).xmp.get_property(XMP_NS_TIFF, 'tiff:Model'), 'Camera')
+        
+        results = propagate_avm({'Title': 'Orion'}, [target], replace=True)
+        self.assertEqual(results, [(target, 'ok', '')])
+        self.assertEqual(avm_from_file(target), {'Title': 'Orion'})
+        self.assertEqual(avm_obj_from_file(target).xmp.get_property(XMP_NS_TIFF, 'tiff:Model'), None)
+
+    def test_propagate_avm_validates_once(self):
+        targets = [os.path.join(self.tempdir, '%d.jpg' % i) for i in range(4)]
+        for target in targets:
+            with open(target, 'wb') as f:
+                f.write('\xff\xd8\xff\xe0' + '\0' * 64)
+        
+        avmdt = SPECS_1_1['Title']
+        calls = []
+        def check_data(value):
+            calls.append(value)
+            return type(avmdt).check_data(avmdt, value)
+        avmdt.check_data = check_data
+        try:
+            results = propagate_avm({'Title': 'Orion'}, targets)
+        finally:
+            del avmdt.check_data
+        self.assertEqual([status for path, status, message in results], ['ok'] * 4)
+        self.assertEqual(calls, ['Orion'])
+        self.assertEqual([avm_from_file(target) for target in targets], [{'Title': 'Orion'}] * 4)
+
+    def test_run_job(self):
+        journal_path = os.path.join(self.tempdir, 'job.journal')
+        file_paths = ['file%d.jpg' % i for i in range(20)]
+        calls = []
+
+        def func(file_path):
+            calls.append(file_path)
+            if file_path == 'file3.jpg':
+                raise IOError('Lorem ipsum')
+            return file_path != 'file4.jpg'
+
+        reports = []
+        progress = run_job(func, file_paths, journal_path, workers=3, progress=reports.append)
+        self.assertEqual((progress.ok, progress.failed, progress.skipped), (18, 2, 0))
+        self.assertEqual(sorted(calls), sorted(file_paths))
+        self.assert_(reports[-1] is progress)
+
+        # An incomplete line left by a crash is ignored
+        with open(journal_path, 'ab') as f:
+            f.write('ok\tfile5')
+        self.assertEqual(AVMJournal(journal_path).statuses['file3.jpg'], 'failed')
+
+        calls[:] = []
+        progress = run_job(func, file_paths, journal_path)
+        self.assertEqual(sorted(calls), ['file3.jpg', 'file4.jpg'])
+        self.assertEqual(progress.skipped, 18)
+
+        calls[:] = []
+        run_job(func, file_paths, journal_path, retry_failed=False)
+        self.assertEqual(calls, [])
+
+    def test_run_job_interrupted(self):
+        journal_path = os.path.join(self.tempdir, 'job.journal')
+        file_paths = ['file%d.jpg' % i for i in range(400)]
+        calls = []
+
+        def func(file_path):
+            calls.append(file_path)
+            time.sleep(0.001)
+            return True
+
+        def progress(job_progress):
+            if job_progress.processed:
+                raise KeyboardInterrupt
+
+        self.assertRaises(KeyboardInterrupt, run_job, func, file_paths, journal_path, workers=2,
+            progress=progress, progress_interval=0.0)
+        # Queued files are dropped, not run without being journaled
+        self.assert_(len(calls) < 100)
+
+    def test_shards(self):
+        file_paths = ['file%d.jpg' % i for i in range(100)]
+        shards = [[path for path in file_paths if shard_of(path, 4) == shard] for shard in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(file_paths))
+        self.assertEqual(shard_of('file1.jpg', 4), shard_of(u'file1.jpg', 4))
+
+        calls = []
+        run_job(calls.append, file_paths, os.path.join(self.tempdir, 'shard.journal'), shard=2, num_shards=4)
+        self.assertEqual(sorted(calls), sorted(shards[2]))
+
+    def test_supervised_pool(self):
+        quarantine_path = os.path.join(self.tempdir, 'quarantine')
+        file_paths = ['hang.jpg', 'crash.jpg', 'error.jpg'] + ['file%d.jpg' % i for i in range(20)]
+
+        with AVMSupervisedPool(workers=3, timeout=0.5, retries=1, quarantine=quarantine_path) as pool:
+            start = time.time()
+            results = dict([(path, (status, result)) for path, status, result in pool.imap_unordered(misbehave, file_paths)])
+            self.assert_(time.time() - start < 10)
+            self.assertEqual(pool.recycled, 4)
+
+        self.assertEqual(len(results), len(file_paths))
+        self.assertEqual(results['hang.jpg'][0], 'timeout')
+        self.assertEqual(results['crash.jpg'][0], 'crashed')
+        self.assertEqual(results['error.jpg'], ('failed', 'ValueError: Lorem ipsum'))
+        self.assertEqual(results['file1.jpg'], ('ok', 'FILE1.JPG'))
+        self.assertEqual(sorted(AVMQuarantine(quarantine_path).paths), ['crash.jpg', 'hang.jpg'])
+
+        # Quarantined files are skipped
+        journal_path = os.path.join(self.tempdir, 'job.journal')
+        progress = run_job(misbehave, file_paths, journal_path, timeout=0.5, quarantine=quarantine_path)
+        self.assertEqual((progress.ok, progress.failed), (20, 3))
+        self.assertEqual(AVMJournal(journal_path).statuses['hang.jpg'], 'quarantined')
+
+    def test_supervised_pool_idle_worker_died(self):
+        with AVMSupervisedPool(workers=1, timeout=5.0) as pool:
+            results = pool.imap_unordered(misbehave, ['file%d.jpg' % i for i in range(3)])
+            self.assertEqual(results.next(), ('file0.jpg', 'ok', 'FILE0.JPG'))
+
+            # Kill the worker between two tasks
+            process = pool.workers[0].process
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+            self.assertEqual(sorted(results), [('file1.jpg', 'ok', 'FILE1.JPG'), ('file2.jpg', 'ok', 'FILE2.JPG')])
+            self.assertEqual(pool.recycled, 1)
+
+    def test_path_lock(self):
+        self.assert_(path_lock('a.jpg') is path_lock(os.path.abspath('a.jpg')))
+        # Locks are not kept per path
+        count = len(libavm.batch._path_locks)
+        for i in range(1000):
+            path_lock('file%d.jpg' % i)
+        self.assertEqual(len(libavm.batch._path_locks), count)
+
+if __name__ == '__main__':
+    unittest.main()
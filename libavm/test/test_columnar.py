@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+import unittest
+
+import os
+import datetime
+import tempfile
+
+from libavm.columnar import AVMColumnWriter, AVMColumnReader
+
+class AVMColumnarTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        os.close(fd)
+        
+        self.avm_dict = {
+            'Title': 'Lorem ipsum',
+            'Contact.Name': ['Sample Name 1', 'Sample Name 2'],
+            'Subject.Category': ['B.4.1.2', 'A.1'],
+            'Date': datetime.datetime(2009, 5, 29, 12, 30),
+            'Type': 'Observation',
+            'Spectral.Band': ['Optical', 'Infrared'],
+            'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10, 0, 0, 500000)],
+            'Spatial.Scale': ['0.001', '-'],
+            'Spatial.Rotation': '90.0',
+        }
+        
+        writer = AVMColumnWriter(self.file_path)
+        writer.write('a.tif', self.avm_dict)
+        writer.write('b.tif', {'Title': 'Crab'})
+        writer.close()
+        
+        self.reader = AVMColumnReader(self.file_path)
+        
+    def tearDown(self):
+        self.reader.close()
+        os.remove(self.file_path)
+    
+    def test_keys(self):
+        self.assertEqual(len(self.reader), 2)
+        self.assertEqual(self.reader.keys(), ['a.tif', 'b.tif'])
+    
+    def test_records(self):
+        data = self.reader[0]
+        self.assertEqual(data['Title'], 'Lorem ipsum')
+        self.assertEqual(data['Contact.Name'], ['Sample Name 1', 'Sample Name 2'])
+        self.assertEqual(data['Subject.Category'], ['B.4.1.2', 'A.1'])
+        self.assertEqual(data['Date'], datetime.datetime(2009, 5, 29, 12, 30))
+        self.assertEqual(data['Type'], 'Observation')
+        self.assertEqual(data['Spectral.Band'], ['Optical', 'Infrared'])
+        self.assertEqual(data['Temporal.StartTime'], [datetime.datetime(2012, 3, 1, 10, 0, 0, 500000)])
+        self.assertEqual(data['Spatial.Scale'], [0.001, None])
+        self.assertEqual(data['Spatial.Rotation'], 90.0)
+        
+        self.assertEqual(self.reader[1], {'Title': 'Crab'})
+        self.assertEqual(self.reader.get(-1, 'Type'), None)
+
+if __name__ == '__main__':
+    unittest.main()
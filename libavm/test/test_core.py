@@ -31,8 +31,11 @@
 
 import unittest
 
-from libavm import AVMMeta
+from libavm import AVMMeta, XMPMetaPool, to_rows, xmp_stats
+from libavm.specs import SPECS_1_1, SPECS_1_2
 import datetime
+import threading
+import cPickle as pickle
 
 class AVMMetaTestCase(unittest.TestCase):
     def setUp(self):
@@ -40,4 +43,133 @@ class AVMMetaTestCase(unittest.TestCase):
         
     def tearDown(self):
         pass
-        
\ No newline at end of file
+    
+    def test_pickle(self):
+        avm = AVMMeta(avm_dict={
+            'Title': 'Lorem ipsum',
+            'Spectral.Band': ['Optical', 'Infrared'],
+            'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10)],
+        })
+        
+        for pickle_format in ('packet', 'fields'):
+            avm = AVMMeta(avm_dict=avm.data, pickle_format=pickle_format)
+            restored = pickle.loads(pickle.dumps(avm, pickle.HIGHEST_PROTOCOL))
+            self.assertEqual(restored.pickle_format, pickle_format)
+            
+            self.assertEqual(restored.data, avm.data, pickle_format)
+            self.assertEqual(restored['Spectral.Band'], ['Optical', 'Infrared'], pickle_format)
+            
+            restored['Headline'] = 'Dolor sit amet'
+            self.assertEqual(pickle.loads(pickle.dumps(restored)).data['Headline'], 'Dolor sit amet', pickle_format)
+        
+        # The format is chosen per object, and can be changed on unpickled objects
+        self.assertEqual(AVMMeta().pickle_format, 'packet')
+        restored = pickle.loads(pickle.dumps(AVMMeta(avm_dict=avm.data)))
+        restored.pickle_format = 'fields'
+        restored = pickle.loads(pickle.dumps(restored))
+        self.assertEqual((restored.pickle_format, restored.data), ('fields', avm.data))
+        self.assertRaises(ValueError, AVMMeta, pickle_format='json')
+    
+    def test_to_row(self):
+        avm_dict = {
+            'Title': 'Lorem ipsum',
+            'Spatial.Rotation': '90.0',
+            'Spectral.Band': ['Optical', 'Infrared'],
+            'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10)],
+            'Date': datetime.datetime(2010, 1, 1, 12),
+        }
+        fields = ['Title', 'Spatial.Rotation', 'Spectral.Band', 'Temporal.StartTime', 'Date', 'Headline']
+        avm = AVMMeta(avm_dict=avm_dict)
+        
+        row = avm.to_row(fields)
+        self.assertEqual(row, tuple([avm.to_string(key) for key in fields]))
+        self.assertEqual(row[2:5], ('Optical;Infrared', '2012-03-01T10:00:00', '2010-01-01T12:00:00'))
+        self.assertEqual(row[5], None)
+        self.assertEqual(list(to_rows([avm, avm_dict], fields)), [row, row])
+        self.assertRaises(KeyError, avm.to_row, ['Lorem'])
+    
+    def test_specs(self):
+        self.assertRaises(TypeError, SPECS_1_1.__setitem__, 'Title', SPECS_1_1['Headline'])
+        self.assertRaises(TypeError, SPECS_1_1.update, {})
+        self.assertRaises(TypeError, SPECS_1_1.pop, 'Title')
+        
+        self.assertTrue('PublicationID' in SPECS_1_2)
+        self.assertFalse('PublicationID' in SPECS_1_1)
+        self.assertTrue(SPECS_1_2['RelatedResources'].deprecated)
+        self.assertFalse(SPECS_1_1['RelatedResources'].deprecated)
+        self.assertEqual(sorted(pickle.loads(pickle.dumps(SPECS_1_2))), sorted(SPECS_1_2))
+        
+        avm = AVMMeta(version='1.2')
+        avm['PublicationID'] = ['2012A&A...537A.123X']
+        self.assertEqual(avm['PublicationID'], ['2012A&A...537A.123X'])
+        self.assertEqual(pickle.loads(pickle.dumps(avm)).data, avm.data)
+        self.assertRaises(KeyError, AVMMeta().__setitem__, 'PublicationID', ['2012A&A...537A.123X'])
+        self.assertRaises(ValueError, AVMMeta, version='0.9')
+    
+    def test_threads(self):
+        avm_dict = {
+            'Title': 'Lorem ipsum',
+            'Spectral.Band': ['Optical', 'Infrared'],
+        }
+        avm = pickle.loads(pickle.dumps(AVMMeta(avm_dict=avm_dict)))
+        errors = []
+        
+        def read():
+            try:
+                for i in range(50):
+                    self.assertEqual(avm['Title'], 'Lorem ipsum')
+                    self.assertEqual(avm.data['Spectral.Band'], ['Optical', 'Infrared'])
+                    avm['Headline'] = 'Dolor sit amet'
+            except Exception, e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=read) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(avm['Headline'], 'Dolor sit amet')
+    
+    def test_xmp_pool(self):
+        avm_dict = {'Title': 'Lorem ipsum', 'Spectral.Band': ['Optical', 'Infrared']}
+        packet = AVMMeta(avm_dict=avm_dict).xmp.serialize_to_str()
+        pool = XMPMetaPool(maxsize=1)
+        
+        before = xmp_stats()
+        with AVMMeta(avm_dict=avm_dict, pool=pool) as avm:
+            self.assertEqual(avm.xmp.serialize_to_str(), packet)
+        self.assertEqual(xmp_stats()['allocated'] - before['allocated'], 1)
+        
+        # Once the pool holds an object, cycles allocate nothing
+        before = xmp_stats()
+        for i in range(10):
+            with AVMMeta(avm_dict=avm_dict, pool=pool) as avm:
+                self.assertEqual(avm.xmp.serialize_to_str(), packet)
+        after = xmp_stats()
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(after['allocated'], before['allocated'])
+        self.assertEqual(after['reused'] - before['reused'], 10)
+        self.assertEqual(after['released'] - before['released'], 10)
+        
+        # Pooled objects are cleared
+        with AVMMeta(pool=pool) as avm:
+            self.assertEqual(avm.data, {})
+            self.assertEqual(avm['Title'], None)
+        
+        # Passed XMPMeta objects are neither allocated nor pooled
+        xmp = AVMMeta(avm_dict=avm_dict).xmp
+        before = xmp_stats()
+        with AVMMeta(xmp=xmp, pool=pool) as avm:
+            self.assertEqual(avm['Title'], 'Lorem ipsum')
+        self.assertTrue(avm.xmp is xmp)
+        self.assertEqual(xmp_stats(), before)
+        pickle.dumps(avm)
+        
+        # Released objects cannot be pickled
+        avm = AVMMeta(avm_dict=avm_dict, pool=pool)
+        avm.release()
+        self.assertRaises(ValueError, pickle.dumps, avm)
+
+if __name__ == '__main__':
+    unittest.main()
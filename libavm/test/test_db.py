@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+import unittest
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import datetime
+
+from libavm.db import table_schema, create_table, record_to_row, load_records
+
+class AVMDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.fields = ['Title', 'Spatial.Rotation', 'Spatial.Scale', 'Spectral.Band', 'Date']
+        self.records = [
+            ('a.jpg', {
+                'Title': 'Orion',
+                'Spatial.Rotation': '90.0',
+                'Spatial.Scale': ['0.001', '-'],
+                'Spectral.Band': ['Optical', 'Infrared'],
+                'Date': datetime.datetime(2010, 1, 1, 12),
+            }),
+            ('b.jpg', {'Title': 'Eagle'}),
+        ]
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_schema(self):
+        schema = table_schema('avm', fields=self.fields)
+        self.assert_('"key" TEXT PRIMARY KEY' in schema)
+        self.assert_('"Spatial.Rotation" REAL' in schema)
+        self.assert_('"Spectral.Band" TEXT' in schema)
+
+    def test_record_to_row(self):
+        row = record_to_row('a.jpg', self.records[0][1], self.fields)
+        self.assertEqual(row, ('a.jpg', 'Orion', '90.0', '0.001;-', 'Optical;Infrared', '2010-01-01T12:00:00'))
+        self.assertEqual(record_to_row('b.jpg', {}, ['Title']), ('b.jpg', None))
+
+    def test_load_records(self):
+        create_table(self.connection, 'avm', fields=self.fields)
+        self.assertEqual(load_records(self.connection, 'avm', self.records, fields=self.fields, chunk_size=1), 2)
+        rows = self.connection.execute('SELECT "key", "Spatial.Rotation", "Spectral.Band" FROM avm ORDER BY "key"').fetchall()
+        self.assertEqual(rows, [(u'a.jpg', 90.0, u'Optical;Infrared'), (u'b.jpg', None, None)])
+
+        # Reloading replaces existing rows
+        load_records(self.connection, 'avm', [('b.jpg', {'Title': 'Pillars'})], fields=self.fields)
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM avm').fetchone()[0], 2)
+        self.assertEqual(self.connection.execute('SELECT "Title" FROM avm WHERE "key" = ?', ('b.jpg',)).fetchone()[0], u'Pillars')
+
+    def test_load_records_not_durable(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            connection = sqlite3.connect(os.path.join(tempdir, 'avm.db'))
+            create_table(connection, 'avm', fields=self.fields)
+            self.assertEqual(load_records(connection, 'avm', self.records, fields=self.fields, durable=False), 2)
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM avm').fetchone()[0], 2)
+            # The settings are restored after the load
+            self.assertEqual(connection.execute('PRAGMA synchronous').fetchone()[0], 2)
+            self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], u'delete')
+            connection.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    unittest.main()
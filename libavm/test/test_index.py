@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+import unittest
+
+import os
+import shutil
+import datetime
+import tempfile
+
+from libavm.index import AVMBitmapIndex, AVMCategoryIndex, AVMTextIndex, AVMIntervalIndex, AVMHashIndex, refresh_indexes
+from libavm.utils import avm_to_file
+
+class AVMBitmapIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            ('a.tif', {'Type': 'Observation', 'Spectral.Band': ['Optical', 'Infrared'], 'Spatial.Quality': 'Full', 'Subject.Category': ['B.4.1.2']}),
+            ('b.tif', {'Type': 'Artwork', 'Spectral.Band': ['Infrared']}),
+            ('c.tif', {'Type': 'Observation', 'Spectral.Band': ['X-ray'], 'Spatial.Quality': 'Full'}),
+        ]
+        self.index = AVMBitmapIndex()
+        self.index.update(self.records)
+        
+    def tearDown(self):
+        pass
+    
+    def test_filter(self):
+        bitmap = self.index.filter({'Type': 'Observation', 'Spectral.Band': 'Infrared', 'Spatial.Quality': 'Full'})
+        self.assertEqual(self.index.resolve(bitmap), ['a.tif'])
+        
+        bitmap = self.index.filter({'Spectral.Band': ['X-ray', 'Optical']})
+        self.assertEqual(sorted(self.index.resolve(bitmap)), ['a.tif', 'c.tif'])
+        self.assertEqual(self.index.count(bitmap), 2)
+    
+    def test_complement(self):
+        bitmap = self.index.complement(self.index.lookup('Type', 'observation'))
+        self.assertEqual(self.index.resolve(bitmap), ['b.tif'])
+    
+    def test_incremental(self):
+        self.index.remove('a.tif')
+        self.assertEqual(self.index.resolve(self.index.lookup('Subject.Category', 'B.4.1.2')), [])
+        
+        self.index.add('c.tif', {'Type': 'Chart'})
+        self.assertEqual(self.index.resolve(self.index.lookup('Type', 'Chart')), ['c.tif'])
+        self.assertEqual(self.index.resolve(self.index.lookup('Type', 'Observation')), [])
+        self.assertEqual(len(self.index), 2)
+    
+    def test_save_load(self):
+        fd, file_path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.index.save(file_path)
+            index = AVMBitmapIndex.load(file_path)
+        finally:
+            os.remove(file_path)
+        
+        bitmap = index.filter({'Type': 'Observation', 'Spatial.Quality': 'Full'})
+        self.assertEqual(sorted(index.resolve(bitmap)), ['a.tif', 'c.tif'])
+
+class AVMCategoryIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AVMCategoryIndex()
+        self.index.add('a.tif', {'Subject.Category': ['B.4.1.2', 'B.4.2']})
+        self.index.add('b.tif', {'Subject.Category': ['B.4.1.1']})
+        self.index.add('c.tif', {'Subject.Category': ['A.1']})
+        
+    def tearDown(self):
+        pass
+    
+    def test_members(self):
+        self.assertEqual(sorted(self.index.members('B.4.*')), ['a.tif', 'b.tif'])
+        self.assertEqual(self.index.members('B.4.1.2'), ['a.tif'])
+        self.assertEqual(self.index.members('C'), [])
+    
+    def test_count(self):
+        self.assertEqual(self.index.count('B.4'), 2)
+        self.assertEqual(self.index.count('B.4.1.2'), 1)
+        self.assertEqual(self.index.children('B.4'), {'B.4.1': 2, 'B.4.2': 1})
+    
+    def test_remove(self):
+        self.index.remove('a.tif')
+        self.assertEqual(self.index.members('B.4'), ['b.tif'])
+        self.assertEqual(self.index.children('B.4'), {'B.4.1': 1})
+        
+        self.index.add('b.tif', {'Subject.Category': ['A.1.1']})
+        self.assertEqual(self.index.count('B'), 0)
+        self.assertEqual(sorted(self.index.members('A.1')), ['b.tif', 'c.tif'])
+
+class AVMTextIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AVMTextIndex()
+        self.index.add('a.tif', {'Title': 'The Orion Nebula', 'Description': 'Hubble image of the Orion nebula.', 'Subject.Name': ['M42', 'Orion Nebula']})
+        self.index.add('b.tif', {'Title': 'Nebula in Orion', 'Headline': 'ORION'})
+        self.index.add('c.tif', {'Title': 'Crab', 'Description': 'Hubble'})
+        
+    def tearDown(self):
+        pass
+    
+    def test_search(self):
+        keys = [key for key, score in self.index.search('orion nebula')]
+        self.assertEqual(sorted(keys), ['a.tif', 'b.tif'])
+        self.assertEqual(self.index.search('orion crab'), [])
+        self.assertEqual(self.index.search('unknown'), [])
+        self.assertEqual(len(self.index.search('hubble', limit=1)), 1)
+    
+    def test_phrase(self):
+        self.assertEqual([key for key, score in self.index.search('"orion nebula"')], ['a.tif'])
+        self.assertEqual(self.index.search('"nebula orion"'), [])
+        # Phrases do not span fields
+        self.assertEqual(self.index.search('"nebula hubble"'), [])
+    
+    def test_remove(self):
+        self.index.remove('a.tif')
+        self.assertEqual(self.index.search('"orion nebula"'), [])
+        self.assertEqual([key for key, score in self.index.search('orion')], ['b.tif'])
+        self.assertEqual(self.index.search('m42'), [])
+
+class AVMIntervalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AVMIntervalIndex()
+        self.index.add('a.tif', {
+            'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10), datetime.datetime(2012, 3, 6)],
+            'Temporal.IntegrationTime': ['3600.0', '-'],
+        })
+        self.index.add('b.tif', {
+            'Temporal.StartTime': [datetime.datetime(2012, 2, 28)],
+            'Temporal.IntegrationTime': ['86400.0'],
+        })
+        self.index.add('c.tif', {
+            'Temporal.StartTime': [datetime.datetime(2012, 3, 10)],
+            'Temporal.IntegrationTime': ['300.0'],
+        })
+        
+    def tearDown(self):
+        pass
+    
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(datetime.date(2012, 3, 1), datetime.date(2012, 3, 5)), ['a.tif'])
+        self.assertEqual(sorted(self.index.overlapping(datetime.date(2012, 2, 1), datetime.date(2012, 3, 31))), ['a.tif', 'b.tif', 'c.tif'])
+        self.assertEqual(self.index.overlapping(datetime.date(2013, 1, 1), datetime.date(2013, 2, 1)), [])
+        self.assertEqual(self.index.count_overlapping(datetime.date(2012, 2, 1), datetime.date(2012, 3, 31)), 4)
+    
+    def test_containing(self):
+        self.assertEqual(self.index.containing(datetime.datetime(2012, 3, 1, 10, 30)), ['a.tif'])
+        self.assertEqual(self.index.containing(datetime.datetime(2012, 3, 6)), ['a.tif'])
+        self.assertEqual(self.index.containing(datetime.datetime(2012, 3, 1, 12)), [])
+    
+    def test_remove(self):
+        self.index.remove('a.tif')
+        self.assertEqual(self.index.overlapping(datetime.date(2012, 3, 1), datetime.date(2012, 3, 5)), [])
+        self.assertEqual(len(self.index), 2)
+
+class AVMHashIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AVMHashIndex()
+        self.index.add('a.tif', {'ID': 'heic0817a', 'DatasetID': ['HST123', 'SSC123']})
+        self.index.add('b.tif', {'ID': 'heic0817b', 'DatasetID': ['HST123'], 'PublisherID': 'vamp://esahubble'})
+        
+    def tearDown(self):
+        pass
+    
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('ID', 'heic0817a'), ['a.tif'])
+        self.assertEqual(sorted(self.index.lookup('DatasetID', 'HST123')), ['a.tif', 'b.tif'])
+        self.assertEqual(self.index.lookup('ResourceID', 'unknown'), [])
+        self.assertRaises(KeyError, self.index.lookup, 'Title', 'Lorem ipsum')
+    
+    def test_lookup_many(self):
+        results = self.index.lookup_many('DatasetID', ['SSC123', 'CFA123'])
+        self.assertEqual(results, {'SSC123': ['a.tif']})
+    
+    def test_remove(self):
+        self.index.add('a.tif', {'ID': 'heic0817c'})
+        self.assertEqual(self.index.lookup('ID', 'heic0817a'), [])
+        self.assertEqual(self.index.lookup('DatasetID', 'HST123'), ['b.tif'])
+        
+        self.index.remove('b.tif')
+        self.assertEqual(self.index.lookup('DatasetID', 'HST123'), [])
+        self.assertEqual(len(self.index), 1)
+
+class AVMRefreshTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.file_paths = []
+        for name in ('a', 'b', 'c'):
+            file_path = os.path.join(self.tempdir, '%s.jpg' % name)
+            with open(file_path, 'wb') as f:
+                f.write('\xff\xd8\xff\xe0' + '\0' * 64)
+            avm_to_file(file_path, {'ID': 'heic%s' % name, 'Title': 'Nebula %s' % name}, replace=True)
+            self.file_paths.append(file_path)
+        self.hash_index = AVMHashIndex()
+        self.text_index = AVMTextIndex()
+        
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+    
+    def touch(self, file_path, avm_dict):
+        avm_to_file(file_path, avm_dict)
+        mtime = os.stat(file_path).st_mtime + 10
+        os.utime(file_path, (mtime, mtime))
+    
+    def test_refresh_indexes(self):
+        a, b, c = self.file_paths
+        indexes = [self.hash_index, self.text_index]
+        # Each file is read once for both indexes
+        self.assertEqual(refresh_indexes(indexes, self.file_paths), 3)
+        self.assertEqual(self.hash_index.lookup('ID', 'heicb'), [b])
+        self.assertEqual([key for key, score in self.text_index.search('nebula')].count(b), 1)
+        
+        # Only the modified file is read again
+        self.touch(b, {'ID': 'heicd', 'Title': 'Galaxy'})
+        self.assertEqual(refresh_indexes(indexes, self.file_paths), 1)
+        self.assertEqual(self.hash_index.lookup('ID', 'heicb'), [])
+        self.assertEqual(self.hash_index.lookup('ID', 'heicd'), [b])
+        self.assertEqual([key for key, score in self.text_index.search('galaxy')], [b])
+        
+        # Deleted files are pruned from every index
+        os.remove(c)
+        self.assertEqual(refresh_indexes(indexes, self.file_paths), 0)
+        for index in indexes:
+            self.assertEqual(sorted(index.keys()), [a, b])
+            self.assertEqual(sorted(index.stamps), [a, b])
+        self.assertEqual(self.hash_index.lookup('ID', 'heicc'), [])
+    
+    def test_refresh(self):
+        self.assertEqual(self.hash_index.refresh(self.file_paths), 3)
+        self.assertEqual(self.hash_index.refresh(self.file_paths), 0)
+        self.assertEqual(self.hash_index.refresh(self.file_paths), 0)
+        self.assertEqual(sorted(self.hash_index.keys()), self.file_paths)
+        
+        # Files left out of file_paths are pruned, unless prune is False
+        self.assertEqual(self.hash_index.refresh(self.file_paths[:2], prune=False), 0)
+        self.assertEqual(len(self.hash_index), 3)
+        self.assertEqual(self.hash_index.refresh(self.file_paths[:2]), 0)
+        self.assertEqual(sorted(self.hash_index.keys()), self.file_paths[:2])
+
+if __name__ == '__main__':
+    unittest.main()
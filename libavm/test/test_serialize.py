@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+import unittest
+
+import datetime
+import StringIO
+
+from libavm.serialize import dump_jsonl, load_jsonl, dump_binary, load_binary
+
+class AVMSerializeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            ('a.tif', {
+                'Title': 'Lorem ipsum',
+                'Contact.Name': ['Sample Name 1', 'Sample Name 2'],
+                'Date': datetime.datetime(2009, 5, 29, 12, 30),
+                'Type': 'Observation',
+                'Spectral.Band': ['Optical', 'Infrared'],
+                'Temporal.StartTime': [datetime.datetime(2012, 3, 1, 10, 0, 0, 500000)],
+                'Spatial.Rotation': 90.0,
+                'Spatial.Scale': [0.001, None],
+            }),
+            ('b.tif', {}),
+        ]
+        
+    def tearDown(self):
+        pass
+    
+    def round_trip(self, dump, load):
+        f = StringIO.StringIO()
+        self.assertEqual(dump(iter(self.records), f), 2)
+        f.seek(0)
+        return list(load(f))
+    
+    def test_jsonl(self):
+        self.assertEqual(self.round_trip(dump_jsonl, load_jsonl), self.records)
+    
+    def test_binary(self):
+        self.assertEqual(self.round_trip(dump_binary, load_binary), self.records)
+    
+    def test_float_strings(self):
+        # Floats read from XMP are strings
+        records = [('a.tif', {'Spatial.Scale': ['0.001', '-'], 'Spatial.Rotation': '90.0', 'Spatial.ReferenceValue': ['0.0', '-5.39']})]
+        expected = [('a.tif', {'Spatial.Scale': [0.001, None], 'Spatial.Rotation': 90.0, 'Spatial.ReferenceValue': [0.0, -5.39]})]
+        
+        for dump, load in ((dump_jsonl, load_jsonl), (dump_binary, load_binary)):
+            f = StringIO.StringIO()
+            dump(records, f)
+            f.seek(0)
+            self.assertEqual(list(load(f)), expected)
+
+if __name__ == '__main__':
+    unittest.main()
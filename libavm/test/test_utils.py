@@ -34,10 +34,20 @@ import unittest
 import sys
 import os
 import os.path
+import gc
+import time
+import struct
+import hashlib
+import shutil
+import weakref
+import threading
+import tempfile
 
 sys.path.append(os.path.pardir)
 
-from libavm.utils import avm_from_file, avm_to_file
+from libavm.utils import avm_from_file, avm_obj_from_file, avm_to_file, enable_cache, disable_cache, AVMSharedStore, \
+    sidecar_path, sync_sidecars, AVMWriteBehind, XMPSession, AVMSessionPool, handle_stats
+from libavm import AVMMeta
 import datetime
 
 from samples import samplefiles, open_flags, sampledir, make_temp_samples, remove_temp_samples
@@ -115,6 +125,7 @@ class AVMUtilsTestCase(unittest.TestCase):
         }
         
     def tearDown(self):
+        disable_cache()
         remove_temp_samples()
         
     def test_avm_to_file(self):
@@ -136,5 +147,283 @@ class AVMUtilsTestCase(unittest.TestCase):
             print missing
             """
 
+    def test_cache(self):
+        cache = enable_cache(maxsize=4)
+        for f in samplefiles.iteritems():
+            avm_to_file(f[0], {'Title': 'Lorem ipsum'}, replace=True)
+            self.assertEqual(avm_from_file(f[0]), {'Title': 'Lorem ipsum'}, f[0])
+            self.assertEqual(avm_from_file(f[0]), {'Title': 'Lorem ipsum'}, f[0])
+            
+            # Writing invalidates the cached entry
+            avm_to_file(f[0], {'Title': 'Dolor sit amet'}, replace=True)
+            self.assertEqual(avm_from_file(f[0]), {'Title': 'Dolor sit amet'}, f[0])
+        
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], len(samplefiles))
+        self.assertEqual(stats['misses'], 2 * len(samplefiles))
+        self.assertTrue(stats['size'] <= 4)
+        
+        # Returned objects are copies
+        avm = avm_obj_from_file(f[0])
+        avm['Title'] = 'Consectetur'
+        self.assertEqual(avm_obj_from_file(f[0])['Title'], 'Dolor sit amet', f[0])
+        
+        # Strategies are cached separately, and validated on hits too
+        cache.clear()
+        avm_from_file(f[0], strategy='onlyxmp')
+        avm_from_file(f[0], strategy='default')
+        avm_from_file(f[0], strategy='default')
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 2))
+        self.assertRaises(ValueError, avm_from_file, f[0], 'lorem')
+
+    def test_read_strategies(self):
+        for f in samplefiles.iteritems():
+            avm_to_file(f[0], {'Title': 'Lorem ipsum'}, replace=True)
+            for strategy in ('auto', 'default', 'onlyxmp'):
+                self.assertEqual(avm_from_file(f[0], strategy=strategy), {'Title': 'Lorem ipsum'}, (f[0], strategy))
+        
+        self.assertRaises(ValueError, avm_from_file, f[0], 'lorem')
+
+    def test_sync_sidecars(self):
+        file_paths = sorted(samplefiles)
+        for file_path in file_paths:
+            avm_to_file(file_path, {'Title': 'Lorem ipsum'}, replace=True)
+            self.assertTrue(avm_to_file(file_path, {'Headline': 'Dolor sit amet'}, sidecar=True), file_path)
+            self.assertEqual(avm_from_file(file_path), {'Title': 'Lorem ipsum'}, file_path)
+            self.assertEqual(avm_from_file(file_path, sidecar=True), {'Title': 'Lorem ipsum', 'Headline': 'Dolor sit amet'}, file_path)
+        
+        results = sync_sidecars(file_paths, remove=True)
+        self.assertEqual([status for file_path, status in results], ['embedded'] * len(file_paths))
+        for file_path in file_paths:
+            self.assertFalse(os.path.exists(sidecar_path(file_path)), file_path)
+            self.assertEqual(avm_from_file(file_path), {'Title': 'Lorem ipsum', 'Headline': 'Dolor sit amet'}, file_path)
+
+    def test_sessions(self):
+        file_paths = sorted(samplefiles)
+        open_handles = handle_stats()['open']
+        
+        with AVMSessionPool(maxsize=2) as pool:
+            for i in range(2):
+                for file_path in file_paths:
+                    with pool.session(file_path) as session:
+                        avm = AVMMeta(xmp=session.get_xmp())
+                        avm['Title'] = 'Lorem ipsum %d' % i
+                        self.assertTrue(session.put_xmp(avm.xmp), file_path)
+                    self.assertTrue(handle_stats()['open'] <= open_handles + 2)
+            
+            # Sessions are reused while they stay in the pool
+            with pool.session(file_paths[-1]) as session:
+                pass
+            self.assertEqual(pool.stats()['hits'], 1)
+            self.assertEqual(pool.stats()['evictions'], 2 * len(file_paths) - 2)
+        
+        self.assertEqual(handle_stats()['open'], open_handles)
+        for file_path in file_paths:
+            self.assertEqual(avm_from_file(file_path)['Title'], 'Lorem ipsum 1', file_path)
+        
+        # Handles are closed when the block raises
+        try:
+            with XMPSession(file_paths[0], open_forupdate=True) as session:
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(session.closed)
+        self.assertEqual(handle_stats()['open'], open_handles)
+        
+        # Pools not closed write their changes when collected
+        pool = AVMSessionPool()
+        with pool.session(file_paths[0]) as session:
+            avm = AVMMeta(xmp=session.get_xmp())
+            avm['Title'] = 'Dolor sit amet'
+            session.put_xmp(avm.xmp)
+        del pool, session
+        gc.collect()
+        self.assertEqual(handle_stats()['open'], open_handles)
+        self.assertEqual(avm_from_file(file_paths[0])['Title'], 'Dolor sit amet')
+
+class AVMSidecarTestCase(unittest.TestCase):
+    """ Class to test reading and writing sidecar files """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tempdir, 'mosaic.tif')
+        with open(self.file_path, 'wb') as f:
+            f.write('II*\0' + '\0' * 64)
+        
+    def tearDown(self):
+        disable_cache()
+        shutil.rmtree(self.tempdir)
+    
+    def test_sidecar_path(self):
+        self.assertEqual(sidecar_path('/a/mosaic.tif'), '/a/mosaic.tif.xmp')
+    
+    def test_sidecar_shared_name(self):
+        other_path = os.path.join(self.tempdir, 'mosaic.png')
+        with open(other_path, 'wb') as f:
+            f.write('\x89PNG\r\n\x1a\n' + '\0' * 64)
+        
+        self.assertTrue(avm_to_file(self.file_path, {'Title': 'Lorem ipsum'}, replace=True, sidecar=True))
+        self.assertNotEqual(sidecar_path(self.file_path), sidecar_path(other_path))
+        self.assertEqual(avm_from_file(other_path, sidecar=True), {})
+        self.assertEqual(sync_sidecars([other_path]), [(other_path, 'skipped')])
+    
+    def test_sidecar_unreadable(self):
+        file_path = os.path.join(self.tempdir, 'broken.tif')
+        with open(file_path, 'wb') as f:
+            f.write('Lorem ipsum' + '\0' * 64)
+        
+        self.assertFalse(avm_to_file(file_path, {'Title': 'Lorem ipsum'}, sidecar=True))
+        self.assertFalse(os.path.exists(sidecar_path(file_path)))
+    
+    def test_sidecar(self):
+        self.assertTrue(avm_to_file(self.file_path, {'Title': 'Lorem ipsum'}, replace=True, sidecar=True))
+        self.assertTrue(os.path.exists(os.path.join(self.tempdir, 'mosaic.tif.xmp')))
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Lorem ipsum'})
+        
+        cache = enable_cache()
+        self.assertTrue(avm_to_file(self.file_path, {'Headline': 'Dolor sit amet'}, sidecar=True))
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Lorem ipsum', 'Headline': 'Dolor sit amet'})
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Lorem ipsum', 'Headline': 'Dolor sit amet'})
+        self.assertEqual(cache.stats()['hits'], 1)
+        
+        # A sidecar older than its file, or as old, is stale
+        stamp = os.stat(self.file_path).st_mtime
+        os.utime(sidecar_path(self.file_path), (stamp, stamp))
+        self.assertEqual(sync_sidecars([self.file_path]), [(self.file_path, 'skipped')])
+        os.utime(sidecar_path(self.file_path), (stamp - 60, stamp - 60))
+        self.assertEqual(sync_sidecars([self.file_path]), [(self.file_path, 'skipped')])
+        self.assertFalse(avm_to_file(os.path.join(self.tempdir, 'missing.tif'), {'Title': 'Lorem ipsum'}, sidecar=True))
+
+    def test_write_behind(self):
+        errors = []
+        queue = AVMWriteBehind(delay=60, sidecar=True, on_error=lambda *args: errors.append(args))
+        queue.write(self.file_path, {'Title': 'Lorem ipsum'}, replace=True)
+        queue.write(self.file_path, {'Headline': 'Dolor sit amet'})
+        queue.write(self.file_path, {'Title': 'Consectetur'})
+        self.assertEqual(queue.pending(self.file_path), {'Title': 'Consectetur', 'Headline': 'Dolor sit amet'})
+        
+        # Merged edits are written once
+        queue.flush()
+        self.assertEqual(queue.pending(self.file_path), None)
+        self.assertEqual((queue.edits, queue.writes), (3, 1))
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Consectetur', 'Headline': 'Dolor sit amet'})
+        
+        queue.write(self.file_path, {'Title': 'Adipiscing'})
+        queue.write(os.path.join(self.tempdir, 'missing.tif'), {'Title': 'Lorem ipsum'})
+        queue.close()
+        self.assertEqual((queue.edits, queue.writes, queue.errors), (5, 3, 1))
+        self.assertEqual(errors, [(os.path.join(self.tempdir, 'missing.tif'), None)])
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True)['Title'], 'Adipiscing')
+        self.assertRaises(ValueError, queue.write, self.file_path, {})
+    
+    def test_write_behind_delay(self):
+        with AVMWriteBehind(delay=0.01, sidecar=True) as queue:
+            queue.write(self.file_path, {'Title': 'Lorem ipsum'})
+            
+            # Written by the timer thread, without flush()
+            deadline = time.time() + 30
+            while queue.writes == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(queue.writes, 1)
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Lorem ipsum'})
+    
+    def test_write_behind_max_pending(self):
+        with AVMWriteBehind(delay=60, max_pending=2, sidecar=True) as queue:
+            queue.write(self.file_path, {'Title': 'Lorem ipsum'})
+            queue.write(os.path.join(self.tempdir, 'other.tif'), {'Title': 'Lorem ipsum'})
+            # Both files were handed to the writers
+            self.assertEqual(queue.pending(self.file_path), None)
+            queue.write(self.file_path, {'Title': 'Dolor sit amet'})
+            self.assertEqual(queue.pending(self.file_path), {'Title': 'Dolor sit amet'})
+        self.assertEqual(queue.writes, 3)
+        self.assertEqual(avm_from_file(self.file_path, sidecar=True), {'Title': 'Dolor sit amet'})
+    
+    def test_write_behind_collected(self):
+        queue = AVMWriteBehind(delay=60)
+        ref = weakref.ref(queue)
+        timer = queue._timer
+        del queue
+        gc.collect()
+        self.assertEqual(ref(), None)
+        timer.join(30)
+        self.assertFalse(timer.is_alive())
+
+class AVMSharedStoreTestCase(unittest.TestCase):
+    """ Class to test the shared cache tier """
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.file_path)
+        self.store = AVMSharedStore(self.file_path, slots=16, slot_size=1024)
+        
+    def tearDown(self):
+        os.remove(self.file_path)
+    
+    def test_get_set(self):
+        self.store.set('/a.tif', (10, 1.0), 'packet a')
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), 'packet a')
+        # Stale stamp
+        self.assertEqual(self.store.get('/a.tif', (10, 2.0)), None)
+        self.assertEqual(self.store.get('/b.tif', (10, 1.0)), None)
+        
+        self.store.delete('/a.tif')
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), None)
+    
+    def test_shared(self):
+        store = AVMSharedStore(self.file_path)
+        self.assertEqual(store.slots, 16)
+        store.set('/a.tif', (10, 1.0), 'packet a')
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), 'packet a')
+    
+    def test_delete_then_set(self):
+        # With two slots, paths whose candidate slots differ compete for both
+        os.remove(self.file_path)
+        store = AVMSharedStore(self.file_path, slots=2, slot_size=1024)
+        paths = [path for path in ['/%d.tif' % i for i in range(100)]
+            if len(set(store._candidates(hashlib.md5(path).digest()))) == 2][:3]
+        a, b, c = paths
+        
+        store.set(a, (10, 1.0), 'packet a')
+        store.set(b, (10, 1.0), 'packet b')
+        self.assertEqual((store.get(a, (10, 1.0)), store.get(b, (10, 1.0))), ('packet a', 'packet b'))
+        
+        # The slot freed by delete() is reused rather than evicting b
+        store.delete(a)
+        store.set(c, (10, 1.0), 'packet c')
+        self.assertEqual(store.get(b, (10, 1.0)), 'packet b')
+        self.assertEqual(store.get(c, (10, 1.0)), 'packet c')
+    
+    def test_too_large(self):
+        self.store.set('/a.tif', (10, 1.0), 'x' * 1024)
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), None)
+    
+    def test_threads(self):
+        def write(i):
+            for j in range(200):
+                self.store.set('/%d.tif' % (j % 8), (10, 1.0), 'packet %d' % i)
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        for j in range(8):
+            self.assertTrue(self.store.get('/%d.tif' % j, (10, 1.0)) in ['packet %d' % i for i in range(4)])
+        for i in range(self.store.slots):
+            offset = self.store.header_size + i * self.store.slot_size
+            self.assertEqual(struct.unpack_from('<Q', self.store.mmap, offset)[0] % 2, 0)
+    
+    def test_interrupted_write(self):
+        self.store.set('/a.tif', (10, 1.0), 'packet a')
+        offset = [offset for offset in self.store._candidates(hashlib.md5('/a.tif').digest())
+            if self.store._read_slot(offset)[0][1] == hashlib.md5('/a.tif').digest()][0]
+        
+        # A writer died after marking the slot as being written
+        sequence = struct.unpack_from('<Q', self.store.mmap, offset)[0]
+        struct.pack_into('<Q', self.store.mmap, offset, sequence + 1)
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), None)
+        
+        self.store.set('/a.tif', (10, 1.0), 'packet b')
+        self.assertEqual(self.store.get('/a.tif', (10, 1.0)), 'packet b')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
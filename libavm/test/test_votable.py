@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+import unittest
+
+import datetime
+import StringIO
+from xml.dom import minidom
+
+from libavm.votable import AVMVOTableWriter, field_metadata
+from libavm.specs import SPECS_1_1
+
+class AVMVOTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = ['Title', 'Spatial.Rotation', 'Spatial.Scale', 'Spectral.Band', 'Date']
+        self.records = [
+            ('a.jpg', {
+                'Title': u'Orion & M42',
+                'Spatial.Rotation': '90.0',
+                'Spatial.Scale': ['0.001', '-0.002'],
+                'Spatial.ReferenceValue': ['83.8', '-5.4'],
+                'Spatial.ReferenceDimension': ['1000', '500'],
+                'Spectral.Band': ['Optical', 'Infrared'],
+                'Date': datetime.datetime(2010, 1, 1, 12),
+            }),
+            ('b.jpg', {'Spatial.Scale': ['0.001', '-']}),
+        ]
+
+    def test_field_metadata(self):
+        self.assertEqual(field_metadata('Spatial.Rotation', SPECS_1_1['Spatial.Rotation']),
+            {'name': 'Spatial.Rotation', 'datatype': 'double', 'ucd': 'pos.posAng', 'unit': 'deg'})
+        self.assertEqual(field_metadata('Spatial.Scale', SPECS_1_1['Spatial.Scale'])['arraysize'], '2')
+        self.assertEqual(field_metadata('Spectral.Band', SPECS_1_1['Spectral.Band'])['datatype'], 'char')
+        self.assertEqual(field_metadata('Date', SPECS_1_1['Date'])['xtype'], 'timestamp')
+        self.assertEqual(field_metadata('Temporal.StartTime', SPECS_1_1['Temporal.StartTime']),
+            {'name': 'Temporal.StartTime', 'datatype': 'char', 'arraysize': '*', 'ucd': 'time.start'})
+
+    def test_write(self):
+        stream = StringIO.StringIO()
+        writer = AVMVOTableWriter(stream, fields=self.fields, chunk_size=1)
+        writer.write_records(self.records)
+        writer.close()
+        self.assertEqual(writer.num_rows, 2)
+
+        document = minidom.parseString(stream.getvalue())
+        names = [field.getAttribute('name') for field in document.getElementsByTagName('FIELD')]
+        self.assertEqual(names, ['key', 's_ra', 's_dec', 's_fov'] + self.fields)
+
+        rows = [[(cell.firstChild.data if cell.firstChild else '') for cell in row.getElementsByTagName('TD')]
+            for row in document.getElementsByTagName('TR')]
+        self.assertEqual(rows[0], ['a.jpg', '83.8', '-5.4', '1.0', 'Orion & M42', '90.0', '0.001 -0.002', 'Optical;Infrared', '2010-01-01T12:00:00'])
+        self.assertEqual(rows[1], ['b.jpg', '', '', '', '', '', '0.001 NaN', '', ''])
+
+    def test_write_zero_and_frames(self):
+        records = [
+            ('a.jpg', {'Spatial.Rotation': 0.0, 'Spatial.ReferenceValue': ['0.0', '-5.39'], 'Spatial.CoordinateFrame': 'FK5'}),
+            ('b.jpg', {'Spatial.ReferenceValue': ['209.0', '-1.7'], 'Spatial.CoordinateFrame': 'GAL'}),
+        ]
+        stream = StringIO.StringIO()
+        writer = AVMVOTableWriter(stream, fields=['Spatial.Rotation'])
+        writer.write_records(records)
+        writer.close()
+
+        document = minidom.parseString(stream.getvalue())
+        rows = [[(cell.firstChild.data if cell.firstChild else '') for cell in row.getElementsByTagName('TD')]
+            for row in document.getElementsByTagName('TR')]
+        self.assertEqual(rows[0], ['a.jpg', '0.0', '-5.39', '', '0.0'])
+        # Galactic coordinates are not right ascension and declination
+        self.assertEqual(rows[1], ['b.jpg', '', '', '', ''])
+
+if __name__ == '__main__':
+    unittest.main()
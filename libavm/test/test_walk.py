@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2009, European Space Agency & European Southern Observatory (ESA/ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+# 
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#      * Neither the name of the European Space Agency, European Southern 
+#        Observatory nor the names of its contributors may be used to endorse or 
+#        promote products derived from this software without specific prior 
+#        written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY ESA/ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESA/ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+import libavm.walk
+import libavm.utils
+import libavm.filetypes
+from libavm.walk import walk_files, iter_avm, read_tree
+from libavm.filetypes import file_type, sniff, classify, open_flags
+
+class AVMWalkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        files = {
+            'a.jpg': '\xff\xd8\xff\xe0' + '\0' * 64,
+            'b/c.PNG': '\x89PNG\r\n\x1a\n' + '\0' * 64,
+            'b/d/e.tif': 'II*\0' + '\0' * 64,
+            'b/d/error.jpg': '<html>Not found</html>',
+            'b/f.mov': '\0\0\0\x14ftypqt  ',
+            'b/notes.txt': 'Lorem ipsum',
+            'b/empty.gif': '',
+        }
+        for name, content in files.items():
+            path = os.path.join(self.tempdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def names(self, paths):
+        return sorted([os.path.relpath(path, self.tempdir) for path in paths])
+
+    def test_file_type(self):
+        self.assertEqual(sniff(os.path.join(self.tempdir, 'b/c.PNG')), 'png')
+        self.assertEqual(file_type(os.path.join(self.tempdir, 'b/d/e.tif')), 'tiff')
+        self.assertEqual(file_type(os.path.join(self.tempdir, 'b/d/error.jpg')), None)
+        self.assertEqual(file_type(os.path.join(self.tempdir, 'b/d/error.jpg'), sniff_content=False), 'jpeg')
+        self.assertEqual(file_type(os.path.join(self.tempdir, 'b/f.mov')), 'mov')
+        self.assertEqual(file_type(os.path.join(self.tempdir, 'b/notes.txt')), None)
+
+    def test_classify(self):
+        def classify_data(name, content):
+            path = os.path.join(self.tempdir, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            return classify(path)
+
+        self.assertEqual(classify_data('a.ai', '%PDF-1.5\n' + ' ' * 100), ('illustrator', None))
+        self.assertEqual(classify_data('preamble.pdf', 'Content-Type: application/pdf\r\n\r\n%PDF-1.4\n' + ' ' * 100), ('pdf', None))
+        self.assertEqual(classify_data('late.pdf', ' ' * 1024 + '%PDF-1.4\n' + ' ' * 100)[1], 'Content does not match the pdf format')
+        self.assertEqual(classify_data('a.psd', '8BPS' + '\0' * 100), ('photoshop', None))
+        self.assertEqual(classify_data('a.avi', 'RIFF\0\0\0\0AVI LIST' + '\0' * 100), ('avi', None))
+        self.assertEqual(classify_data('a.xmp', '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'), ('xmp', None))
+        self.assertEqual(classify_data('png.jpg', '\x89PNG\r\n\x1a\n' + '\0' * 100), ('png', None))
+        self.assertEqual(classify_data('noextension', 'GIF89a' + '\0' * 100), ('gif', None))
+        self.assertEqual(classify_data('a.png', '\x89PNG\r\n\x1a\n'), ('png', 'File is truncated'))
+        self.assertEqual(classify(os.path.join(self.tempdir, 'b/empty.gif')), (None, 'Empty file'))
+        self.assertEqual(classify(os.path.join(self.tempdir, 'b/d/error.jpg'))[1], 'Content does not match the jpeg format')
+        self.assertEqual(classify(os.path.join(self.tempdir, 'missing.jpg'))[0], None)
+
+        self.assertEqual(open_flags('jpeg'), {'open_read': True, 'open_onlyxmp': True, 'open_usesmarthandler': True})
+        self.assertEqual(open_flags('pdf', for_update=True), {'open_forupdate': True, 'open_usepacketscanning': True})
+        self.assertEqual(open_flags(None), {'open_read': True, 'open_onlyxmp': True})
+
+    def test_walk_files(self):
+        self.assertEqual(self.names(walk_files(self.tempdir)), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/f.mov'])
+        self.assertEqual(self.names(walk_files(self.tempdir, sniff=False)), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/d/error.jpg', 'b/empty.gif', 'b/f.mov'])
+        self.assertEqual(self.names(walk_files(self.tempdir, extensions=set(['.jpg']))), ['a.jpg'])
+
+        # Sidecars are not counted as files, unlike standalone XMP packets
+        for name in ('a.jpg.xmp', 'b/g.xmp'):
+            with open(os.path.join(self.tempdir, name), 'wb') as f:
+                f.write('<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>')
+        self.assertEqual(self.names(walk_files(self.tempdir)), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/f.mov', 'b/g.xmp'])
+        self.assertEqual(self.names(walk_files(self.tempdir, sniff=False)), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/d/error.jpg', 'b/empty.gif', 'b/f.mov', 'b/g.xmp'])
+
+        errors = []
+        self.assertEqual(list(walk_files(os.path.join(self.tempdir, 'missing'), onerror=errors.append)), [])
+        self.assertEqual(len(errors), 1)
+
+    def test_iter_avm(self):
+        produced = []
+
+        def file_paths():
+            for i in range(1000):
+                produced.append(i)
+                yield 'file%d' % i
+
+        results = iter_avm(file_paths(), workers=2, queue_size=4, reader=len)
+        for i in range(10):
+            results.next()
+        # Paths are only read ahead as far as the queues allow
+        self.assert_(len(produced) <= 10 + 4 + 4 + 2 + 1)
+        results.close()
+
+        results = dict(iter_avm(file_paths(), workers=3, reader=lambda path: 1 / (path != 'file7')))
+        self.assertEqual(len(results), 1000)
+        self.assertEqual(results['file7'], None)
+        self.assertEqual(results['file8'], 1)
+
+    def test_read_tree(self):
+        calls = []
+        classify = libavm.filetypes.classify
+        
+        def counting_classify(file_path):
+            calls.append(file_path)
+            return classify(file_path)
+        
+        libavm.walk.classify = libavm.utils.classify = counting_classify
+        try:
+            results = dict(read_tree(self.tempdir, workers=2))
+        finally:
+            libavm.walk.classify = libavm.utils.classify = classify
+        
+        self.assertEqual(self.names(results), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/f.mov'])
+        # Files are classified once, by the walk
+        self.assertEqual(self.names(calls), ['a.jpg', 'b/c.PNG', 'b/d/e.tif', 'b/d/error.jpg', 'b/empty.gif', 'b/f.mov'])
+
+if __name__ == '__main__':
+    unittest.main()